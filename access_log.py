@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Аналитика access-лога Xray с инкрементальной агрегацией
+
+Лог читается через mmap пачками по BATCH_SIZE байт (до последнего полного перевода
+строки), строки пачки разбираются одним проходом регулярного выражения по байтам.
+Агрегаты пачки (подключения и отклоненные подключения пользователей, адреса
+назначения, адреса клиентов) и смещение в файле записываются в базу SQLite
+`*_access.db` одной транзакцией, поэтому повторный запуск обрабатывает только новые
+байты, а прерванный запуск не учитывает пачку дважды. Ротация лога определяется
+по смене inode или уменьшению файла - тогда чтение начинается с начала.
+"""
+
+import mmap
+import os
+import re
+import time
+from collections import Counter
+
+BATCH_SIZE = 16 * 1024 * 1024
+NO_USER = ""
+
+# Время, адреса клиента и назначения без портов, результат и остаток строки (маршрут, email или
+# причина отказа). Остаток разбирается отдельно по различным значениям: их немного, а регулярное
+# выражение без необязательной группы в конце строки работает в несколько раз быстрее
+_HOST = rb"(\[[^\]\s]*\]|[^\s:\[]+)(?::\d+)?"
+ACCESS_LINE_RE = re.compile(
+    rb"^(\d{4}/\d\d/\d\d \d\d:\d\d:\d\d)\S* (?:from )?(?:(?:tcp|udp):)?" + _HOST +
+    rb" (accepted|rejected) +(?:(?:tcp|udp):)?" + _HOST + rb"([^\n]*)",
+    re.MULTILINE
+)
+
+
+def _email(rest):
+    """Email из остатка строки access-лога ("[inbound -> outbound] email: user"), пустой без email"""
+    _, separator, email = rest.rpartition(b" email: ")
+    return email.split()[0] if separator and email.strip() else b""
+
+
+def get_access_stats_path(config_path):
+    """Путь к базе агрегатов access-лога для файла конфигурации"""
+    base_path, _ = os.path.splitext(config_path)
+    return f"{base_path}_access.db"
+
+
+def _host(address):
+    """Адрес из лога в строку: квадратные скобки IPv6 убираются"""
+    return address.decode('utf-8', 'replace').strip("[]")
+
+
+def aggregate(data):
+    """Агрегаты строк access-лога из байтов
+
+    Возвращает (users, destinations, sources, lines): users - {email: [подключения,
+    отклоненные, первое время, последнее время]}, destinations и sources - Counter
+    по парам (email, host). Строки без email учитываются под пустым именем.
+
+    Строки пачки разбираются одним вызовом findall, а подсчет ведется по столбцам
+    через Counter и dict, поэтому цикл на Python идет только по различным значениям.
+    """
+    rows = ACCESS_LINE_RE.findall(data)
+    if not rows:
+        return {}, Counter(), Counter(), 0
+    times, source_addresses, statuses, destination_addresses, rests = zip(*rows)
+    emails_by_rest = {rest: _email(rest) for rest in set(rests)}
+    emails = tuple(map(emails_by_rest.__getitem__, rests))
+
+    # Строки лога идут по времени: последнее вхождение email - последнее подключение
+    first_seen = dict(zip(reversed(emails), reversed(times)))
+    last_seen = dict(zip(emails, times))
+    connections = Counter(emails)
+    rejected = Counter(email for email, status in zip(emails, statuses) if status == b"rejected")
+
+    users = {}
+    for email, count in connections.items():
+        users[email.decode('utf-8', 'replace')] = [
+            count, rejected[email], first_seen[email].decode('ascii'), last_seen[email].decode('ascii')
+        ]
+
+    destinations = Counter()
+    # У отклоненных подключений вместо адреса назначения - причина отказа
+    for (email, address), count in Counter(
+            pair for pair, status in zip(zip(emails, destination_addresses), statuses) if status == b"accepted"
+    ).items():
+        if address:
+            destinations[email.decode('utf-8', 'replace'), _host(address)] += count
+
+    sources = Counter()
+    for (email, address), count in Counter(zip(emails, source_addresses)).items():
+        sources[email.decode('utf-8', 'replace'), _host(address)] += count
+
+    return users, destinations, sources, len(rows)
+
+
+class AccessLogAnalyzer:
+    """Инкрементальная обработка access-лога и отчеты по накопленным агрегатам"""
+
+    def __init__(self, log_path, db_path, batch_size=BATCH_SIZE):
+        self.log_path = log_path
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._connection = None
+
+    def exists(self):
+        return os.path.exists(self.db_path)
+
+    @property
+    def connection(self):
+        """Ленивое открытие базы и создание схемы"""
+        if self._connection is None:
+            import sqlite3
+            self._connection = sqlite3.connect(self.db_path)
+            self._connection.executescript("""
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS checkpoint (key TEXT PRIMARY KEY, value) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+                CREATE TABLE IF NOT EXISTS users (
+                    name_id INTEGER PRIMARY KEY,
+                    connections INTEGER NOT NULL,
+                    rejected INTEGER NOT NULL,
+                    first_seen TEXT NOT NULL,
+                    last_seen TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS destinations (
+                    name_id INTEGER NOT NULL,
+                    host TEXT NOT NULL,
+                    connections INTEGER NOT NULL,
+                    PRIMARY KEY (name_id, host)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS sources (
+                    name_id INTEGER NOT NULL,
+                    host TEXT NOT NULL,
+                    connections INTEGER NOT NULL,
+                    PRIMARY KEY (name_id, host)
+                ) WITHOUT ROWID;
+            """)
+        return self._connection
+
+    def _checkpoint(self):
+        """Сохраненная позиция: (inode, смещение)"""
+        values = dict(self.connection.execute("SELECT key, value FROM checkpoint"))
+        return values.get("inode"), values.get("offset", 0)
+
+    def _name_ids(self, names):
+        """ID имен пользователей, новые имена добавляются"""
+        connection = self.connection
+        connection.executemany("INSERT OR IGNORE INTO names (name) VALUES (?)", [(name,) for name in names])
+        ids = {}
+        for name in names:
+            ids[name] = connection.execute("SELECT id FROM names WHERE name = ?", (name,)).fetchone()[0]
+        return ids
+
+    def _store(self, users, destinations, sources, inode, offset):
+        """Запись агрегатов пачки и новой позиции одной транзакцией"""
+        with self.connection as connection:
+            ids = self._name_ids(list(users))
+            connection.executemany(
+                """INSERT INTO users (name_id, connections, rejected, first_seen, last_seen) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (name_id) DO UPDATE SET
+                       connections = connections + excluded.connections, rejected = rejected + excluded.rejected,
+                       last_seen = MAX(last_seen, excluded.last_seen)""",
+                [(ids[name], *entry) for name, entry in users.items()]
+            )
+            for table, counter in (("destinations", destinations), ("sources", sources)):
+                connection.executemany(
+                    f"""INSERT INTO {table} (name_id, host, connections) VALUES (?, ?, ?)
+                        ON CONFLICT (name_id, host) DO UPDATE SET connections = connections + excluded.connections""",
+                    [(ids[name], host, count) for (name, host), count in counter.items()]
+                )
+            connection.executemany(
+                "INSERT OR REPLACE INTO checkpoint (key, value) VALUES (?, ?)",
+                [("inode", inode), ("offset", offset), ("updated", time.time())]
+            )
+
+    def update(self):
+        """Обработка байтов, добавленных после сохраненной позиции
+
+        Возвращает (обработано байт, разобрано строк). Незавершенная последняя строка
+        остается до следующего запуска.
+        """
+        with open(self.log_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            inode, offset = self._checkpoint()
+            if inode != stat.st_ino or offset > stat.st_size:
+                offset = 0
+            if stat.st_size == offset:
+                return 0, 0
+
+            processed = lines = 0
+            with mmap.mmap(f.fileno(), stat.st_size, access=mmap.ACCESS_READ) as data:
+                while offset < stat.st_size:
+                    end = min(offset + self.batch_size, stat.st_size)
+                    newline = data.rfind(b"\n", offset, end)
+                    if newline < 0:
+                        if end == stat.st_size:
+                            break
+                        # Строка длиннее пачки пропускается целиком
+                        newline = data.find(b"\n", end)
+                        if newline < 0:
+                            break
+                        users, destinations, sources, count = {}, Counter(), Counter(), 0
+                    else:
+                        users, destinations, sources, count = aggregate(data[offset:newline + 1])
+
+                    self._store(users, destinations, sources, stat.st_ino, newline + 1)
+                    processed += newline + 1 - offset
+                    lines += count
+                    offset = newline + 1
+        return processed, lines
+
+    def top(self, limit=10, order="connections"):
+        """Пользователи по метрике: список (email, подключения, отклоненные, адресов назначения, адресов клиентов, последнее подключение)"""
+        if not self.exists():
+            return []
+        order_by = {
+            "connections": "connections", "rejected": "rejected",
+            "destinations": "destination_count", "sources": "source_count",
+        }[order]
+        query = f"""SELECT n.name, u.connections, u.rejected,
+                           (SELECT COUNT(*) FROM destinations d WHERE d.name_id = u.name_id) AS destination_count,
+                           (SELECT COUNT(*) FROM sources s WHERE s.name_id = u.name_id) AS source_count,
+                           u.last_seen
+                    FROM users u JOIN names n ON n.id = u.name_id
+                    WHERE n.name != ?
+                    ORDER BY {order_by} DESC LIMIT ?"""
+        return self.connection.execute(query, (NO_USER, limit)).fetchall()
+
+    def top_destinations(self, limit=10, user=None):
+        """Адреса назначения с наибольшим числом подключений: список (host, подключения)"""
+        if not self.exists():
+            return []
+        if user is None:
+            query = "SELECT host, SUM(connections) AS total FROM destinations GROUP BY host ORDER BY total DESC LIMIT ?"
+            params = (limit,)
+        else:
+            query = """SELECT d.host, d.connections FROM destinations d JOIN names n ON n.id = d.name_id
+                       WHERE n.name = ? ORDER BY d.connections DESC LIMIT ?"""
+            params = (user, limit)
+        return self.connection.execute(query, params).fetchall()
+
+    def summary(self):
+        """Итоги: (подключения, отклоненные, отклоненные без пользователя)"""
+        if not self.exists():
+            return 0, 0, 0
+        total, rejected = self.connection.execute(
+            "SELECT COALESCE(SUM(connections), 0), COALESCE(SUM(rejected), 0) FROM users"
+        ).fetchone()
+        anonymous = self.connection.execute(
+            "SELECT u.rejected FROM users u JOIN names n ON n.id = u.name_id WHERE n.name = ?", (NO_USER,)
+        ).fetchone()
+        return total, rejected, anonymous[0] if anonymous else 0
+
+    def last_seen(self):
+        """Время последнего подключения пользователей: {email: "YYYY/MM/DD HH:MM:SS"}"""
+        if not self.exists():
+            return {}
+        rows = self.connection.execute("SELECT n.name, u.last_seen FROM users u JOIN names n ON n.id = u.name_id")
+        return dict(rows)
+
+    def idle(self, names, seconds):
+        """Пользователи из names без подключений за последние seconds секунд: список (email, последнее подключение или None)
+
+        Время в логе Xray - время контейнера (UTC в официальном образе).
+        """
+        cutoff = time.strftime("%Y/%m/%d %H:%M:%S", time.gmtime(time.time() - seconds))
+        seen = self.last_seen()
+        return [(name, seen.get(name)) for name in names if seen.get(name, "") < cutoff]
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
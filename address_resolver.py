@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Определение внешнего адреса сервера с кэшем в метаданных
+
+Источники задаются строками:
+- `static:<адрес>` - заранее известный адрес или домен;
+- `interface` - публичный адрес одного из локальных интерфейсов;
+- `http:<url>` или просто `<url>` - HTTP-сервис, возвращающий адрес текстом.
+
+Все источники опрашиваются параллельно, побеждает первый успешный ответ.
+"""
+
+import ipaddress
+import socket
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+
+DEFAULT_SOURCES = ["interface", "http:https://api.ipify.org", "http:https://ifconfig.me/ip"]
+DEFAULT_TTL = 3600
+DEFAULT_TIMEOUT = 2.0
+
+
+def _public_ip(address):
+    """Возвращает адрес, если это публичный IP, иначе None"""
+    try:
+        ip = ipaddress.ip_address(address.split('%')[0])
+    except ValueError:
+        return None
+    return str(ip) if ip.is_global else None
+
+
+def resolve_interface(timeout=DEFAULT_TIMEOUT):
+    """Публичный адрес локального интерфейса (без NAT) или None"""
+    candidates = []
+
+    # Адрес интерфейса маршрута по умолчанию: connect для UDP не отправляет пакетов
+    for family, probe in ((socket.AF_INET, "192.0.2.1"), (socket.AF_INET6, "2001:db8::1")):
+        try:
+            with socket.socket(family, socket.SOCK_DGRAM) as sock:
+                sock.connect((probe, 9))
+                candidates.append(sock.getsockname()[0])
+        except OSError:
+            pass
+
+    try:
+        for info in socket.getaddrinfo(socket.gethostname(), None):
+            candidates.append(info[4][0])
+    except OSError:
+        pass
+
+    for candidate in candidates:
+        address = _public_ip(candidate)
+        if address:
+            return address
+    return None
+
+
+def resolve_http(url, timeout=DEFAULT_TIMEOUT):
+    """Адрес от HTTP-сервиса или None"""
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        address = response.read(256).decode('utf-8').strip()
+    try:
+        return str(ipaddress.ip_address(address))
+    except ValueError:
+        return None
+
+
+def resolve_source(source, timeout=DEFAULT_TIMEOUT):
+    """Опрос одного источника адреса"""
+    if source.startswith("static:"):
+        return source[len("static:"):] or None
+    if source == "interface":
+        return resolve_interface(timeout)
+    if source.startswith("http:") and not source.startswith("http://"):
+        source = source[len("http:"):]
+    return resolve_http(source, timeout)
+
+
+class AddressResolver:
+    """Определение внешнего адреса с параллельным опросом источников и кэшем с TTL
+
+    Настройки берутся из ключа `resolver` метаданных, кэш хранится в ключе `address_cache`.
+    """
+
+    def __init__(self, config_manager, sources=None, ttl=None, timeout=None):
+        self.config_manager = config_manager
+        settings = config_manager.user_metadata.get("resolver", {})
+        self.sources = sources or settings.get("sources") or DEFAULT_SOURCES
+        self.ttl = ttl if ttl is not None else settings.get("ttl", DEFAULT_TTL)
+        self.timeout = timeout if timeout is not None else settings.get("timeout", DEFAULT_TIMEOUT)
+
+    def get_cached(self):
+        """Адрес из кэша, если срок его жизни не истек"""
+        cache = self.config_manager.user_metadata.get("address_cache")
+        if cache and cache.get("sources") == self.sources and cache.get("expires", 0) > time.time():
+            return cache["address"]
+        return None
+
+    def resolve(self, refresh=False):
+        """Определение адреса: из кэша или гонкой источников, пустая строка при неудаче"""
+        if not refresh:
+            cached = self.get_cached()
+            if cached:
+                return cached
+
+        address = self.race()
+        if address:
+            self.store(address)
+        return address or ""
+
+    def store(self, address):
+        """Сохранение адреса в кэш метаданных"""
+        self.config_manager.save_metadata_value("address_cache", {
+            "address": address,
+            "sources": self.sources,
+            "expires": time.time() + self.ttl
+        })
+
+    def race(self):
+        """Параллельный опрос всех источников, возвращает первый успешный результат"""
+        executor = ThreadPoolExecutor(max_workers=len(self.sources))
+        futures = {executor.submit(resolve_source, source, self.timeout): source for source in self.sources}
+        try:
+            for future in as_completed(futures, timeout=self.timeout + 1):
+                try:
+                    address = future.result()
+                except Exception as e:
+                    print(f"Ошибка при определении адреса через {futures[future]}: {e}", file=sys.stderr)
+                    continue
+                if address:
+                    return address
+        except TimeoutError:
+            print("Истекло время ожидания источников адреса", file=sys.stderr)
+        finally:
+            # Не ждем медленные источники, их результат уже не нужен
+            executor.shutdown(wait=False, cancel_futures=True)
+        return None
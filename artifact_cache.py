@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Кэш сгенерированных QR-кодов на диске
+
+Артефакт (QR-код в PNG, SVG или тексте) адресуется хэшем своего содержимого - строки,
+закодированной в QR-код (VLESS-ссылки или JSON-конфигурации клиента). В строку уже
+входят UUID и shortId пользователя, ключ, адрес и порт сервера, поэтому при изменении
+любого из них адрес артефакта меняется и старый артефакт больше не используется.
+
+Файлы лежат в директории `<config>_artifacts` с именами `<UUID>.<хэш>.<вид>` (вид -
+формат, для компактных QR-кодов с префиксом, например compact.svg):
+при удалении пользователя его артефакты удаляются по префиксу, при смене ключа
+сервера (файл key) кэш очищается целиком. Размер кэша ограничен, при превышении
+удаляются файлы, к которым дольше всего не обращались (время изменения файла
+обновляется при каждом попадании).
+"""
+
+import hashlib
+import os
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+KINDS = ("png", "svg", "ascii")
+
+
+def get_artifacts_path(config_path):
+    """Директория кэша артефактов для файла конфигурации"""
+    base_path, _ = os.path.splitext(config_path)
+    return f"{base_path}_artifacts"
+
+
+class ArtifactCache:
+    """Кэш артефактов с адресацией по содержимому и вытеснением LRU"""
+
+    def __init__(self, path, public_key=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Размер кэша считается по директории один раз, затем увеличивается при записи
+        self._total = None
+        if public_key is not None:
+            self._check_key(public_key)
+
+    def _check_key(self, public_key):
+        """Очистка кэша, если ключ сервера изменился с момента записи артефактов"""
+        key_path = os.path.join(self.path, "key")
+        try:
+            with open(key_path, 'r') as f:
+                if f.read() == public_key:
+                    return
+        except OSError:
+            pass
+        self.purge()
+        os.makedirs(self.path, exist_ok=True)
+        with open(key_path, 'w') as f:
+            f.write(public_key)
+
+    def _file_path(self, user_id, kind, payload):
+        digest = hashlib.sha256(f"{kind}\n{payload}".encode('utf-8')).hexdigest()[:40]
+        return os.path.join(self.path, f"{user_id}.{digest}.{kind}")
+
+    def get(self, user_id, kind, payload):
+        """Артефакт из кэша или None"""
+        file_path = self._file_path(user_id, kind, payload)
+        try:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            os.utime(file_path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, user_id, kind, payload, data):
+        """Запись артефакта: временный файл и rename, чтобы читатели не видели частичную запись"""
+        os.makedirs(self.path, exist_ok=True)
+        file_path = self._file_path(user_id, kind, payload)
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+        if self._total is not None:
+            self._total += len(data)
+        if self._total is None or self._total > self.max_bytes:
+            self.evict()
+
+    def get_or_create(self, user_id, kind, payload, build):
+        """Артефакт из кэша или результат build(payload), записанный в кэш"""
+        data = self.get(user_id, kind, payload)
+        if data is None:
+            data = build(payload)
+            try:
+                self.put(user_id, kind, payload, data)
+            except OSError:
+                pass
+        return data
+
+    def _entries(self):
+        """Файлы артефактов: список (время обращения, размер, путь)"""
+        entries = []
+        try:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    if entry.name.endswith(KINDS):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def evict(self):
+        """Удаление давно не использованных артефактов, пока размер кэша больше max_bytes"""
+        entries = self._entries()
+        self._total = sum(size for _, size, _ in entries)
+        if self._total <= self.max_bytes:
+            return
+        for _, size, file_path in sorted(entries):
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            self._total -= size
+            if self._total <= self.max_bytes:
+                break
+
+    def purge(self, user_ids=None):
+        """Удаление артефактов пользователей user_ids или всех артефактов"""
+        prefixes = tuple(f"{user_id}." for user_id in user_ids) if user_ids is not None else None
+        for _, _, file_path in self._entries():
+            if prefixes is None or os.path.basename(file_path).startswith(prefixes):
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+        self._total = None
+
+
+def purge_user_artifacts(config_path, user_ids):
+    """Удаление артефактов удаленных пользователей, если кэш для конфигурации есть"""
+    path = get_artifacts_path(config_path)
+    if user_ids and os.path.isdir(path):
+        ArtifactCache(path).purge(user_ids)
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Бенчмарки для Xray Reality CLI Manager"""
+
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from config_manager import ConfigManager
+
+
+def measure(func, repeat):
+    """Замер времени выполнения функции, возвращает список длительностей в секундах"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def print_timings(title, timings):
+    """Вывод статистики по замерам"""
+    print(f"{title}: "
+          f"среднее {statistics.mean(timings) * 1000:.3f} мс, "
+          f"медиана {statistics.median(timings) * 1000:.3f} мс, "
+          f"мин {min(timings) * 1000:.3f} мс, "
+          f"макс {max(timings) * 1000:.3f} мс "
+          f"({len(timings)} запусков)")
+
+
+def bench_keys(args):
+    """Сравнение встроенной генерации ключей X25519 и генерации через Docker"""
+    config_manager = ConfigManager()
+
+    print_timings("Встроенная генерация X25519", measure(config_manager.generate_keys, args.repeat))
+
+    if args.docker:
+        print_timings(
+            "Генерация через docker run xray x25519",
+            measure(lambda: config_manager.generate_keys(use_docker=True), args.docker_repeat)
+        )
+
+
+def build_config_manager(users_count):
+    """Создание конфигурации REALITY с users_count синтетическими пользователями"""
+    config_manager = ConfigManager()
+    config_manager.create_config("example.com:443", ["example.com"])
+    reality_settings = config_manager.get_reality_settings()
+    clients = config_manager.get_clients()
+    short_ids = reality_settings.setdefault("shortIds", [])
+    users = config_manager.user_metadata.setdefault("users", {})
+
+    for i in range(users_count):
+        user_id = f"00000000-0000-4000-8000-{i:012x}"
+        short_id = f"{i:016x}"
+        client_data = {"id": user_id, "flow": "xtls-rprx-vision"}
+        clients.append(client_data)
+        short_ids.append(short_id)
+        users[user_id] = {"name": f"user{i}", "data": client_data, "shortId": short_id}
+
+    config_manager.registry.rebuild()
+    return config_manager
+
+
+def linear_find_by_name(config_manager, name):
+    """Линейный поиск пользователя по имени (как до появления UserRegistry)"""
+    for user_id, user_data in config_manager.user_metadata["users"].items():
+        if user_data["name"] == name:
+            return user_id, user_data
+    return None
+
+
+def bench_registry(args):
+    """Поиск, добавление и удаление пользователей через UserRegistry"""
+    from user_manager import UserManager
+
+    for users_count in args.sizes:
+        print(f"\n{users_count} пользователей:")
+        config_manager = build_config_manager(users_count)
+        user_manager = UserManager(config_manager)
+        names = [f"user{random.randrange(users_count)}" for _ in range(args.ops)]
+
+        print_timings("  Пересборка индексов", measure(config_manager.registry.rebuild, 1))
+
+        started = time.perf_counter()
+        for name in names:
+            config_manager.get_client_by_name(name)
+        print(f"  Поиск по имени через индекс: {(time.perf_counter() - started) / len(names) * 1e6:.2f} мкс/операция")
+
+        linear_names = names[:args.linear_ops]
+        started = time.perf_counter()
+        for name in linear_names:
+            linear_find_by_name(config_manager, name)
+        print(f"  Линейный поиск по имени: {(time.perf_counter() - started) / len(linear_names) * 1e6:.2f} мкс/операция")
+
+        new_names = [f"new-user{i}" for i in range(args.ops)]
+        started = time.perf_counter()
+        for name in new_names:
+            user_manager.add_user(name)
+        print(f"  Добавление пользователя: {(time.perf_counter() - started) / len(new_names) * 1e6:.2f} мкс/операция")
+
+        started = time.perf_counter()
+        for name in new_names:
+            user_manager.remove_user(name)
+        print(f"  Удаление пользователя: {(time.perf_counter() - started) / len(new_names) * 1e6:.2f} мкс/операция")
+
+
+STARTUP_COMMANDS = [
+    ["--help"],
+    ["list-users"],
+    ["vless-link", "--name", "user0", "--server", "203.0.113.1"],
+    ["get-config", "--name", "user0", "--server", "203.0.113.1"],
+    ["qr", "--name", "user0", "--server", "203.0.113.1", "--save", "qr.png"],
+    ["add-user", "--name", "startup-user"],
+    ["remove-user", "--name", "startup-user"],
+    ["check"],
+    ["gen-keys"],
+    ["stop"],
+]
+
+
+def parse_importtime(stderr):
+    """Разбор вывода `python -X importtime`: (суммарное время импорта в мс, самые долгие модули верхнего уровня)"""
+    total_us = 0
+    top_level = []
+    for match in re.finditer(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", stderr):
+        self_us, cumulative_us, indent, module = match.groups()
+        total_us += int(self_us)
+        if len(indent) == 1:
+            top_level.append((int(cumulative_us), module))
+    top_level.sort(reverse=True)
+    return total_us / 1000, top_level[:3]
+
+
+def bench_startup(args):
+    """Время запуска CLI и время импорта модулей для каждой команды"""
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        config_manager = build_config_manager(args.users)
+        config_manager.save_config(os.path.join(work_dir, "config.json"))
+
+        for command in STARTUP_COMMANDS:
+            timings = []
+            import_ms = 0
+            top_modules = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                result = subprocess.run(
+                    [sys.executable, "-X", "importtime", main_path] + command,
+                    cwd=work_dir, capture_output=True, text=True
+                )
+                timings.append(time.perf_counter() - started)
+                import_ms, top_modules = parse_importtime(result.stderr)
+
+            print_timings(f"main.py {' '.join(command)}", timings)
+            modules = ", ".join(f"{module} {cumulative / 1000:.1f} мс" for cumulative, module in top_modules)
+            print(f"  импорт модулей: {import_ms:.1f} мс; самые долгие: {modules}")
+
+
+def concurrency_worker(config_path, prefix, users_count, optimistic):
+    """Добавление users_count пользователей отдельными загрузками и сохранениями, возвращает число конфликтов"""
+    from config_store import ConfigConflictError
+    from user_manager import UserManager
+
+    conflicts = 0
+    for i in range(users_count):
+        while True:
+            config_manager = ConfigManager()
+            # Без optimistic блокировка удерживается от загрузки до сохранения, как в CLI
+            config_manager.load_config(config_path, lock=not optimistic)
+            UserManager(config_manager).add_user(f"{prefix}-user{i}")
+            try:
+                config_manager.save_config(config_path)
+                break
+            except ConfigConflictError:
+                conflicts += 1
+    return conflicts
+
+
+def count_users(config_path):
+    """Количество пользователей и список проблем согласованности конфигурации на диске"""
+    config_manager = ConfigManager()
+    config_manager.load_config(config_path)
+    return len(config_manager.registry), config_manager.check_consistency()
+
+
+def bench_concurrency(args):
+    """Параллельное добавление пользователей из нескольких процессов с проверкой, что изменения не потеряны"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        config_path = os.path.join(work_dir, "config.json")
+        config_manager = build_config_manager(args.users)
+        config_manager.metadata_backend = args.backend
+        config_manager.save_config(config_path)
+
+        modes = (("lock", "блокировка на чтение-изменение-запись", False), ("cas", "оптимистичный CAS с повтором", True))
+        for mode, title, optimistic in modes:
+            users_before, _ = count_users(config_path)
+
+            started = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=args.workers) as executor:
+                futures = [
+                    executor.submit(concurrency_worker, config_path, f"{mode}{worker}", args.ops, optimistic)
+                    for worker in range(args.workers)
+                ]
+                conflicts = sum(future.result() for future in futures)
+            elapsed = time.perf_counter() - started
+
+            users_after, problems = count_users(config_path)
+            added = users_after - users_before
+            expected = args.workers * args.ops
+            print(f"{title}: {args.workers} процессов x {args.ops} операций, "
+                  f"{expected / elapsed:.1f} операций/с, конфликтов {conflicts}, "
+                  f"добавлено {added} из {expected}, проблем согласованности {len(problems)}")
+            if added != expected or problems:
+                sys.exit(1)
+
+
+def bench_qr(args):
+    """Построение QR-кода конфигурации клиента: текущий путь и компактные режимы с SVG"""
+    from qr_codes import encode_config, make_qr, render_qr_png, render_qr_svg
+    from user_manager import UserManager
+
+    user_manager = UserManager(build_config_manager(1))
+    client_config = user_manager.generate_client_config("user0", "203.0.113.10")
+    variants = [("json, перебор масок (текущий путь)", encode_config(client_config), False)]
+    for mode in ("json", "compact", "deflate"):
+        variants.append((f"{mode}, фиксированная маска", encode_config(client_config, mode), True))
+    variants.append(("link, фиксированная маска", user_manager.generate_vless_link("user0", "203.0.113.10"), True))
+
+    for title, payload, compact in variants:
+        qr = make_qr(payload, compact)
+        png = render_qr_png(payload, compact)
+        svg = render_qr_svg(payload, compact)
+        print(f"{title}: {len(payload)} символов, версия {qr.version} ({qr.modules_count}x{qr.modules_count} модулей), "
+              f"PNG {len(png)} байт, SVG {len(svg)} байт")
+        print_timings("  построение", measure(lambda: make_qr(payload, compact), args.repeat))
+        print_timings("  построение и PNG", measure(lambda: render_qr_png(payload, compact), args.repeat))
+        print_timings("  построение и SVG", measure(lambda: render_qr_svg(payload, compact), args.repeat))
+
+
+def bench_client_configs(args):
+    """Конфигурации клиентов всех пользователей: словарь и json.dumps на пользователя против шаблона"""
+    from client_configs import CLIENT_FORMATS, xray_template
+    from user_manager import UserManager
+
+    config_manager = build_config_manager(args.users)
+    user_manager = UserManager(config_manager)
+    users = list(config_manager.iter_users())
+
+    def per_user_dicts():
+        for user_id, user_data in users:
+            server_info = config_manager.get_server_info()
+            server = dict(server_info, address="203.0.113.10")
+            values = {"id": user_id, "shortId": user_data["shortId"], "name": user_data["name"]}
+            json.dumps(xray_template(server, values.__getitem__), indent=2)
+
+    print(f"Пользователей: {args.users}")
+    print_timings("xray, словарь и json.dumps на пользователя", measure(per_user_dicts, args.repeat))
+    for fmt in CLIENT_FORMATS:
+        print_timings(
+            f"{fmt}, шаблон (client_renderer)",
+            measure(lambda: list(user_manager.client_renderer("203.0.113.10").render_all(fmt, users)), args.repeat)
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарки Xray Reality CLI Manager')
+    subparsers = parser.add_subparsers(dest='command', help='Бенчмарки')
+
+    keys_parser = subparsers.add_parser('keys', help='Генерация ключей X25519: встроенная и через Docker')
+    keys_parser.add_argument('--repeat', type=int, default=100, help='Количество запусков встроенной генерации')
+    keys_parser.add_argument('--docker', action='store_true', help='Также замерить генерацию через Docker')
+    keys_parser.add_argument('--docker-repeat', type=int, default=3, help='Количество запусков генерации через Docker')
+    keys_parser.set_defaults(func=bench_keys)
+
+    registry_parser = subparsers.add_parser('registry', help='Операции с пользователями через UserRegistry')
+    registry_parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help='Количество пользователей')
+    registry_parser.add_argument('--ops', type=int, default=1000, help='Количество операций каждого типа')
+    registry_parser.add_argument('--linear-ops', type=int, default=20, help='Количество операций линейного поиска для сравнения')
+    registry_parser.set_defaults(func=bench_registry)
+
+    startup_parser = subparsers.add_parser('startup', help='Время запуска CLI и импорта модулей для каждой команды')
+    startup_parser.add_argument('--repeat', type=int, default=5, help='Количество запусков каждой команды')
+    startup_parser.add_argument('--users', type=int, default=1000, help='Количество пользователей в тестовой конфигурации')
+    startup_parser.set_defaults(func=bench_startup)
+
+    concurrency_parser = subparsers.add_parser('concurrency', help='Параллельное изменение конфигурации из нескольких процессов')
+    concurrency_parser.add_argument('--workers', type=int, default=8, help='Количество процессов')
+    concurrency_parser.add_argument('--ops', type=int, default=25, help='Количество добавлений пользователей в каждом процессе')
+    concurrency_parser.add_argument('--users', type=int, default=1000, help='Количество пользователей в исходной конфигурации')
+    concurrency_parser.add_argument('--backend', type=str, choices=['json', 'sqlite'], default='json', help='Хранилище метаданных')
+    concurrency_parser.set_defaults(func=bench_concurrency)
+
+    qr_parser = subparsers.add_parser('qr', help='Построение QR-кода конфигурации клиента в разных режимах')
+    qr_parser.add_argument('--repeat', type=int, default=20, help='Количество запусков каждого варианта')
+    qr_parser.set_defaults(func=bench_qr)
+
+    client_configs_parser = subparsers.add_parser('client-configs', help='Генерация конфигураций клиентов всех пользователей')
+    client_configs_parser.add_argument('--users', type=int, default=10000, help='Количество пользователей')
+    client_configs_parser.add_argument('--repeat', type=int, default=5, help='Количество запусков')
+    client_configs_parser.set_defaults(func=bench_client_configs)
+
+    args = parser.parse_args()
+
+    if not args.command:
+        parser.print_help()
+        return
+
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+import sys
+
+
+def _parse_line(line):
+    """Извлечение имени пользователя из строки CSV или JSONL"""
+    if line.startswith('{'):
+        record = json.loads(line)
+        return str(record.get("name", "")).strip()
+
+    row = next(csv.reader([line]), [])
+    return row[0].strip() if row else ""
+
+
+def read_user_names(path="-"):
+    """Чтение имен пользователей из файла или stdin (CSV или JSONL)
+
+    Для CSV используется первая колонка, строка заголовка `name` пропускается.
+    Для JSONL используется поле `name`. Пустые строки и строки с `#` пропускаются.
+    """
+    stream = sys.stdin if path in (None, "-") else open(path, 'r', encoding='utf-8')
+    try:
+        names = []
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            name = _parse_line(line)
+            if line_number == 1 and name.lower() == "name":
+                continue
+            if name:
+                names.append(name)
+        return names
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def write_results(results, stream=None):
+    """Вывод результатов по каждому пользователю в формате JSONL"""
+    stream = stream or sys.stdout
+    for result in results:
+        stream.write(json.dumps(result, ensure_ascii=False) + "\n")
+    stream.flush()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Генерация клиентских конфигураций по шаблону
+
+Серверная часть конфигурации (адрес, порт, ключ, serverName) одинакова для всех
+пользователей, поэтому шаблон каждого формата строится и сериализуется один раз
+на рендерер. В сериализованном шаблоне поля пользователя (UUID, shortId, имя)
+заменены метками; для пользователя в текст подставляются только эти значения,
+без построения вложенных словарей и повторной сериализации.
+
+Форматы:
+    xray     - JSON клиента Xray (как раньше выдавал generate_client_config)
+    sing-box - JSON sing-box с outbound vless и REALITY
+    clash    - YAML для Clash Meta (mihomo) с прокси vless и reality-opts
+"""
+
+import json
+import re
+
+CLIENT_FORMATS = ("xray", "sing-box", "clash")
+# Суффиксы файлов экспорта для форматов
+FILE_SUFFIXES = {"xray": ".json", "sing-box": ".sing-box.json", "clash": ".clash.yaml"}
+
+FLOW = "xtls-rprx-vision"
+FINGERPRINT = "chrome"
+
+# Метка поля пользователя в шаблоне: строка, которая не встречается в параметрах сервера
+_FIELD = "\x00{}\x00"
+_FIELDS = ("id", "shortId", "name")
+_FIELD_RE = re.compile("|".join(re.escape(json.dumps(_FIELD.format(field))) for field in _FIELDS))
+
+
+def xray_template(server, field):
+    """Конфигурация клиента Xray; field(name) - значение поля пользователя"""
+    return {
+        "log": {
+            "loglevel": "warning"
+        },
+        "routing": {
+            "rules": [
+                {
+                    "ip": [
+                        "geoip:private"
+                    ],
+                    "outboundTag": "direct"
+                }
+            ]
+        },
+        "inbounds": [
+            {
+                "listen": "127.0.0.1",
+                "port": 10808,
+                "protocol": "socks"
+            },
+            {
+                "listen": "127.0.0.1",
+                "port": 10809,
+                "protocol": "http"
+            }
+        ],
+        "outbounds": [
+            {
+                "protocol": "vless",
+                "settings": {
+                    "vnext": [
+                        {
+                            "address": server["address"],
+                            "port": server["port"],
+                            "users": [
+                                {
+                                    "id": field("id"),
+                                    "encryption": "none",
+                                    "flow": FLOW
+                                }
+                            ]
+                        }
+                    ]
+                },
+                "streamSettings": {
+                    "network": "tcp",
+                    "security": "reality",
+                    "realitySettings": {
+                        "fingerprint": FINGERPRINT,
+                        "serverName": server["serverName"],
+                        "publicKey": server["publicKey"],
+                        "shortId": field("shortId")
+                    }
+                },
+                "tag": "proxy"
+            },
+            {
+                "protocol": "freedom",
+                "tag": "direct"
+            }
+        ]
+    }
+
+
+def sing_box_template(server, field):
+    """Конфигурация sing-box: локальный mixed-прокси и outbound vless с REALITY"""
+    return {
+        "log": {
+            "level": "warn"
+        },
+        "inbounds": [
+            {
+                "type": "mixed",
+                "tag": "mixed-in",
+                "listen": "127.0.0.1",
+                "listen_port": 2080
+            }
+        ],
+        "outbounds": [
+            {
+                "type": "vless",
+                "tag": "proxy",
+                "server": server["address"],
+                "server_port": server["port"],
+                "uuid": field("id"),
+                "flow": FLOW,
+                "tls": {
+                    "enabled": True,
+                    "server_name": server["serverName"],
+                    "utls": {
+                        "enabled": True,
+                        "fingerprint": FINGERPRINT
+                    },
+                    "reality": {
+                        "enabled": True,
+                        "public_key": server["publicKey"],
+                        "short_id": field("shortId")
+                    }
+                }
+            },
+            {
+                "type": "direct",
+                "tag": "direct"
+            }
+        ],
+        "route": {
+            "rules": [
+                {
+                    "ip_is_private": True,
+                    "outbound": "direct"
+                }
+            ],
+            "final": "proxy"
+        }
+    }
+
+
+def clash_template(server, field):
+    """Конфигурация Clash Meta: прокси vless с reality-opts и группа PROXY"""
+    return {
+        "mixed-port": 7890,
+        "allow-lan": False,
+        "mode": "rule",
+        "log-level": "warning",
+        "proxies": [
+            {
+                "name": field("name"),
+                "type": "vless",
+                "server": server["address"],
+                "port": server["port"],
+                "uuid": field("id"),
+                "network": "tcp",
+                "udp": True,
+                "tls": True,
+                "flow": FLOW,
+                "servername": server["serverName"],
+                "client-fingerprint": FINGERPRINT,
+                "reality-opts": {
+                    "public-key": server["publicKey"],
+                    "short-id": field("shortId")
+                }
+            }
+        ],
+        "proxy-groups": [
+            {
+                "name": "PROXY",
+                "type": "select",
+                "proxies": [field("name")]
+            }
+        ],
+        "rules": [
+            "IP-CIDR,10.0.0.0/8,DIRECT",
+            "IP-CIDR,172.16.0.0/12,DIRECT",
+            "IP-CIDR,192.168.0.0/16,DIRECT",
+            "MATCH,PROXY"
+        ]
+    }
+
+
+def dump_yaml(value, indent=0):
+    """Сериализация словарей, списков и скаляров в YAML блочного стиля
+
+    Строки и пустые коллекции записываются в JSON - это корректные значения YAML
+    (строки в двойных кавычках, [] и {}).
+    """
+    prefix = " " * indent
+    if isinstance(value, dict) and value:
+        lines = []
+        for key, item in value.items():
+            if isinstance(item, (dict, list)) and item:
+                lines.append(f"{prefix}{key}:\n{dump_yaml(item, indent + 2)}")
+            else:
+                lines.append(f"{prefix}{key}: {dump_yaml(item)}")
+        return "\n".join(lines)
+    if isinstance(value, list) and value:
+        lines = []
+        for item in value:
+            if isinstance(item, (dict, list)) and item:
+                # Первая строка вложенной коллекции пишется в строке с дефисом
+                lines.append(f"{prefix}- {dump_yaml(item, indent + 2)[indent + 2:]}")
+            else:
+                lines.append(f"{prefix}- {dump_yaml(item)}")
+        return "\n".join(lines)
+    return json.dumps(value, ensure_ascii=False)
+
+
+TEMPLATES = {
+    "xray": (xray_template, lambda config: json.dumps(config, indent=2)),
+    "sing-box": (sing_box_template, lambda config: json.dumps(config, indent=2)),
+    "clash": (clash_template, lambda config: dump_yaml(config) + "\n"),
+}
+
+
+class ClientConfigRenderer:
+    """Клиентские конфигурации всех форматов по шаблонам с общей серверной частью
+
+    Шаблоны строятся при первом обращении к формату и используются для всех
+    пользователей inbound, пока параметры сервера не изменились (см. UserManager.client_renderer).
+    """
+
+    def __init__(self, config_manager, server_address="", inbound=None):
+        self.config_manager = config_manager
+        self.inbound = inbound
+        server_info = config_manager.get_server_info(inbound)
+        short_ids = server_info.get("shortIds") or [""]
+        self.server = {
+            "address": server_address,
+            "port": server_info["port"],
+            "serverName": server_info["serverName"],
+            "publicKey": server_info["publicKey"],
+        }
+        # shortId для пользователей без собственного shortId (обратная совместимость)
+        self.default_short_id = short_ids[0]
+        self._templates = {}
+
+    def _template(self, fmt):
+        """Сериализованный шаблон формата: список чередующихся литералов и имен полей"""
+        template = self._templates.get(fmt)
+        if template is None:
+            build, serialize = TEMPLATES[fmt]
+            text = serialize(build(self.server, _FIELD.format))
+            template = []
+            position = 0
+            for match in _FIELD_RE.finditer(text):
+                template.append(text[position:match.start()])
+                template.append(json.loads(match.group()).strip("\x00"))
+                position = match.end()
+            template.append(text[position:])
+            self._templates[fmt] = template
+        return template
+
+    def render(self, user_id, user_data, fmt="xray"):
+        """Конфигурация пользователя в формате fmt, возвращает строку"""
+        values = {
+            "id": json.dumps(user_id),
+            "shortId": json.dumps(user_data.get("shortId") or self.default_short_id),
+            "name": json.dumps(user_data["name"], ensure_ascii=False),
+        }
+        template = self._template(fmt)
+        parts = template[:]
+        parts[1::2] = [values[field] for field in template[1::2]]
+        return "".join(parts)
+
+    def render_all(self, fmt="xray", users=None):
+        """Генератор (user_id, имя, конфигурация) для пар (user_id, user_data), по умолчанию всех пользователей inbound"""
+        if users is None:
+            users = ((user_id, user_data) for user_id, user_data in self.config_manager.iter_users()
+                     if user_data.get("inbound") == self.inbound)
+        for user_id, user_data in users:
+            yield user_id, user_data["name"], self.render(user_id, user_data, fmt)
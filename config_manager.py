@@ -3,22 +3,46 @@
 
 import json
 import os
-import uuid
-import subprocess
-import base64
-import secrets
-import string
+
+from config_store import ConfigConflictError, FileLock, check_consistency
+from metadata_store import SqliteMetadataStore, migrate_metadata, open_metadata_store
+from restart_scheduler import schedule_restart
+from user_registry import UserRegistry
+from xray_api import DEFAULT_API_PORT
+
+INBOUND_TAG = "vless-in"
+API_TAG = "api"
+# Inbound со старым ключом на время ротации (см. key_rotation.py); email его клиентов - с суффиксом
+RETIRING_TAG = "vless-in-retiring"
+RETIRING_EMAIL_SUFFIX = "@old"
+# Состояние ротации в метаданных
+ROTATION_KEY = "rotation"
+# Дополнительные inbound пользователей: параметры для клиентов в метаданных и политика распределения
+INBOUNDS_KEY = "inbounds"
+SHARDING_KEY = "sharding"
+SHARDING_POLICIES = ("hash", "least-loaded", "explicit")
+# Директория конфигурации монтируется в контейнер как /etc/xray, лог пишется рядом с config.json
+CONTAINER_CONFIG_DIR = "/etc/xray"
+ACCESS_LOG_NAME = "access.log"
 
 class ConfigManager:
     """Класс для управления конфигурацией Xray"""
 
-    def __init__(self):
+    def __init__(self, metadata_backend=None):
+        # Хранилище метаданных: "json", "sqlite" или None (определяется по существующим файлам)
+        self.metadata_backend = metadata_backend
+        self.metadata_store = None
+        # Хранилище, из которого пользователи читаются по запросу (режим только для чтения)
+        self._lazy_store = None
+        # Содержимое config.json на диске, чтобы не перезаписывать файл без изменений
+        self._config_snapshot = None
         self.config = {
             "log": {
                 "loglevel": "warning"
             },
             "inbounds": [
                 {
+                    "tag": INBOUND_TAG,
                     "listen": "0.0.0.0",
                     "protocol": "vless",
                     "settings": {
@@ -52,51 +76,175 @@ class ConfigManager:
             ]
         }
         self.user_metadata = {}
-
-    def load_config(self, file_path):
-        """Загрузка конфигурации из файла"""
+        self.registry = UserRegistry(self)
+        # Поколение метаданных на момент загрузки, проверяется при сохранении (compare-and-swap)
+        self.generation = 0
+        self.config_path = None
+        self._lock = None
+        # Контейнер, который перезапускается после сохранения (None - контейнер по умолчанию)
+        self.container_name = None
+
+    def acquire_lock(self, file_path):
+        """Захват межпроцессной блокировки `<config>.lock`, возвращает False, если она уже захвачена"""
+        if self._lock is not None:
+            return False
+        self._lock = FileLock(f"{file_path}.lock")
+        self._lock.acquire()
+        return True
+
+    def release_lock(self):
+        if self._lock is not None:
+            self._lock.release()
+            self._lock = None
+
+    def load_config(self, file_path, readonly=False, lock=False):
+        """Загрузка конфигурации из файла
+
+        С readonly=True и хранилищем SQLite config.json не читается, а пользователи
+        загружаются из базы по одному при обращении. С lock=True блокировка
+        конфигурации удерживается до save_config, чтобы чтение, изменение и
+        запись не пересекались с другими процессами.
+        """
+        self.config_path = file_path
+        if lock:
+            self.acquire_lock(file_path)
+
+        # Без удержания блокировки чтение все равно выполняется под разделяемой блокировкой,
+        # чтобы не прочитать config.json и метаданные от разных записей
+        read_lock = None
+        if self._lock is None:
+            read_lock = FileLock(f"{file_path}.lock")
+            try:
+                read_lock.acquire(shared=True)
+            except OSError:
+                # Директория только для чтения: записи в нее невозможны, блокировка не нужна
+                read_lock = None
         try:
+            self.metadata_store = open_metadata_store(file_path, self.metadata_backend)
+
+            # Завершение или откат прерванной записи до чтения файлов
+            recovered = self.metadata_store.recover(file_path)
+            if recovered == "replayed":
+                print(f"Завершена прерванная запись конфигурации {file_path} по журналу")
+            elif recovered == "rolled_back":
+                print(f"Отменена незавершенная запись конфигурации {file_path}")
+
+            if readonly and isinstance(self.metadata_store, SqliteMetadataStore) and self.metadata_store.exists():
+                self._lazy_store = self.metadata_store
+                self.user_metadata = {"users": {}}
+                for key in ("server", INBOUNDS_KEY, "resolver", "address_cache", "generation"):
+                    value = self.metadata_store.get_meta(key)
+                    if value is not None:
+                        self.user_metadata[key] = value
+                self.generation = self.user_metadata.get("generation", 0)
+                return
+
             if os.path.exists(file_path):
-                with open(file_path, 'r') as f:
-                    self.config = json.load(f)
-
-                # Загрузка метаданных о пользователях, если файл существует
-                metadata_path = self._get_metadata_path(file_path)
-                if os.path.exists(metadata_path):
-                    with open(metadata_path, 'r') as f:
-                        self.user_metadata = json.load(f)
+                with open(file_path, 'rb') as f:
+                    self._config_snapshot = f.read()
+                self.config = json.loads(self._config_snapshot)
+
+                # Загрузка метаданных о пользователях, если они существуют
+                if self.metadata_store.exists():
+                    self.user_metadata = self.metadata_store.load()
+
+                self.generation = self.user_metadata.get("generation", 0)
+
+                # Пересборка индексов пользователей под загруженную конфигурацию
+                self.registry.rebuild()
             else:
                 print(f"Файл конфигурации {file_path} не найден, будет создана новая конфигурация")
         except Exception as e:
             print(f"Ошибка при загрузке конфигурации: {e}")
             raise
+        finally:
+            if read_lock is not None:
+                read_lock.release()
 
     def save_config(self, file_path, restart_server=False):
-        """Сохранение конфигурации в файл"""
-        try:
-            with open(file_path, 'w') as f:
-                json.dump(self.config, f, indent=2)
+        """Сохранение конфигурации в файл
 
-            # Сохранение метаданных о пользователях
-            metadata_path = self._get_metadata_path(file_path)
-            with open(metadata_path, 'w') as f:
-                json.dump(self.user_metadata, f, indent=2)
+        Запись выполняется под блокировкой конфигурации и только если поколение
+        метаданных на диске совпадает с загруженным, иначе ConfigConflictError.
+        """
+        self.config_path = file_path
+        self.acquire_lock(file_path)
+        try:
+            if self.metadata_store is None:
+                self.metadata_store = open_metadata_store(file_path, self.metadata_backend)
+
+            current = self.metadata_store.get_meta("generation", 0) if self.metadata_store.exists() else 0
+            if current != self.generation:
+                raise ConfigConflictError(
+                    f"Конфигурация {file_path} изменена другим процессом "
+                    f"(поколение {current}, загружено {self.generation})"
+                )
+
+            # Удаленные пользователи теряют доступ и через inbound со старым ключом
+            self.remove_retiring_clients(self.registry.removed_ids)
+
+            # config.json перезаписывается только если он действительно изменился
+            config_data = json.dumps(self.config, indent=2).encode('utf-8')
+            changed_config = config_data if config_data != self._config_snapshot else None
+
+            # Конфигурация и метаданные записываются одной транзакцией
+            self.user_metadata["generation"] = self.generation + 1
+            try:
+                self.metadata_store.save(
+                    file_path, changed_config, self.user_metadata,
+                    self.registry.changed_ids, self.registry.removed_ids
+                )
+            except Exception:
+                self.user_metadata["generation"] = self.generation
+                raise
+            self.generation += 1
+            self._config_snapshot = config_data
+            if self.registry.removed_ids:
+                # Кэш артефактов нужен только при удалении пользователей
+                from artifact_cache import purge_user_artifacts
+                purge_user_artifacts(file_path, self.registry.removed_ids)
+            self.registry.clear_changes()
 
             # Если требуется перезапуск сервера
             if restart_server:
-                from docker_manager import DockerManager
-                docker_manager = DockerManager()
-                docker_manager.restart_xray()
+                schedule_restart(file_path, self.container_name)
 
             return True
+        except ConfigConflictError:
+            raise
         except Exception as e:
             print(f"Ошибка при сохранении конфигурации: {e}")
             return False
+        finally:
+            self.release_lock()
+
+    def save_metadata_value(self, key, value):
+        """Запись одного ключа метаданных (например, кэша) без сохранения всей конфигурации"""
+        self.user_metadata[key] = value
+        if self.metadata_store is not None:
+            # JSON-хранилище перезаписывает файл целиком, поэтому под той же блокировкой, что и save_config
+            acquired = self.acquire_lock(self.config_path)
+            try:
+                self.metadata_store.set_meta(key, value)
+            finally:
+                if acquired:
+                    self.release_lock()
+
+    def migrate_metadata(self, file_path, backend):
+        """Перенос метаданных конфигурации в хранилище backend ("json" или "sqlite")"""
+        if self.metadata_store is not None:
+            self.metadata_store.close()
+            self.metadata_store = None
+        acquired = self.acquire_lock(file_path)
+        try:
+            return migrate_metadata(file_path, backend)
+        finally:
+            if acquired:
+                self.release_lock()
 
-    def _get_metadata_path(self, config_path):
-        """Возвращает путь к файлу метаданных о пользователях"""
-        base_path, _ = os.path.splitext(config_path)
-        return f"{base_path}_metadata.json"
+    def check_consistency(self):
+        """Проверка согласованности конфигурации и метаданных, возвращает список проблем"""
+        return check_consistency(self.get_user_inbounds(), self.user_metadata)
 
     def create_config(self, dest, server_names, port=443):
         """Создание новой конфигурации Xray с REALITY"""
@@ -123,83 +271,89 @@ class ConfigManager:
             "port": port
         }
 
+        self.registry.rebuild()
         return self.config
 
-    def has_reality_settings(self):
+    def has_reality_settings(self, tag=None):
         """Проверяет, настроены ли параметры REALITY в конфигурации"""
         try:
-            reality_settings = self.get_reality_settings()
+            reality_settings = self.get_reality_settings(tag)
             return bool(reality_settings.get("privateKey") and reality_settings.get("dest") and reality_settings.get("serverNames"))
         except:
             return False
 
-    def update_dest(self, dest):
+    def _server_metadata(self, tag=None):
+        """Параметры inbound для клиентов в метаданных: запись "server" для основного inbound, иначе запись в "inbounds" по тегу"""
+        if tag is None:
+            return self.user_metadata.setdefault("server", {})
+        return self.user_metadata.setdefault(INBOUNDS_KEY, {}).setdefault(tag, {})
+
+    def update_dest(self, dest, tag=None):
         """Обновление целевого домена в REALITY настройках"""
-        reality_settings = self.get_reality_settings()
+        reality_settings = self.get_reality_settings(tag)
         reality_settings["dest"] = dest
 
         # Обновление метаданных для клиентов
-        if "server" not in self.user_metadata:
-            self.user_metadata["server"] = {}
-        self.user_metadata["server"]["dest"] = dest
+        self._server_metadata(tag)["dest"] = dest
 
-    def update_server_names(self, server_names):
+    def update_server_names(self, server_names, tag=None):
         """Обновление serverNames в REALITY настройках"""
-        reality_settings = self.get_reality_settings()
+        reality_settings = self.get_reality_settings(tag)
         reality_settings["serverNames"] = server_names
 
         # Обновление метаданных для клиентов
-        if "server" not in self.user_metadata:
-            self.user_metadata["server"] = {}
-        self.user_metadata["server"]["serverName"] = server_names[0]
+        self._server_metadata(tag)["serverName"] = server_names[0]
 
-    def update_port(self, port):
+    def update_port(self, port, tag=None):
         """Обновление порта для inbound"""
-        inbound = self.get_inbound()
+        inbound = self.get_inbound(tag)
         inbound["port"] = port
 
         # Обновление метаданных для клиентов
-        if "server" not in self.user_metadata:
-            self.user_metadata["server"] = {}
-        self.user_metadata["server"]["port"] = port
+        self._server_metadata(tag)["port"] = port
 
     def update_keys(self, private_key, public_key, short_id=None):
-        """Обновление ключей в REALITY настройках"""
-        reality_settings = self.get_reality_settings()
-        reality_settings["privateKey"] = private_key
+        """Обновление ключей в REALITY настройках всех inbound пользователей (ключ у них общий)"""
+        for inbound in self.get_user_inbounds().values():
+            inbound["streamSettings"]["realitySettings"]["privateKey"] = private_key
 
         # Обновление метаданных для клиентов
-        if "server" not in self.user_metadata:
-            self.user_metadata["server"] = {}
-        self.user_metadata["server"]["publicKey"] = public_key
+        self._server_metadata()["publicKey"] = public_key
 
     def generate_short_id(self):
         """Генерация короткого идентификатора для Reality"""
-        try:
-            # Используем openssl для генерации short_id
-            result = subprocess.run(
-                ["openssl", "rand", "-hex", "8"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            return result.stdout.strip()
-        except Exception as e:
-            print(f"Ошибка при генерации short_id через openssl: {e}")
-            # Запасной метод, если команда openssl не доступна
-            return secrets.token_hex(8)
+        import secrets
+        return secrets.token_hex(8)
 
-    def generate_keys(self):
+    def generate_keys(self, use_docker=False):
         """Генерация ключей X25519 для REALITY"""
+        if use_docker:
+            keys = self._generate_keys_docker()
+            if keys:
+                return keys
+            print("Использую встроенную генерацию ключей X25519")
+
+        import x25519
+        return x25519.generate_keypair()
+
+    def _generate_keys_docker(self):
+        """Генерация ключей X25519 через `xray x25519` в Docker-контейнере"""
+        import subprocess
+
         try:
-            # Попытка вызвать xray для генерации ключей
             result = subprocess.run(
                 ["docker", "run", "--rm", "ghcr.io/xtls/xray-core:latest", "x25519"],
                 capture_output=True, text=True, check=True
             )
-            output = result.stdout.strip().split('\n')
-            private_key = output[0].split('Private key: ')[1] if 'Private key: ' in output[0] else None
-            public_key = output[1].split('Public key: ')[1] if 'Public key: ' in output[1] else None
+            values = {}
+            for line in result.stdout.strip().split('\n'):
+                if ':' in line:
+                    key, value = line.split(':', 1)
+                    values[key.strip().replace(' ', '').lower()] = value.strip()
+
+            # Старые версии xray выводят "Public key", новые - "Password"
+            private_key = values.get("privatekey")
+            public_key = values.get("publickey") or values.get("password")
 
             if private_key and public_key:
                 return private_key, public_key
@@ -207,93 +361,300 @@ class ConfigManager:
                 raise Exception("Не удалось извлечь ключи из вывода xray")
         except (subprocess.SubprocessError, Exception) as e:
             print(f"Ошибка при генерации ключей через xray: {e}")
-            # Если вызов xray не удался, используем встроенные средства Python
-            # Это заглушка - для реальной реализации нужно использовать библиотеку для X25519
-            # В условиях ограничения на использование только стандартных библиотек
-            # можно предложить пользователю сгенерировать ключи вручную
-            random_key = base64.b64encode(os.urandom(32)).decode('utf-8')
-            private_key = random_key
-            public_key = base64.b64encode(os.urandom(32)).decode('utf-8')
-            return private_key, public_key
+            return None
 
     def generate_uuid(self):
-        """Генерация UUID через Docker и Xray"""
-        try:
-            # Используем Docker для запуска Xray и генерации UUID
-            result = subprocess.run(
-                ["docker", "run", "--rm", "ghcr.io/xtls/xray-core:latest", "uuid"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            return result.stdout.strip()
-        except Exception as e:
-            print(f"Ошибка при генерации UUID через Docker: {e}")
-            # Запасной метод, если Docker недоступен
-            return str(uuid.uuid4())
+        """Генерация UUID пользователя"""
+        import uuid
+        return str(uuid.uuid4())
+
+    def get_inbound(self, tag=None):
+        """Получение inbound пользователей по тегу (None - основной inbound), KeyError, если его нет"""
+        if tag is None:
+            return self.config["inbounds"][0]
+        for inbound in self.config["inbounds"]:
+            if inbound.get("tag") == tag:
+                return inbound
+        raise KeyError(f"inbound {tag} не найден")
+
+    def get_inbound_tag(self, tag=None):
+        """Тег inbound для API Xray: tag дополнительного inbound или тег основного (назначается при первом обращении)"""
+        return tag or self.get_inbound().setdefault("tag", INBOUND_TAG)
+
+    def get_user_inbounds(self):
+        """Inbound пользователей: {тег: inbound}, основной inbound - под ключом None и первым
+
+        Inbound API и inbound со старым ключом во время ротации не входят.
+        """
+        inbounds = self.config["inbounds"]
+        user_inbounds = {None: inbounds[0]}
+        for inbound in inbounds[1:]:
+            if inbound.get("protocol") == "vless" and inbound.get("tag") not in (None, RETIRING_TAG):
+                user_inbounds[inbound["tag"]] = inbound
+        return user_inbounds
+
+    def add_inbound(self, port, dest=None, server_names=None, tag=None):
+        """Добавление inbound пользователей с тем же ключом, что у основного, ValueError при конфликте
+
+        Порт, dest и serverNames задаются для inbound отдельно (по умолчанию dest и serverNames
+        основного inbound). Возвращает тег нового inbound.
+        """
+        import copy
+
+        inbounds = self.config["inbounds"]
+        if any(inbound.get("port") == port for inbound in inbounds):
+            raise ValueError(f"порт {port} уже используется")
+        tags = {inbound.get("tag") for inbound in inbounds} | {self.get_inbound_tag()}
+        if tag is None:
+            number = 2
+            while f"{INBOUND_TAG}-{number}" in tags:
+                number += 1
+            tag = f"{INBOUND_TAG}-{number}"
+        elif tag in tags or tag == RETIRING_TAG:
+            raise ValueError(f"тег {tag} уже используется")
+
+        # Клиенты и shortIds у каждого inbound свои, остальные параметры копируются из основного
+        inbound = copy.deepcopy(self.get_inbound())
+        inbound["tag"] = tag
+        inbound["settings"]["clients"] = []
+        inbound["streamSettings"]["realitySettings"]["shortIds"] = []
+        # Inbound пользователей идут перед API и inbound со старым ключом
+        position = 1 + sum(1 for existing in inbounds[1:] if existing.get("protocol") == "vless" and existing.get("tag") != RETIRING_TAG)
+        inbounds.insert(position, inbound)
+
+        self.update_port(port, tag)
+        self.update_dest(dest or self.get_reality_settings()["dest"], tag)
+        self.update_server_names(server_names or self.get_reality_settings()["serverNames"], tag)
+        return tag
+
+    def remove_inbound(self, tag):
+        """Удаление дополнительного inbound без пользователей, ValueError, если удалить нельзя"""
+        if tag is None or tag == self.get_inbound_tag():
+            raise ValueError("основной inbound удалить нельзя")
+        inbound = self.get_user_inbounds().get(tag)
+        if inbound is None:
+            raise ValueError(f"inbound {tag} не найден")
+        if inbound["settings"]["clients"]:
+            raise ValueError(f"в inbound {tag} есть пользователи: {len(inbound['settings']['clients'])}")
+        self.config["inbounds"].remove(inbound)
+        self.user_metadata.get(INBOUNDS_KEY, {}).pop(tag, None)
+
+    def select_inbound(self, name, tag=None):
+        """Inbound для нового пользователя name по политике распределения, возвращает тег (None - основной)
+
+        tag задает inbound явно. Политики: hash - по хэшу имени, least-loaded - inbound с наименьшим
+        числом клиентов, explicit - основной inbound, если tag не указан.
+        """
+        user_inbounds = self.get_user_inbounds()
+        if tag is not None:
+            if tag == self.get_inbound_tag():
+                return None
+            if tag not in user_inbounds:
+                raise ValueError(f"inbound {tag} не найден")
+            return tag
+        if len(user_inbounds) == 1:
+            return None
 
-    def get_inbound(self):
-        """Получение основного inbound из конфигурации"""
-        return self.config["inbounds"][0]
+        policy = self.user_metadata.get(SHARDING_KEY, {}).get("policy", "hash")
+        if policy == "least-loaded":
+            return min(user_inbounds, key=lambda key: len(user_inbounds[key]["settings"]["clients"]))
+        if policy == "hash":
+            import hashlib
+            digest = hashlib.sha256(name.encode('utf-8')).digest()
+            return list(user_inbounds)[int.from_bytes(digest[:8], "big") % len(user_inbounds)]
+        return None
+
+    def get_retiring_inbound(self):
+        """Inbound со старым ключом во время ротации или None"""
+        for inbound in self.config.get("inbounds", []):
+            if inbound.get("tag") == RETIRING_TAG:
+                return inbound
+        return None
 
-    def get_reality_settings(self):
+    def remove_retiring_clients(self, user_ids):
+        """Удаление клиентов user_ids из inbound со старым ключом, возвращает количество удаленных"""
+        retiring_inbound = self.get_retiring_inbound()
+        if not user_ids or retiring_inbound is None:
+            return 0
+        clients = retiring_inbound["settings"]["clients"]
+        remaining = [client for client in clients if client["id"] not in user_ids]
+        removed = len(clients) - len(remaining)
+        clients[:] = remaining
+        return removed
+
+    def get_api_inbound(self):
+        """Получение inbound API Xray или None, если API не включен"""
+        for inbound in self.config.get("inbounds", []):
+            if inbound.get("tag") == API_TAG:
+                return inbound
+        return None
+
+    def has_api(self):
+        """Проверяет, включен ли API Xray в конфигурации"""
+        return self.get_api_inbound() is not None
+
+    def get_api_address(self):
+        """Адрес API Xray на хосте"""
+        api_inbound = self.get_api_inbound()
+        port = api_inbound["port"] if api_inbound else DEFAULT_API_PORT
+        return f"127.0.0.1:{port}"
+
+    def enable_api(self, port=DEFAULT_API_PORT, services=("HandlerService",)):
+        """Включение API Xray: секция api, inbound API и правило маршрутизации"""
+        self.get_inbound_tag()
+
+        api = self.config.setdefault("api", {"tag": API_TAG, "services": []})
+        for service in services:
+            if service not in api["services"]:
+                api["services"].append(service)
+
+        api_inbound = self.get_api_inbound()
+        if api_inbound is None:
+            # Внутри контейнера API слушает все интерфейсы, на хост порт пробрасывается только на 127.0.0.1
+            api_inbound = {
+                "tag": API_TAG,
+                "listen": "0.0.0.0",
+                "protocol": "dokodemo-door",
+                "settings": {
+                    "address": "127.0.0.1"
+                }
+            }
+            self.config["inbounds"].append(api_inbound)
+        api_inbound["port"] = port
+
+        rules = self.config.setdefault("routing", {}).setdefault("rules", [])
+        if not any(rule.get("outboundTag") == API_TAG for rule in rules):
+            rules.insert(0, {
+                "type": "field",
+                "inboundTag": [API_TAG],
+                "outboundTag": API_TAG
+            })
+
+    def enable_stats(self, port=None):
+        """Включение счетчиков трафика пользователей: секции stats и policy, StatsService в API"""
+        self.config.setdefault("stats", {})
+        policy = self.config.setdefault("policy", {})
+        level = policy.setdefault("levels", {}).setdefault("0", {})
+        level["statsUserUplink"] = True
+        level["statsUserDownlink"] = True
+        system = policy.setdefault("system", {})
+        system["statsInboundUplink"] = True
+        system["statsInboundDownlink"] = True
+
+        if port is None:
+            api_inbound = self.get_api_inbound()
+            port = api_inbound["port"] if api_inbound else DEFAULT_API_PORT
+        self.enable_api(port, ("HandlerService", "StatsService"))
+
+    def has_stats(self):
+        """Проверяет, включены ли счетчики трафика пользователей"""
+        return "stats" in self.config and "StatsService" in self.config.get("api", {}).get("services", [])
+
+    def enable_access_log(self):
+        """Включение access-лога Xray в директории конфигурации и email у всех клиентов
+
+        Возвращает количество клиентов, которым добавлен email.
+        """
+        self.config.setdefault("log", {})["access"] = f"{CONTAINER_CONFIG_DIR}/{ACCESS_LOG_NAME}"
+        return self.ensure_client_emails()
+
+    def get_access_log_path(self, config_path):
+        """Путь к access-логу на хосте или None, если лог не включен или пишется вне директории конфигурации"""
+        access = self.config.get("log", {}).get("access")
+        if not access or not access.startswith(f"{CONTAINER_CONFIG_DIR}/"):
+            return None
+        config_dir = os.path.dirname(os.path.abspath(config_path))
+        return os.path.join(config_dir, access[len(CONTAINER_CONFIG_DIR) + 1:])
+
+    def ensure_client_emails(self):
+        """Добавление email (имени пользователя) клиентам без него: по email Xray подписывает строки access-лога"""
+        users = self.user_metadata.get("users", {})
+        updated = 0
+        clients = [client for inbound in self.get_user_inbounds().values() for client in inbound["settings"]["clients"]]
+        for client in clients:
+            user_data = users.get(client["id"])
+            if client.get("email") or not user_data:
+                continue
+            client["email"] = user_data["name"]
+            user_data["data"] = dict(user_data.get("data", {}), email=user_data["name"])
+            self.registry.set_user(client["id"], user_data)
+            updated += 1
+        return updated
+
+    def get_reality_settings(self, tag=None):
         """Получение настроек REALITY из конфигурации"""
-        return self.get_inbound()["streamSettings"]["realitySettings"]
+        return self.get_inbound(tag)["streamSettings"]["realitySettings"]
 
-    def get_clients(self):
+    def get_clients(self, tag=None):
         """Получение списка клиентов из конфигурации"""
-        return self.get_inbound()["settings"]["clients"]
+        return self.get_inbound(tag)["settings"]["clients"]
 
-    def add_client_short_id(self, short_id):
+    def add_client_short_id(self, short_id, tag=None):
         """Добавление short_id в список shortIds в realitySettings"""
-        reality_settings = self.get_reality_settings()
-        if "shortIds" not in reality_settings:
-            reality_settings["shortIds"] = []
-
-        # Добавляем short_id, если его еще нет в списке
-        if short_id not in reality_settings["shortIds"]:
-            reality_settings["shortIds"].append(short_id)
+        self.registry.add_short_id(short_id, tag)
 
     def remove_client_short_id(self, short_id):
         """Удаление short_id из списка shortIds в realitySettings"""
-        reality_settings = self.get_reality_settings()
-        if "shortIds" in reality_settings and short_id in reality_settings["shortIds"]:
-            reality_settings["shortIds"].remove(short_id)
+        self.registry.remove_short_id(short_id)
 
-    def get_server_info(self):
-        """Получение информации о сервере из метаданных"""
+    def add_client(self, client_data, tag=None):
+        """Добавление клиента в список clients inbound tag (по умолчанию основного)"""
+        self.registry.add_client(client_data, tag)
+
+    def remove_client(self, user_id):
+        """Удаление клиента из списка clients его inbound"""
+        return self.registry.remove_client(user_id)
+
+    def get_server_info(self, tag=None):
+        """Получение информации о сервере из метаданных
+
+        Для дополнительного inbound порт, serverName и dest берутся из его записи в "inbounds".
+        """
         server_info = self.user_metadata.get("server", {})
+        if tag is not None:
+            server_info = dict(server_info, **self.user_metadata.get(INBOUNDS_KEY, {}).get(tag, {}))
 
         # Добавляем список shortIds из realitySettings, если они есть
-        if self.has_reality_settings():
-            reality_settings = self.get_reality_settings()
+        if self.has_reality_settings(tag):
+            reality_settings = self.get_reality_settings(tag)
             if "shortIds" in reality_settings:
                 server_info["shortIds"] = reality_settings.get("shortIds", [])
 
         return server_info
 
-    def update_client(self, user_id, name, client_data, short_id=None):
+    def update_client(self, user_id, name, client_data, short_id=None, tag=None):
         """Обновление или добавление метаданных о клиенте"""
-        if "users" not in self.user_metadata:
-            self.user_metadata["users"] = {}
-
         # Сохранение базовой информации о пользователе
-        self.user_metadata["users"][user_id] = {
+        user_data = {
             "name": name,
             "data": client_data
         }
 
         # Если передан short_id, сохраняем его для этого пользователя
         if short_id:
-            self.user_metadata["users"][user_id]["shortId"] = short_id
+            user_data["shortId"] = short_id
 
-    def get_client_by_name(self, name):
-        """Поиск клиента по имени"""
-        if "users" not in self.user_metadata:
-            return None
+        # Пользователи основного inbound хранятся без тега (как до появления нескольких inbound)
+        if tag is not None:
+            user_data["inbound"] = tag
 
-        for user_id, user_data in self.user_metadata["users"].items():
-            if user_data["name"] == name:
-                return user_id, user_data
+        self.registry.set_user(user_id, user_data)
 
-        return None
+    def remove_client_metadata(self, user_id):
+        """Удаление метаданных о клиенте, возвращает удаленные данные или None"""
+        return self.registry.remove_user(user_id)
+
+    def get_client_by_name(self, name):
+        """Поиск клиента по имени"""
+        if self._lazy_store:
+            user_info = self._lazy_store.get_user_by_name(name)
+            if user_info:
+                self.user_metadata["users"][user_info[0]] = user_info[1]
+            return user_info
+        return self.registry.get_by_name(name)
+
+    def iter_users(self):
+        """Перебор пользователей из метаданных: пары (user_id, user_data)"""
+        if self._lazy_store:
+            return self._lazy_store.iter_users()
+        return iter(self.user_metadata.get("users", {}).items())
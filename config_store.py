@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Атомарная запись конфигурации и метаданных с журналом
+
+Запись нескольких файлов выполняется в три шага:
+1. Новое содержимое пишется во временные файлы `<путь>.tmp` с fsync.
+2. Атомарно записывается журнал `<config>.journal` со списком файлов - точка фиксации
+   (хранилище метаданных SQLite ведет журнал в своей базе, см. metadata_store.py).
+3. Временные файлы переименовываются поверх рабочих, журнал удаляется.
+
+Если процесс упал до записи журнала, при следующей загрузке временные файлы
+удаляются (откат). Если после - переименования повторяются (повтор по журналу).
+"""
+
+import fcntl
+import json
+import os
+
+
+def _fsync_dir(path):
+    """fsync директории, чтобы переименование файла пережило сбой питания"""
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def _write_file(path, data):
+    """Запись байтов в файл с fsync"""
+    with open(path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def atomic_write(path, data):
+    """Атомарная запись одного файла: временный файл, fsync и rename"""
+    tmp_path = f"{path}.tmp"
+    _write_file(tmp_path, data)
+    os.replace(tmp_path, path)
+    _fsync_dir(path)
+
+
+class ConfigConflictError(Exception):
+    """Конфигурация изменена другим процессом после загрузки"""
+
+
+class FileLock:
+    """Межпроцессная рекомендательная блокировка (fcntl.flock) на отдельном файле"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self, blocking=True, shared=False):
+        """Захват блокировки (shared - разделяемая, для чтения), без blocking возвращает False, если она занята"""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class FileJournal:
+    """Журнал транзакции в отдельном файле"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def commit(self, pending):
+        """Атомарная запись журнала - точка фиксации транзакции"""
+        atomic_write(self.path, json.dumps({"files": pending}).encode('utf-8'))
+
+    def read(self):
+        """Чтение журнала, возвращает {путь: временный путь} или None"""
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r') as f:
+            return json.load(f)["files"]
+
+    def clear(self):
+        """Удаление журнала после применения транзакции"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            # Журнал уже применил другой процесс, читавший конфигурацию параллельно
+            return
+        _fsync_dir(self.path)
+
+
+class ConfigStore:
+    """Транзакционное хранилище для согласованной записи нескольких файлов"""
+
+    def __init__(self, config_path, journal=None):
+        self.config_path = config_path
+        self.journal = journal or FileJournal(f"{config_path}.journal")
+
+    def write(self, files):
+        """Согласованная запись нескольких файлов: {путь: байты}"""
+        pending = {}
+        for path, data in files.items():
+            tmp_path = f"{path}.tmp"
+            _write_file(tmp_path, data)
+            pending[path] = tmp_path
+
+        # Точка фиксации: после записи журнала транзакция считается выполненной
+        self.journal.commit(pending)
+
+        self._apply(pending)
+
+    def _apply(self, pending):
+        """Переименование временных файлов поверх рабочих и удаление журнала"""
+        for path, tmp_path in pending.items():
+            try:
+                os.replace(tmp_path, path)
+            except FileNotFoundError:
+                pass
+        if pending:
+            _fsync_dir(next(iter(pending)))
+
+        self.journal.clear()
+
+    def recover(self, paths):
+        """Восстановление после сбоя: повтор по журналу или откат
+
+        Возвращает "replayed", "rolled_back" или None, если восстановление не требовалось.
+        """
+        pending = self.journal.read()
+        if pending is not None:
+            self._apply(pending)
+            return "replayed"
+
+        rolled_back = False
+        for path in paths:
+            tmp_path = f"{path}.tmp"
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+                rolled_back = True
+        return "rolled_back" if rolled_back else None
+
+
+def check_consistency(inbounds, metadata):
+    """Проверка согласованности inbound пользователей ({тег: inbound}, см. ConfigManager.get_user_inbounds) и метаданных
+
+    Возвращает список проблем.
+    """
+    problems = []
+    users = metadata.get("users", {})
+
+    # Inbound каждого клиента и shortId (None - основной inbound)
+    client_ids = {}
+    short_id_set = {}
+    for tag, inbound in inbounds.items():
+        for client in inbound["settings"]["clients"]:
+            if client["id"] in client_ids:
+                problems.append(f"Клиент {client['id']} встречается в clients несколько раз")
+            client_ids[client["id"]] = tag
+
+        for short_id in inbound["streamSettings"]["realitySettings"].get("shortIds", []):
+            if short_id in short_id_set:
+                problems.append(f"shortId {short_id} встречается в shortIds несколько раз")
+            short_id_set[short_id] = tag
+
+    names = set()
+    user_short_ids = set()
+    for user_id, user_data in users.items():
+        name = user_data.get("name")
+        if name in names:
+            problems.append(f"Имя пользователя {name} используется несколько раз")
+        names.add(name)
+
+        tag = user_data.get("inbound")
+        if tag is not None and tag not in inbounds:
+            problems.append(f"Inbound {tag} пользователя {name} отсутствует в конфигурации")
+
+        if user_id not in client_ids:
+            problems.append(f"Пользователь {name} ({user_id}) есть в метаданных, но отсутствует в clients")
+        elif client_ids[user_id] != tag:
+            problems.append(f"Клиент пользователя {name} находится в inbound {client_ids[user_id] or 'основном'}, "
+                            f"а в метаданных указан {tag or 'основной'}")
+
+        short_id = user_data.get("shortId")
+        if short_id:
+            user_short_ids.add(short_id)
+            if short_id not in short_id_set:
+                problems.append(f"shortId {short_id} пользователя {name} отсутствует в shortIds")
+            elif short_id_set[short_id] != tag:
+                problems.append(f"shortId {short_id} пользователя {name} находится в другом inbound")
+
+    for client_id in set(client_ids) - set(users):
+        problems.append(f"Клиент {client_id} есть в clients, но отсутствует в метаданных")
+
+    for short_id in set(short_id_set) - user_short_ids:
+        problems.append(f"shortId {short_id} есть в shortIds, но не принадлежит ни одному пользователю")
+
+    return problems
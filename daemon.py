@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Долгоживущий сервис управления с HTTP/JSON API
+
+Состояние ConfigManager и UserManager хранится в памяти. Изменения пользователей
+применяются сразу в памяти, а на диск записываются пачками раз в flush_interval;
+перезапуски и отправка изменений в API Xray объединяются в один на пачку.
+
+Маршруты:
+    GET    /health
+    GET    /users
+    POST   /users                 {"name": "..."} или {"names": [...]}
+    DELETE /users/<name>
+    GET    /users/<name>/link     ?server=
+    GET    /users/<name>/config   ?server=&format=xray|sing-box|clash
+    GET    /users/<name>/qr       ?server=&format=svg  (image/png или image/svg+xml)
+    GET    /users/<name>/subscription
+    GET    /sub/<token>           подписка в base64, ETag/If-None-Match (без авторизации по токену сервиса)
+    POST   /flush
+Ответ на мутирующий запрос отправляется после записи пачки на диск, поэтому запросы,
+пришедшие за один интервал, разделяют одно сохранение. Параметр ?restart=1 запрашивает
+перезапуск Xray после записи (с --hot изменения сначала отправляются через API).
+Если запись не удалась, изменения остаются в памяти и записываются следующей попыткой,
+а запрос получает ответ 202; при конфликте с другим процессом пачка отменяется (409).
+"""
+
+import asyncio
+import hmac
+import json
+import sys
+import time
+import urllib.parse
+
+from client_configs import CLIENT_FORMATS
+from config_store import ConfigConflictError
+from metrics import OperationMetrics, get_metrics_path
+from subscription import SubscriptionService
+from user_manager import UserManager
+
+MAX_BODY_SIZE = 1024 * 1024
+METRICS_FLUSH_INTERVAL = 10
+
+
+class HttpError(Exception):
+    """Ошибка обработки запроса с HTTP-статусом"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ManagementDaemon:
+    """HTTP/JSON API поверх ConfigManager и UserManager"""
+
+    def __init__(self, config_manager, config_path, host="127.0.0.1", port=8080, flush_interval=0.5, hot=False, api_address=None, token=None,
+                 nodes=()):
+        self.config_manager = config_manager
+        self.config_path = config_path
+        self.host = host
+        self.port = port
+        self.flush_interval = flush_interval
+        self.hot = hot
+        self.api_address = api_address
+        self.token = token
+
+        self.user_manager = UserManager(self.config_manager)
+        self.user_manager.enable_artifact_cache(config_path)
+        self.subscriptions = SubscriptionService(self.config_manager, nodes)
+
+        self._dirty = False
+        self._restart_requested = False
+        self._flushed = None
+        self.operation_metrics = OperationMetrics(get_metrics_path(config_path))
+
+    # --- Запись на диск и перезапуск ---
+
+    def _mark_dirty(self, restart=False):
+        """Отметка об изменении состояния, которое нужно записать на диск"""
+        self._dirty = True
+        self._restart_requested = self._restart_requested or restart
+        if self._flushed is None or self._flushed.done():
+            self._flushed = asyncio.get_running_loop().create_future()
+        return self._flushed
+
+    async def flush(self):
+        """Запись накопленных изменений одним сохранением, затем один перезапуск или отправка в API
+
+        Ожидающие запись запросы получают True, если пачка записана, и False, если запись
+        отложена до следующей попытки.
+        """
+        if not self._dirty:
+            return
+
+        restart = self._restart_requested
+        pending_changes, self.user_manager.pending_api_changes = self.user_manager.pending_api_changes, []
+        flushed = self._flushed
+        self._dirty = False
+        self._restart_requested = False
+
+        try:
+            # Сериализация и запись выполняются в цикле событий, чтобы состояние не менялось во время записи
+            if not self.config_manager.save_config(self.config_path):
+                raise OSError("не удалось сохранить конфигурацию")
+        except ConfigConflictError as e:
+            # Конфигурацию изменил другой процесс: состояние перечитывается, пачка отклоняется.
+            # load_config открывает хранилище метаданных заново, старое соединение закрывается
+            self.config_manager.metadata_store.close()
+            self.config_manager.load_config(self.config_path)
+            if flushed and not flushed.done():
+                flushed.set_exception(HttpError(409, f"{e}, изменения отменены, повторите запрос"))
+            raise
+        except Exception as e:
+            # Состояние в памяти остается измененным: следующая запись повторит попытку
+            self._dirty = True
+            self._restart_requested = self._restart_requested or restart
+            self.user_manager.pending_api_changes = pending_changes + self.user_manager.pending_api_changes
+            if flushed and not flushed.done():
+                flushed.set_result(False)
+            raise
+
+        # Записанные ID уже есть в индексах, выданные ID больше не нужно хранить
+        self.user_manager.id_allocator.release()
+
+        try:
+            loop = asyncio.get_running_loop()
+            hot_applied = False
+            if self.hot and pending_changes:
+                hot_applied = await loop.run_in_executor(None, self._apply_hot_changes, pending_changes)
+            if restart and not hot_applied:
+                self._restart_xray()
+        finally:
+            # Изменения уже на диске, ошибки применения не отменяют запись
+            if flushed and not flushed.done():
+                flushed.set_result(True)
+
+    def _apply_hot_changes(self, changes):
+        """Отправка изменений пользователей в запущенный Xray (в потоке)"""
+        from xray_api import XrayApiClient
+
+        api_client = XrayApiClient(self.api_address or self.config_manager.get_api_address())
+        try:
+            return self.user_manager.apply_hot_changes(api_client, changes)
+        finally:
+            api_client.close()
+
+    def _restart_xray(self):
+        """Запрос отложенного перезапуска: исполнитель объединит его с запросами других процессов"""
+        from restart_scheduler import RestartScheduler
+        RestartScheduler(self.config_path, container_name=self.config_manager.container_name).request()
+
+    async def _flush_loop(self):
+        """Периодическая запись изменений"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Ошибка при записи изменений: {e}", file=sys.stderr)
+
+    async def _metrics_loop(self):
+        """Периодическая запись длительностей запросов в общий файл метрик"""
+        while True:
+            await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.operation_metrics.flush()
+            except (OSError, ValueError) as e:
+                print(f"Ошибка при записи метрик: {e}", file=sys.stderr)
+
+    def _operation_name(self, method, path):
+        """Имя операции для метрик: маршрут без имени пользователя"""
+        parts = [part for part in path.strip("/").split("/") if part]
+        if len(parts) > 1 and parts[0] in ("users", "sub"):
+            parts[1] = "{name}" if parts[0] == "users" else "{token}"
+        return f"serve:{method} /{'/'.join(parts)}"
+
+    # --- Обработчики API ---
+
+    async def _server_address(self, query):
+        """Адрес сервера из параметра server или из кэша/опроса AddressResolver"""
+        from address_resolver import AddressResolver
+
+        address = query.get("server", [""])[0]
+        if address:
+            return address
+
+        resolver = AddressResolver(self.config_manager)
+        address = resolver.get_cached()
+        if not address:
+            # Опрос источников - в потоке, запись кэша - в цикле событий
+            address = await asyncio.get_running_loop().run_in_executor(None, resolver.race)
+            if not address:
+                raise HttpError(503, "Не удалось определить адрес сервера, укажите параметр server")
+            resolver.store(address)
+        return address
+
+    def _require_user(self, name):
+        if not self.config_manager.get_client_by_name(name):
+            raise HttpError(404, f"Пользователь {name} не найден")
+
+    async def handle_request(self, method, path, query, body, headers=None):
+        """Маршрутизация запроса
+
+        Возвращает (статус, ответ): ответ - JSON-объект, пара (тип содержимого, байты)
+        или тройка с дополнительными заголовками.
+        """
+        parts = [urllib.parse.unquote(part) for part in path.strip("/").split("/") if part]
+        restart = query.get("restart", ["0"])[0] in ("1", "true")
+
+        if method == "GET" and parts == ["health"]:
+            return 200, {"status": "ok", "users": len(self.config_manager.registry), "dirty": self._dirty}
+
+        if method == "POST" and parts == ["flush"]:
+            try:
+                await self.flush()
+            except ConfigConflictError as e:
+                raise HttpError(409, f"{e}, изменения отменены, повторите запрос")
+            return 200, {"status": "flushed"}
+
+        if parts == ["users"]:
+            if method == "GET":
+                return 200, self.user_manager.list_users()
+            if method == "POST":
+                if "names" in body:
+                    names = body["names"]
+                    # Строка вместо списка перебиралась бы посимвольно
+                    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+                        raise HttpError(400, "Параметр names должен быть списком имен")
+                else:
+                    names = [body["name"]] if body.get("name") else []
+                    if not all(isinstance(name, str) for name in names):
+                        raise HttpError(400, "Параметр name должен быть строкой")
+                if not names:
+                    raise HttpError(400, "Нужно указать name или names")
+                results = self.user_manager.add_users(names, body.get("inbound"))
+                saved = True
+                if any(result["status"] == "added" for result in results):
+                    saved = await self._mark_dirty(restart)
+                return 201 if saved else 202, results if "names" in body else results[0]
+
+        if len(parts) == 2 and parts[0] == "users" and method == "DELETE":
+            results = self.user_manager.remove_users([parts[1]])
+            if results[0]["status"] == "not_found":
+                raise HttpError(404, f"Пользователь {parts[1]} не найден")
+            saved = await self._mark_dirty(restart)
+            return 200 if saved else 202, results[0]
+
+        if len(parts) == 2 and parts[0] == "sub" and method == "GET":
+            server_address = await self._server_address(query)
+            bundle = self.subscriptions.get(parts[1], server_address)
+            if bundle is None:
+                raise HttpError(404, "Подписка не найдена")
+            etag, data = bundle
+            if (headers or {}).get("if-none-match") == etag:
+                return 304, ("text/plain; charset=utf-8", b"", {"ETag": etag})
+            return 200, ("text/plain; charset=utf-8", data, {"ETag": etag, "Cache-Control": "no-cache"})
+
+        if len(parts) == 3 and parts[0] == "users" and method == "GET":
+            name, resource = parts[1], parts[2]
+            self._require_user(name)
+            if resource == "subscription":
+                user_id, _ = self.config_manager.get_client_by_name(name)
+                token = self.subscriptions.token_for(user_id)
+                return 200, {"name": name, "token": token, "path": f"/sub/{token}"}
+
+            server_address = await self._server_address(query)
+
+            if resource == "link":
+                return 200, {"name": name, "link": self.user_manager.generate_vless_link(name, server_address)}
+            if resource == "config":
+                client_format = query.get("format", ["xray"])[0]
+                if client_format not in CLIENT_FORMATS:
+                    raise HttpError(400, f"Параметр format: {', '.join(CLIENT_FORMATS)}")
+                client_config = self.user_manager.render_client_config(name, server_address, client_format)
+                content_type = "application/yaml; charset=utf-8" if client_format == "clash" else "application/json; charset=utf-8"
+                return 200, (content_type, client_config.encode('utf-8'))
+            if resource == "qr":
+                image_format = query.get("format", ["png"])[0]
+                if image_format not in ("png", "svg"):
+                    raise HttpError(400, "Параметр format: png или svg")
+                link = self.user_manager.generate_vless_link(name, server_address)
+                loop = asyncio.get_running_loop()
+                image = await loop.run_in_executor(None, self.user_manager.render_qr, name, link, image_format)
+                return 200, ("image/svg+xml" if image_format == "svg" else "image/png", image)
+
+        raise HttpError(404, "Маршрут не найден")
+
+    # --- HTTP ---
+
+    def _authorized(self, path, headers):
+        # Подписки защищены собственным токеном в адресе: клиентские приложения не передают заголовков
+        if not self.token or path.startswith("/sub/"):
+            return True
+        expected = f"Bearer {self.token}"
+        return hmac.compare_digest(headers.get("authorization", ""), expected)
+
+    async def _handle_connection(self, reader, writer):
+        """Обработка соединения HTTP/1.1 с поддержкой keep-alive"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('latin-1').rstrip("\r\n").split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode('latin-1').partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_SIZE:
+                    await self._write_response(writer, 413, {"error": "Слишком большой запрос"}, False)
+                    break
+                raw_body = await reader.readexactly(length) if length else b""
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                url = urllib.parse.urlsplit(target)
+                query = urllib.parse.parse_qs(url.query)
+
+                started = time.perf_counter()
+                try:
+                    if not self._authorized(url.path, headers):
+                        raise HttpError(401, "Требуется авторизация")
+                    body = json.loads(raw_body) if raw_body else {}
+                    if not isinstance(body, dict):
+                        raise HttpError(400, "Тело запроса должно быть JSON-объектом")
+                    status, payload = await self.handle_request(method, url.path, query, body, headers)
+                except HttpError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except ValueError as e:
+                    status, payload = 400, {"error": f"Некорректный JSON: {e}"}
+                except Exception as e:
+                    status, payload = 500, {"error": str(e)}
+
+                await self._write_response(writer, status, payload, keep_alive)
+                if status != 404:
+                    self.operation_metrics.observe(self._operation_name(method, url.path), time.perf_counter() - started)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _write_response(self, writer, status, payload, keep_alive):
+        extra_headers = {}
+        if isinstance(payload, tuple):
+            content_type, data, *rest = payload
+            extra_headers = rest[0] if rest else {}
+        else:
+            content_type, data = "application/json; charset=utf-8", json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+        reason = {200: "OK", 201: "Created", 202: "Accepted", 304: "Not Modified", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 409: "Conflict",
+                  413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}.get(status, "")
+        head = (
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            + "".join(f"{key}: {value}\r\n" for key, value in extra_headers.items()) +
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + data)
+        await writer.drain()
+
+    async def serve(self):
+        """Запуск HTTP-сервера и цикла записи изменений"""
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        flush_task = asyncio.create_task(self._flush_loop())
+        metrics_task = asyncio.create_task(self._metrics_loop())
+        print(f"Сервис управления слушает http://{self.host}:{self.port}", file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            flush_task.cancel()
+            metrics_task.cancel()
+            await self.flush()
+            self.operation_metrics.flush()
+
+
+def run_daemon(config_manager, config_path, host, port, flush_interval, hot=False, api_address=None, token=None, inventory=None):
+    """Запуск сервиса управления до прерывания"""
+    config_manager.load_config(config_path)
+    if not config_manager.has_reality_settings():
+        print(f"В {config_path} нет настроенного Reality inbound, сначала выполните команду config", file=sys.stderr)
+        return False
+    nodes = []
+    if inventory:
+        from subscription import load_fleet_sources
+        nodes = load_fleet_sources(inventory, config_path)
+    daemon = ManagementDaemon(config_manager, config_path, host, port, flush_interval, hot, api_address, token, nodes)
+    asyncio.run(daemon.serve())
+    return True
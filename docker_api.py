@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Клиент Docker Engine API через Unix-сокет без запуска docker CLI"""
+
+import http.client
+import json
+import os
+import select
+import socket
+import struct
+import urllib.parse
+
+DEFAULT_SOCKET_PATH = "/var/run/docker.sock"
+API_VERSION = "v1.41"
+# Запросы, которые можно безопасно повторить, если ответ не получен
+IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+
+class DockerApiError(Exception):
+    """Ошибка, которую вернул Docker Engine API"""
+
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP-соединение поверх Unix-сокета"""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+    def closed_by_peer(self):
+        """Открытое keep-alive соединение закрыто сервером: сокет читается без отправленного запроса"""
+        if self.sock is None:
+            return False
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        return bool(readable)
+
+
+class DockerApiClient:
+    """Минимальный клиент Docker Engine API с переиспользованием соединения"""
+
+    def __init__(self, socket_path=None, timeout=30):
+        self.socket_path = socket_path or os.environ.get("DOCKER_SOCKET", DEFAULT_SOCKET_PATH)
+        self.timeout = timeout
+        self._connection = None
+
+    def available(self):
+        """Проверка, что сокет существует и Docker отвечает"""
+        if not os.path.exists(self.socket_path):
+            return False
+        try:
+            self.request("GET", "/_ping")
+            return True
+        except (OSError, DockerApiError):
+            return False
+
+    def _open_response(self, method, path, params=None, body=None, dedicated=False, timeout=None):
+        """Отправка запроса, возвращает HTTPResponse"""
+        url = f"/{API_VERSION}{path}"
+        if params:
+            url = f"{url}?{urllib.parse.urlencode(params)}"
+
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers["Content-Type"] = "application/json"
+
+        if dedicated:
+            # Отдельное соединение для потоковых запросов, чтобы не занимать общее
+            connection = UnixHTTPConnection(self.socket_path, timeout)
+        else:
+            if self._connection is None:
+                self._connection = UnixHTTPConnection(self.socket_path, self.timeout)
+            connection = self._connection
+            # Закрытое сервером keep-alive соединение заменяется новым до отправки запроса
+            if connection.closed_by_peer():
+                connection.close()
+
+        try:
+            connection.request(method, url, body=payload, headers=headers)
+            response = connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            # Запрос мог быть выполнен: повторяются только идемпотентные запросы, чтобы не
+            # создать второй контейнер или не перезапустить его дважды
+            if method not in IDEMPOTENT_METHODS:
+                raise
+            connection.request(method, url, body=payload, headers=headers)
+            response = connection.getresponse()
+
+        if response.status >= 400:
+            data = response.read()
+            try:
+                message = json.loads(data).get("message", "")
+            except ValueError:
+                message = data.decode('utf-8', 'replace')
+            raise DockerApiError(response.status, message)
+        return response
+
+    def request(self, method, path, params=None, body=None):
+        """Запрос к API, возвращает разобранный JSON-ответ или None"""
+        response = self._open_response(method, path, params, body)
+        data = response.read()
+        if not data:
+            return None
+        if response.getheader("Content-Type", "").startswith("application/json"):
+            return json.loads(data)
+        return data
+
+    def inspect_container(self, name):
+        """Информация о контейнере или None, если его нет"""
+        try:
+            return self.request("GET", f"/containers/{name}/json")
+        except DockerApiError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def pull_image(self, image):
+        """Загрузка образа (ответ - поток прогресса, читается до конца)"""
+        name, tag = image, "latest"
+        if ":" in image.rsplit("/", 1)[-1]:
+            name, tag = image.rsplit(":", 1)
+        response = self._open_response("POST", "/images/create", {"fromImage": name, "tag": tag})
+        response.read()
+
+    def create_container(self, name, image, cmd, binds=None, port_bindings=None, restart_policy="unless-stopped"):
+        """Создание контейнера, при отсутствии образа он загружается"""
+        exposed_ports = {port: {} for port in (port_bindings or {})}
+        body = {
+            "Image": image,
+            "Cmd": cmd,
+            "ExposedPorts": exposed_ports,
+            "HostConfig": {
+                "Binds": binds or [],
+                "PortBindings": port_bindings or {},
+                "RestartPolicy": {"Name": restart_policy}
+            }
+        }
+        try:
+            return self.request("POST", "/containers/create", {"name": name}, body)
+        except DockerApiError as e:
+            if e.status != 404:
+                raise
+            self.pull_image(image)
+            return self.request("POST", "/containers/create", {"name": name}, body)
+
+    def start_container(self, name):
+        self.request("POST", f"/containers/{name}/start")
+
+    def stop_container(self, name, timeout=10):
+        """Остановка контейнера; уже остановленный контейнер (304) не считается ошибкой"""
+        self.request("POST", f"/containers/{name}/stop", {"t": timeout})
+
+    def restart_container(self, name, timeout=10):
+        self.request("POST", f"/containers/{name}/restart", {"t": timeout})
+
+    def remove_container(self, name, force=False):
+        self.request("DELETE", f"/containers/{name}", {"force": int(force)})
+
+    def logs(self, name, tail=100, follow=False, since=None):
+        """Логи контейнера: генератор пар (stream, bytes), где stream - "stdout" или "stderr"
+
+        Поток логов контейнера без TTY мультиплексирован: каждый кадр начинается
+        с 8-байтового заголовка (номер потока и длина данных).
+        """
+        params = {"stdout": 1, "stderr": 1, "tail": tail if tail is not None else "all", "follow": int(follow)}
+        if since:
+            params["since"] = since
+        # При follow чтение блокируется до появления новых строк, поэтому без таймаута
+        response = self._open_response(
+            "GET", f"/containers/{name}/logs", params, dedicated=True, timeout=None if follow else self.timeout
+        )
+        try:
+            while True:
+                header = response.read(8)
+                if len(header) < 8:
+                    return
+                stream_type, size = struct.unpack(">BxxxL", header)
+                yield ("stderr" if stream_type == 2 else "stdout"), response.read(size)
+        finally:
+            response.close()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -5,12 +5,29 @@ import os
 import subprocess
 import json
 
+from docker_api import DockerApiClient, DockerApiError
+
+DEFAULT_CONTAINER_NAME = "xray-reality-container"
+
 class DockerManager:
-    """Класс для управления Docker-контейнером с Xray"""
+    """Класс для управления Docker-контейнером с Xray
 
-    def __init__(self):
-        self.container_name = "xray-reality-container"
+    Если доступен сокет Docker Engine API, операции выполняются прямыми
+    запросами к API, иначе - через docker CLI.
+    """
+
+    def __init__(self, use_api=True, container_name=None):
+        # Имя контейнера задается явно (узлы флота) или переменной окружения XRAY_CONTAINER_NAME
+        self.container_name = container_name or os.environ.get("XRAY_CONTAINER_NAME", DEFAULT_CONTAINER_NAME)
         self.image_name = "ghcr.io/xtls/xray-core:latest"
+        self.api = DockerApiClient() if use_api else None
+        self._api_available = None
+
+    def _use_api(self):
+        """Проверка (один раз) доступности Docker Engine API"""
+        if self._api_available is None:
+            self._api_available = bool(self.api and self.api.available())
+        return self._api_available
 
     def _check_docker(self):
         """Проверка доступности Docker"""
@@ -25,8 +42,28 @@ class DockerManager:
             print("Docker не установлен или недоступен")
             return False
 
+    def get_container_state(self):
+        """Состояние контейнера (секция State из inspect) или None, если контейнера нет"""
+        if self._use_api():
+            info = self.api.inspect_container(self.container_name)
+            return info["State"] if info else None
+
+        try:
+            result = subprocess.run(
+                ["docker", "inspect", "--format", "{{json .State}}", self.container_name],
+                capture_output=True,
+                text=True,
+                check=True
+            )
+            return json.loads(result.stdout)
+        except (subprocess.SubprocessError, FileNotFoundError, ValueError):
+            return None
+
     def _check_container_exists(self):
         """Проверка, существует ли контейнер"""
+        if self._use_api():
+            return self.get_container_state() is not None
+
         try:
             result = subprocess.run(
                 ["docker", "ps", "-a", "--format", "{{.Names}}"],
@@ -40,6 +77,10 @@ class DockerManager:
 
     def _check_container_running(self):
         """Проверка, запущен ли контейнер"""
+        if self._use_api():
+            state = self.get_container_state()
+            return bool(state and state.get("Running"))
+
         try:
             result = subprocess.run(
                 ["docker", "ps", "--format", "{{.Names}}"],
@@ -58,8 +99,67 @@ class DockerManager:
             os.makedirs(config_dir)
         return config_dir
 
-    def start_xray(self, config_path, detach=False, host_port=443):
-        """Запуск Xray в Docker-контейнере"""
+    def _get_published_ports(self, config_path, host_port=None):
+        """Пробрасываемые порты inbound из конфигурации: список (адрес хоста, порт хоста, порт контейнера)
+
+        Основной inbound публикуется на host_port (по умолчанию на своем порту), остальные
+        inbound (например, inbound со старым ключом во время ротации) - на своих портах,
+        API Xray - только на loopback хоста.
+        """
+        try:
+            with open(config_path, 'r') as f:
+                inbounds = json.load(f).get("inbounds", [])
+        except (OSError, ValueError):
+            inbounds = [{"port": 443}]
+
+        ports = []
+        for i, inbound in enumerate(inbounds):
+            port = inbound.get("port")
+            if not port:
+                continue
+            if inbound.get("tag") == "api":
+                ports.append(("127.0.0.1", port, port))
+            else:
+                ports.append(("", (host_port or port) if i == 0 else port, port))
+        return ports
+
+    def _start_xray_api(self, config_path, host_port):
+        """Запуск контейнера через Docker Engine API"""
+        try:
+            # Удалить существующий контейнер одним запросом (с остановкой)
+            if self.api.inspect_container(self.container_name):
+                self.api.remove_container(self.container_name, force=True)
+
+            config_dir = self._prepare_config_dir(config_path)
+            config_file = os.path.basename(config_path)
+
+            port_bindings = {}
+            for host_ip, published_port, container_port in self._get_published_ports(config_path, host_port):
+                binding = {"HostIp": host_ip, "HostPort": str(published_port)} if host_ip else {"HostPort": str(published_port)}
+                port_bindings[f"{container_port}/tcp"] = [binding]
+
+            self.api.create_container(
+                self.container_name, self.image_name,
+                ["run", "-c", f"/etc/xray/{config_file}"],
+                binds=[f"{config_dir}:/etc/xray"],
+                port_bindings=port_bindings
+            )
+            self.api.start_container(self.container_name)
+            print(f"Xray запущен в фоновом режиме в контейнере {self.container_name}")
+            return True
+        except (OSError, DockerApiError) as e:
+            print(f"Ошибка при запуске контейнера: {e}")
+            return False
+
+    def start_xray(self, config_path, detach=False, host_port=None):
+        """Запуск Xray в Docker-контейнере
+
+        Публикуются порты всех inbound конфигурации; host_port - порт хоста для основного inbound.
+        """
+        # Запуск в текущем терминале требует docker CLI, в фоне - достаточно API
+        if detach and self._use_api():
+            return self._start_xray_api(config_path, host_port)
+
         if not self._check_docker():
             return False
 
@@ -76,10 +176,14 @@ class DockerManager:
             "docker", "run",
             "--name", self.container_name,
             "-v", f"{config_dir}:/etc/xray",
-            "-p", f"{host_port}:443/tcp",
             "--restart", "unless-stopped"
         ]
 
+        # Порты всех inbound, API Xray - только на loopback хоста
+        for host_ip, published_port, container_port in self._get_published_ports(config_path, host_port):
+            address = f"{host_ip}:{published_port}" if host_ip else str(published_port)
+            cmd.extend(["-p", f"{address}:{container_port}/tcp"])
+
         if detach:
             cmd.append("-d")
 
@@ -101,8 +205,28 @@ class DockerManager:
             print(f"Ошибка при запуске контейнера: {e}")
             return False
 
+    def _stop_xray_api(self):
+        """Остановка и удаление контейнера через Docker Engine API"""
+        try:
+            self.api.stop_container(self.container_name)
+            self.api.remove_container(self.container_name)
+            print(f"Контейнер {self.container_name} остановлен и удален")
+            return True
+        except DockerApiError as e:
+            if e.status == 404:
+                print("Контейнер не существует")
+                return True
+            print(f"Ошибка при остановке контейнера: {e}")
+            return False
+        except OSError as e:
+            print(f"Ошибка при остановке контейнера: {e}")
+            return False
+
     def stop_xray(self):
         """Остановка и удаление контейнера Xray"""
+        if self._use_api():
+            return self._stop_xray_api()
+
         if not self._check_docker():
             return False
 
@@ -130,29 +254,68 @@ class DockerManager:
             print(f"Ошибка при остановке контейнера: {e}")
             return False
 
-    def get_container_logs(self, tail=100):
-        """Получение логов контейнера"""
-        if not self._check_docker():
-            return None
+    def stream_container_logs(self, tail=100, follow=False, since=None):
+        """Логи контейнера построчно: генератор (stream, строка)
 
-        if not self._check_container_exists():
-            print("Контейнер не существует")
-            return None
+        Логи читаются по мере потребления: пока вызывающий код не запросит следующую
+        строку, чтение из сокета Docker или из `docker logs` не продолжается.
+        since - unix timestamp. Ошибки Docker API выбрасываются как DockerApiError.
+        """
+        from xray_logs import iter_lines, read_chunks
+
+        if self._use_api():
+            yield from iter_lines(self.api.logs(self.container_name, tail, follow, since))
+            return
 
+        command = ["docker", "logs", f"--tail={tail if tail is not None else 'all'}"]
+        if follow:
+            command.append("--follow")
+        if since:
+            command.append(f"--since={int(since)}")
+        command.append(self.container_name)
+
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         try:
-            result = subprocess.run(
-                ["docker", "logs", f"--tail={tail}", self.container_name],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            return result.stdout
-        except subprocess.SubprocessError as e:
+            yield from iter_lines(read_chunks(process.stdout))
+        finally:
+            process.terminate()
+            process.wait()
+
+    def get_container_logs(self, tail=100):
+        """Получение логов контейнера одной строкой"""
+        if not self._use_api():
+            if not self._check_docker():
+                return None
+            if not self._check_container_exists():
+                print("Контейнер не существует")
+                return None
+
+        try:
+            return "".join(f"{line}\n" for stream, line in self.stream_container_logs(tail) if stream == "stdout")
+        except DockerApiError as e:
+            print("Контейнер не существует" if e.status == 404 else f"Ошибка при получении логов: {e}")
+            return None
+        except OSError as e:
             print(f"Ошибка при получении логов: {e}")
             return None
 
     def restart_xray(self):
         """Перезапуск контейнера Xray"""
+        if self._use_api():
+            try:
+                self.api.restart_container(self.container_name)
+                print(f"Контейнер {self.container_name} перезапущен")
+                return True
+            except DockerApiError as e:
+                if e.status == 404:
+                    print("Контейнер не существует, нечего перезапускать")
+                else:
+                    print(f"Ошибка при перезапуске контейнера: {e}")
+                return False
+            except OSError as e:
+                print(f"Ошибка при перезапуске контейнера: {e}")
+                return False
+
         if not self._check_docker():
             return False
 
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Пакетный экспорт VLESS-ссылок, клиентских конфигураций и QR-кодов"""
+
+import os
+import re
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from client_configs import FILE_SUFFIXES
+from qr_codes import render_qr_png
+
+
+def safe_file_name(name):
+    """Имя файла из имени пользователя без разделителей путей и спецсимволов"""
+    return re.sub(r'[^\w.-]', '_', name) or "_"
+
+
+class DirectoryWriter:
+    """Запись артефактов экспорта в директорию"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, file_name, data):
+        with open(os.path.join(self.path, file_name), 'wb') as f:
+            f.write(data)
+
+    def close(self):
+        pass
+
+
+class ZipWriter:
+    """Запись артефактов экспорта в zip-архив (файл или stdout)"""
+
+    def __init__(self, path):
+        stream = sys.stdout.buffer if path == "-" else path
+        self.archive = zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED)
+
+    def write(self, file_name, data):
+        # PNG уже сжат, повторное сжатие только тратит время
+        compress_type = zipfile.ZIP_STORED if file_name.endswith(".png") else zipfile.ZIP_DEFLATED
+        self.archive.writestr(file_name, data, compress_type=compress_type)
+
+    def close(self):
+        self.archive.close()
+
+
+def open_writer(output):
+    """Выбор способа записи: zip для путей *.zip и "-" (stdout), иначе директория"""
+    if output == "-" or output.endswith(".zip"):
+        return ZipWriter(output)
+    return DirectoryWriter(output)
+
+
+def export_users(user_manager, output, names=None, server_address="", workers=None, with_qr=True, formats=("xray",)):
+    """Экспорт ссылок, конфигураций и QR-кодов для всех пользователей или списка names
+
+    Внешний IP определяется один раз на весь экспорт, конфигурации клиентов в форматах
+    formats заполняются по общим шаблонам (client_configs.py), растеризация QR-кодов
+    выполняется в пуле процессов. Возвращает список результатов по пользователям.
+    """
+    if not server_address:
+        server_address = user_manager.get_external_ip()
+        if not server_address:
+            print("Не удалось автоматически определить IP-адрес сервера. Укажите адрес с помощью параметра --server", file=sys.stderr)
+            return []
+
+    if names is None:
+        names = [user_data["name"] for _, user_data in user_manager.config_manager.iter_users()]
+
+    results = []
+    exported = []
+    for name in names:
+        # Проверка заранее, чтобы генераторы не печатали в stdout, куда может писаться архив
+        user_info = user_manager.config_manager.get_client_by_name(name)
+        if not user_info:
+            results.append({"name": name, "status": "not_found"})
+            continue
+        link = user_manager.generate_vless_link(name, server_address)
+        renderer = user_manager.client_renderer(server_address, user_info[1].get("inbound"))
+        client_configs = {fmt: renderer.render(*user_info, fmt) for fmt in formats}
+        exported.append((name, link, client_configs))
+
+    writer = open_writer(output)
+    try:
+        for name, link, client_configs in exported:
+            file_name = safe_file_name(name)
+            writer.write(f"{file_name}.txt", link.encode('utf-8'))
+            for fmt, client_config in client_configs.items():
+                writer.write(f"{file_name}{FILE_SUFFIXES[fmt]}", client_config.encode('utf-8'))
+
+        if with_qr and exported:
+            # Из кэша артефактов берутся готовые QR-коды, в пуле растеризуются только отсутствующие
+            cache = user_manager.artifact_cache
+            missing = []
+            for name, link, _ in exported:
+                user_id = user_manager.config_manager.get_client_by_name(name)[0]
+                image = cache.get(user_id, "png", link) if cache else None
+                if image is None:
+                    missing.append((name, user_id, link))
+                else:
+                    writer.write(f"{safe_file_name(name)}.png", image)
+
+            if missing:
+                links = [link for _, _, link in missing]
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    images = executor.map(render_qr_png, links, chunksize=max(1, len(links) // 64))
+                    for (name, user_id, link), image in zip(missing, images):
+                        writer.write(f"{safe_file_name(name)}.png", image)
+                        if cache:
+                            cache.put(user_id, "png", link, image)
+    finally:
+        writer.close()
+
+    results.extend({"name": name, "status": "exported"} for name, _, _ in exported)
+    return results
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Управление несколькими узлами Xray (флотом)
+
+Узлы описываются в файле инвентаря (по умолчанию fleet.json):
+
+    {
+      "nodes": [
+        {"name": "nl-1", "config": "/srv/xray/nl-1/config.json", "container": "xray-nl-1"},
+        {"name": "de-1", "transport": "command", "config": "/opt/xray/config.json",
+         "command": ["ssh", "de-1", "python3", "/opt/xray/main.py"]}
+      ]
+    }
+
+У каждого узла своя конфигурация, а метаданные лежат рядом с ней, как у одиночного сервера.
+Транспорт "local" (по умолчанию) выполняет операции в текущем процессе, транспорт
+"command" - запуском CLI менеджера через команду узла (ssh или любую другую обертку),
+к которой добавляются аргументы команды. Операции над узлами выполняются параллельно
+в пуле потоков ограниченного размера, результат возвращается отдельно для каждого узла.
+"""
+
+import json
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DEFAULT_INVENTORY = "fleet.json"
+DEFAULT_PARALLEL = 8
+COMMAND_TIMEOUT = 120
+
+
+class FleetError(Exception):
+    """Ошибка инвентаря или выполнения операции на узле"""
+
+
+def _require_config(config_path):
+    if not os.path.exists(config_path):
+        raise FleetError(f"конфигурация {config_path} не найдена")
+
+
+def node_status(config_manager, config_path, container_name=None):
+    """Состояние узла: пользователи, поколение конфигурации, порт, ключ и контейнер"""
+    from docker_manager import DockerManager
+
+    _require_config(config_path)
+    # Полная загрузка без блокировки: в ленивом режиме SQLite config.json не читается,
+    # а shortIds, порт и inbounds берутся из него
+    config_manager.load_config(config_path)
+    state = DockerManager(container_name=container_name).get_container_state()
+    server_info = config_manager.get_server_info()
+    user_inbounds = config_manager.get_user_inbounds()
+    return {
+        "users": len(list(config_manager.iter_users())),
+        # shortId пользователей распределены по всем inbound пользователей
+        "shortIds": sum(len(config_manager.get_reality_settings(tag).get("shortIds", [])) for tag in user_inbounds),
+        "generation": config_manager.generation,
+        "port": config_manager.get_inbound().get("port"),
+        "inbounds": len(user_inbounds),
+        "publicKey": server_info.get("publicKey"),
+        "container": "missing" if state is None else ("running" if state.get("Running") else "stopped"),
+    }
+
+
+class LocalTransport:
+    """Узел на этом хосте: операции выполняются в текущем процессе"""
+
+    def __init__(self, node):
+        self.node = node
+
+    def _config_manager(self):
+        from config_manager import ConfigManager
+
+        _require_config(self.node["config"])
+        config_manager = ConfigManager()
+        config_manager.container_name = self.node.get("container")
+        return config_manager
+
+    def _change_users(self, name, add, restart):
+        from user_manager import UserManager
+
+        config_manager = self._config_manager()
+        config_manager.load_config(self.node["config"], lock=True)
+        try:
+            user_manager = UserManager(config_manager)
+            result = (user_manager.add_users if add else user_manager.remove_users)([name])[0]
+            if result["status"] in ("added", "removed"):
+                if not config_manager.save_config(self.node["config"], restart):
+                    raise FleetError("не удалось сохранить конфигурацию")
+            return result
+        finally:
+            config_manager.release_lock()
+
+    def add_user(self, name, restart=False):
+        return self._change_users(name, True, restart)
+
+    def remove_user(self, name, restart=False):
+        return self._change_users(name, False, restart)
+
+    def rotate_keys(self, restart=False):
+        config_manager = self._config_manager()
+        config_manager.load_config(self.node["config"], lock=True)
+        try:
+            private_key, public_key = config_manager.generate_keys()
+            config_manager.update_keys(private_key, public_key)
+            if not config_manager.save_config(self.node["config"], restart):
+                raise FleetError("не удалось сохранить конфигурацию")
+            return {"publicKey": public_key}
+        finally:
+            config_manager.release_lock()
+
+    def status(self):
+        return node_status(self._config_manager(), self.node["config"], self.node.get("container"))
+
+
+class CommandTransport:
+    """Узел, управляемый запуском CLI менеджера через команду узла
+
+    Команда узла (например, ["ssh", "de-1", "python3", "/opt/xray/main.py"]) дополняется
+    аргументами команды CLI и --config узла. Имя контейнера на удаленном узле задается
+    там же переменной окружения XRAY_CONTAINER_NAME.
+    """
+
+    def __init__(self, node):
+        self.node = node
+        if not node.get("command"):
+            raise FleetError(f"у узла {node['name']} с транспортом command не указана команда")
+
+    def _execute(self, args, input=None):
+        """Запуск команды узла с аргументами CLI, возвращает stdout"""
+        try:
+            result = subprocess.run(
+                list(self.node["command"]) + args, input=input, capture_output=True, text=True, timeout=COMMAND_TIMEOUT
+            )
+        except (OSError, subprocess.TimeoutExpired) as e:
+            raise FleetError(str(e))
+        if result.returncode != 0:
+            raise FleetError((result.stderr or result.stdout).strip() or f"код завершения {result.returncode}")
+        return result.stdout
+
+    def _run(self, *args, restart=False, input=None):
+        return self._execute(list(args) + ["--config", self.node["config"]] + (["--restart"] if restart else []), input)
+
+    def _change_users(self, command, name, restart):
+        # Пакетные команды читают имена из stdin и выводят результат в JSONL, как у локального узла
+        output = self._run(command, restart=restart, input=f"{name}\n")
+        try:
+            return json.loads(output.splitlines()[0])
+        except (IndexError, ValueError):
+            raise FleetError(f"некорректный ответ узла: {output.strip()}")
+
+    def add_user(self, name, restart=False):
+        return self._change_users("add-users", name, restart)
+
+    def remove_user(self, name, restart=False):
+        return self._change_users("remove-users", name, restart)
+
+    def rotate_keys(self, restart=False):
+        # У gen-keys путь к конфигурации задается параметром --save-to-config
+        output = self._execute(["gen-keys", "--save-to-config", self.node["config"]] + (["--restart"] if restart else []))
+        public_key = None
+        for line in output.splitlines():
+            if line.startswith("Публичный ключ:"):
+                public_key = line.split(":", 1)[1].strip()
+        return {"publicKey": public_key}
+
+    def status(self):
+        try:
+            return json.loads(self._run("status", "--json"))
+        except ValueError as e:
+            raise FleetError(f"некорректный ответ узла: {e}")
+
+
+TRANSPORTS = {"local": LocalTransport, "command": CommandTransport}
+
+
+def load_inventory(path=DEFAULT_INVENTORY):
+    """Список узлов из файла инвентаря; относительные пути конфигураций локальных узлов - от файла инвентаря"""
+    try:
+        with open(path, 'r') as f:
+            nodes = json.load(f).get("nodes", [])
+    except (OSError, ValueError) as e:
+        raise FleetError(f"не удалось прочитать инвентарь {path}: {e}")
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    names = set()
+    for node in nodes:
+        if not node.get("name") or not node.get("config"):
+            raise FleetError(f"у узла {node} должны быть указаны name и config")
+        if node["name"] in names:
+            raise FleetError(f"узел {node['name']} указан дважды")
+        names.add(node["name"])
+        node.setdefault("transport", "local")
+        if node["transport"] not in TRANSPORTS:
+            raise FleetError(f"неизвестный транспорт {node['transport']} у узла {node['name']}")
+        if node["transport"] == "local":
+            node["config"] = os.path.join(base_dir, node["config"])
+    return nodes
+
+
+def select_nodes(nodes, names=None):
+    """Узлы с указанными именами (все, если names пуст)"""
+    if not names:
+        return nodes
+    unknown = set(names) - {node["name"] for node in nodes}
+    if unknown:
+        raise FleetError(f"узлы не найдены в инвентаре: {', '.join(sorted(unknown))}")
+    return [node for node in nodes if node["name"] in names]
+
+
+def run_on_nodes(nodes, operation, parallel=DEFAULT_PARALLEL, transports=None):
+    """Параллельное выполнение operation(transport) на узлах
+
+    Генератор результатов по мере завершения: {"node", "ok", "result" или "error"}.
+    Ошибка на одном узле не прерывает операцию на остальных.
+    """
+    transports = transports or TRANSPORTS
+
+    def run(node):
+        try:
+            return {"node": node["name"], "ok": True, "result": operation(transports[node["transport"]](node))}
+        except Exception as e:
+            return {"node": node["name"], "ok": False, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        futures = [executor.submit(run, node) for node in nodes]
+        for future in as_completed(futures):
+            yield future.result()
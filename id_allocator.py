@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+
+
+class IdAllocator:
+    """Пакетная генерация UUID и shortId пользователей без запуска внешних процессов"""
+
+    def __init__(self, config_manager, batch_size=64):
+        self.config_manager = config_manager
+        self.batch_size = batch_size
+        self._uuid_pool = []
+        self._short_id_pool = []
+        # ID, уже выданные, но еще не добавленные в конфигурацию
+        self._reserved_ids = set()
+        self._reserved_short_ids = set()
+
+    def _refill_uuids(self):
+        """Генерация пачки UUID версии 4 одним вызовом os.urandom"""
+        import uuid
+
+        raw = os.urandom(16 * self.batch_size)
+        self._uuid_pool.extend(
+            str(uuid.UUID(bytes=raw[i:i + 16], version=4))
+            for i in range(0, len(raw), 16)
+        )
+
+    def _refill_short_ids(self):
+        """Генерация пачки 8-байтовых shortId одним вызовом os.urandom"""
+        raw = os.urandom(8 * self.batch_size).hex()
+        self._short_id_pool.extend(raw[i:i + 16] for i in range(0, len(raw), 16))
+
+    def allocate_uuid(self):
+        """Выдача нового UUID, не совпадающего с существующими"""
+        registry = self.config_manager.registry
+        while True:
+            if not self._uuid_pool:
+                self._refill_uuids()
+            user_id = self._uuid_pool.pop()
+            if user_id not in self._reserved_ids and not registry.has_id(user_id):
+                self._reserved_ids.add(user_id)
+                return user_id
+
+    def allocate_short_id(self):
+        """Выдача нового shortId, не совпадающего с существующими"""
+        registry = self.config_manager.registry
+        while True:
+            if not self._short_id_pool:
+                self._refill_short_ids()
+            short_id = self._short_id_pool.pop()
+            if short_id not in self._reserved_short_ids and not registry.has_short_id(short_id):
+                self._reserved_short_ids.add(short_id)
+                return short_id
+
+    def release(self):
+        """Сброс выданных ID после сохранения: сохраненные ID проверяются по UserRegistry"""
+        self._reserved_ids.clear()
+        self._reserved_short_ids.clear()
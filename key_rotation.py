@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Ротация ключа REALITY и shortId без разрыва подключений клиентов
+
+У inbound REALITY один приватный ключ, поэтому на время ротации старый ключ
+продолжает работать во втором inbound:
+
+1. start - основной inbound копируется в inbound RETIRING_TAG (старый ключ, старый
+   порт, старые shortIds; email клиентов с суффиксом RETIRING_EMAIL_SUFFIX), а основной
+   inbound получает новый ключ, новый порт (по умолчанию порт прошлой ротации или
+   порт + 1) и, по желанию, новые shortId пользователей. Ссылки, конфигурации, QR-коды
+   и подписки строятся по основному inbound, поэтому сразу указывают на новый ключ,
+   а клиенты со старыми ссылками подключаются к старому порту. Контейнер пересоздается
+   один раз, чтобы опубликовать новый порт.
+2. check - пользователь считается перешедшим, если после начала ротации у него появился
+   трафик под основным email (через новый inbound). Источники: база stats-collect,
+   счетчики StatsService (если контейнер запущен после начала ротации) и access-лог.
+3. retire - когда перешли все пользователи или истек срок grace, inbound со старым
+   ключом удаляется: через API Xray без перезапуска или одним отложенным перезапуском.
+
+Состояние хранится в метаданных под ключом "rotation".
+"""
+
+import calendar
+import copy
+import os
+import time
+
+from config_manager import RETIRING_EMAIL_SUFFIX, RETIRING_TAG, ROTATION_KEY
+
+DEFAULT_GRACE = 7 * 86400
+
+
+class RotationError(Exception):
+    """Ротацию нельзя начать или завершить в текущем состоянии"""
+
+
+def _container_started_at(container_name=None):
+    """Время запуска контейнера Xray (timestamp) или None"""
+    from docker_manager import DockerManager
+
+    try:
+        state = DockerManager(container_name=container_name).get_container_state()
+    except Exception:
+        return None
+    if not state or not state.get("Running") or not state.get("StartedAt"):
+        return None
+    try:
+        return calendar.timegm(time.strptime(state["StartedAt"][:19], "%Y-%m-%dT%H:%M:%S"))
+    except ValueError:
+        return None
+
+
+class KeyRotation:
+    """Поэтапная ротация ключа для загруженной конфигурации"""
+
+    def __init__(self, config_manager, config_path):
+        self.config_manager = config_manager
+        self.config_path = config_path
+
+    @property
+    def active(self):
+        return self.config_manager.get_retiring_inbound() is not None
+
+    @property
+    def state(self):
+        return self.config_manager.user_metadata.get(ROTATION_KEY) or {}
+
+    def start(self, port=None, grace=DEFAULT_GRACE, rotate_short_ids=False, use_docker=False):
+        """Начало ротации: новый ключ в основном inbound, старый - в inbound RETIRING_TAG
+
+        Возвращает состояние ротации.
+        """
+        config_manager = self.config_manager
+        if self.active:
+            raise RotationError("ротация уже идет, завершите ее командой rotation-retire")
+        if len(config_manager.get_user_inbounds()) > 1:
+            raise RotationError("ротация поддерживается только для конфигурации с одним inbound пользователей")
+
+        inbound = config_manager.get_inbound()
+        old_port = inbound["port"]
+        new_port = port or self.state.get("sparePort") or old_port + 1
+        used_ports = {other.get("port") for other in config_manager.config["inbounds"]}
+        if new_port in used_ports:
+            raise RotationError(f"порт {new_port} уже используется inbound конфигурации")
+
+        # Старый ключ остается в копии inbound; email клиентов нужны Xray для учета трафика
+        config_manager.ensure_client_emails()
+        retiring_inbound = copy.deepcopy(inbound)
+        retiring_inbound["tag"] = RETIRING_TAG
+        for client in retiring_inbound["settings"]["clients"]:
+            client["email"] = f"{client.get('email') or client['id']}{RETIRING_EMAIL_SUFFIX}"
+        config_manager.config["inbounds"].append(retiring_inbound)
+
+        old_public_key = config_manager.user_metadata.get("server", {}).get("publicKey")
+        private_key, public_key = config_manager.generate_keys(use_docker)
+        config_manager.update_keys(private_key, public_key)
+        config_manager.update_port(new_port)
+        if rotate_short_ids:
+            self._rotate_short_ids()
+
+        config_manager.user_metadata[ROTATION_KEY] = {
+            "startedAt": time.time(),
+            "grace": grace,
+            "port": old_port,
+            "publicKey": old_public_key,
+            "users": [user_id for user_id, _ in config_manager.iter_users()],
+            "moved": {},
+        }
+        return self.state
+
+    def _rotate_short_ids(self):
+        """Новые shortId всех пользователей в основном inbound (старые остаются в inbound со старым ключом)"""
+        from id_allocator import IdAllocator
+
+        registry = self.config_manager.registry
+        allocator = IdAllocator(self.config_manager)
+        for user_id, user_data in list(self.config_manager.iter_users()):
+            short_id = allocator.allocate_short_id()
+            if user_data.get("shortId"):
+                registry.remove_short_id(user_data["shortId"])
+            registry.add_short_id(short_id, user_data.get("inbound"))
+            registry.set_user(user_id, dict(user_data, shortId=short_id))
+
+    def _active_since(self, names, started):
+        """Имена из names с трафиком под основным email после started и использованные источники"""
+        from access_log import AccessLogAnalyzer, get_access_stats_path
+        from stats import USER_STATS_PATTERN, StatsStore, get_stats_path, parse_user_stats
+
+        config_manager = self.config_manager
+        active = set()
+        sources = []
+
+        stats_store = StatsStore(get_stats_path(self.config_path))
+        if stats_store.exists():
+            totals = stats_store.totals()
+            stats_store.close()
+            active.update(name for name in names if name in totals and totals[name][2] >= started)
+            sources.append("stats")
+        elif config_manager.has_stats() and (_container_started_at(config_manager.container_name) or 0) >= started:
+            # Без stats-collect счетчики не сбрасываются и накоплены с запуска контейнера
+            from xray_api import XrayApiClient, XrayApiError
+
+            api_client = XrayApiClient(config_manager.get_api_address())
+            try:
+                counters = parse_user_stats(api_client.query_stats(USER_STATS_PATTERN))
+                active.update(name for name, values in counters.items() if name in names and any(values))
+                sources.append("api")
+            except XrayApiError:
+                pass
+            finally:
+                api_client.close()
+
+        log_path = config_manager.get_access_log_path(self.config_path)
+        if log_path and os.path.exists(log_path):
+            analyzer = AccessLogAnalyzer(log_path, get_access_stats_path(self.config_path))
+            try:
+                analyzer.update()
+                # Время в логе Xray - UTC
+                cutoff = time.strftime("%Y/%m/%d %H:%M:%S", time.gmtime(started))
+                seen = analyzer.last_seen()
+            finally:
+                analyzer.close()
+            active.update(name for name in names if seen.get(name, "") >= cutoff)
+            sources.append("access-log")
+
+        return active, sources
+
+    def check(self):
+        """Обновление списка перешедших пользователей
+
+        Возвращает {"moved", "pending" (имена ожидающих), "sources", "expired"}.
+        Пользователи, добавленные после начала ротации, старого ключа не знают и не учитываются.
+        """
+        if not self.active:
+            raise RotationError("ротация не начата")
+        state = self.state
+        started_users = set(state["users"])
+        pending = {}
+        for user_id, user_data in self.config_manager.iter_users():
+            if user_id in started_users and user_id not in state["moved"]:
+                pending[user_data["name"]] = user_id
+
+        active, sources = self._active_since(set(pending), state["startedAt"])
+        now = time.time()
+        for name in active:
+            state["moved"][pending.pop(name)] = now
+
+        return {
+            "moved": len(state["moved"]),
+            "pending": sorted(pending),
+            "sources": sources,
+            "expired": now >= state["startedAt"] + state["grace"],
+        }
+
+    def retire(self):
+        """Удаление inbound со старым ключом, возвращает итоговое состояние ротации"""
+        if not self.active:
+            raise RotationError("ротация не начата")
+        config_manager = self.config_manager
+        inbounds = config_manager.config["inbounds"]
+        inbounds[:] = [inbound for inbound in inbounds if inbound.get("tag") != RETIRING_TAG]
+
+        state = self.state
+        # Освободившийся порт используется следующей ротацией: порты чередуются
+        config_manager.user_metadata[ROTATION_KEY] = {
+            "sparePort": state["port"],
+            "startedAt": state["startedAt"],
+            "retiredAt": time.time(),
+            "moved": len(state["moved"]),
+            "users": len(state["users"]),
+        }
+        return self.state
@@ -4,9 +4,126 @@
 import argparse
 import sys
 import json
-from config_manager import ConfigManager
-from user_manager import UserManager
-from docker_manager import DockerManager
+
+# Модули менеджеров импортируются только для команд, которым они нужны
+DOCKER_COMMANDS = {'start', 'stop', 'logs'}
+USER_COMMANDS = {
+    'add-user', 'remove-user', 'add-users', 'remove-users',
+    'qr', 'get-config', 'vless-link', 'list-users', 'export'
+}
+
+# Команды, изменяющие конфигурацию или контейнер: их длительность записывается в метрики операций.
+# Команды только для чтения не записывают файл метрик, чтобы не замедлять запуск
+RECORDED_COMMANDS = {
+    'config', 'start', 'add-user', 'remove-user', 'add-users', 'remove-users', 'gen-keys',
+    'inbound-add', 'inbound-remove', 'rotation-start', 'rotation-status', 'rotation-retire', 'migrate-metadata'
+}
+
+
+def record_command(config_path, command, seconds):
+    """Запись длительности команды в метрики операций (см. metrics.py)"""
+    from metrics import record_operation
+    record_operation(config_path, f"cli:{command}", seconds)
+
+
+def add_hot_arguments(parser):
+    """Параметры применения изменений пользователей через API Xray"""
+    parser.add_argument('--hot', action='store_true', help='Применить изменения к запущенному Xray через API без перезапуска')
+    parser.add_argument('--api', type=str, help='Адрес API Xray (по умолчанию из конфигурации, 127.0.0.1:10085)')
+
+
+def add_fleet_arguments(parser, restart=True):
+    """Параметры команд флота: инвентарь, выбор узлов, параллельность"""
+    parser.add_argument('--inventory', type=str, default='fleet.json', help='Файл инвентаря узлов')
+    parser.add_argument('--nodes', type=str, nargs='+', help='Имена узлов (по умолчанию все узлы инвентаря)')
+    parser.add_argument('--parallel', type=int, default=8, help='Количество узлов, обрабатываемых одновременно')
+    parser.add_argument('--json', action='store_true', help='Выводить результаты по узлам в формате JSONL')
+    if restart:
+        parser.add_argument('--restart', action='store_true', help='Перезапустить Xray на узлах после изменения')
+
+
+def run_fleet_command(args, operation):
+    """Выполнение операции на узлах флота с выводом результата каждого узла по мере готовности"""
+    from fleet import FleetError, load_inventory, run_on_nodes, select_nodes
+
+    try:
+        nodes = select_nodes(load_inventory(args.inventory), args.nodes)
+    except FleetError as e:
+        print(f"Ошибка: {e}")
+        sys.exit(1)
+
+    failed = 0
+    for result in run_on_nodes(nodes, operation, args.parallel):
+        failed += not result["ok"]
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+        elif result["ok"]:
+            print(f"{result['node']}: {json.dumps(result['result'], ensure_ascii=False)}", flush=True)
+        else:
+            print(f"{result['node']}: ошибка: {result['error']}", flush=True)
+
+    if not args.json:
+        print(f"Узлов: {len(nodes)}, успешно: {len(nodes) - failed}, с ошибками: {failed}")
+    if failed:
+        sys.exit(1)
+
+
+def save_user_changes(config_manager, user_manager, args):
+    """Сохранение изменений пользователей, применение через API и перезапуск при необходимости
+
+    Возвращает True, если запланирован перезапуск сервера. Если конфигурация не сохранена,
+    изменения не применяются к Xray и команда завершается с ошибкой.
+    """
+    if not config_manager.save_config(args.config):
+        print("Ошибка: изменения пользователей не сохранены", file=sys.stderr)
+        sys.exit(1)
+
+    hot_applied = False
+    if args.hot:
+        from xray_api import XrayApiClient
+
+        api_client = XrayApiClient(args.api or config_manager.get_api_address())
+        hot_applied = user_manager.apply_hot_changes(api_client)
+        api_client.close()
+        if hot_applied:
+            print("Изменения применены к запущенному Xray без перезапуска", file=sys.stderr)
+        elif args.restart:
+            print("Не удалось применить изменения через API, запрашиваю перезапуск", file=sys.stderr)
+
+    if args.restart and not hot_applied:
+        from restart_scheduler import schedule_restart
+        schedule_restart(args.config)
+        return True
+    return False
+
+
+def retire_rotation(config_manager, rotation, args):
+    """Завершение ротации: сохранение конфигурации и удаление inbound со старым ключом через API или перезапуском"""
+    summary = rotation.retire()
+    if not config_manager.save_config(args.config):
+        print("Ошибка: конфигурация не сохранена, ротация не завершена", file=sys.stderr)
+        sys.exit(1)
+    print(f"Ротация завершена: перешли {summary['moved']} из {summary['users']} пользователей, "
+          f"старый ключ отключен", file=sys.stderr)
+
+    if args.hot:
+        from config_manager import RETIRING_TAG
+        from xray_api import XrayApiClient, XrayApiError
+
+        api_client = XrayApiClient(args.api or config_manager.get_api_address())
+        try:
+            api_client.remove_inbound(RETIRING_TAG)
+            print("Inbound со старым ключом удален из запущенного Xray без перезапуска", file=sys.stderr)
+            return
+        except XrayApiError as e:
+            print(f"Ошибка при удалении inbound через API Xray: {e}", file=sys.stderr)
+        finally:
+            api_client.close()
+
+    if args.restart:
+        from restart_scheduler import schedule_restart
+        schedule_restart(args.config)
+
 
 def main():
     parser = argparse.ArgumentParser(description='Xray Reality CLI Manager')
@@ -19,34 +136,69 @@ def main():
     config_parser.add_argument('--port', type=int, default=443, help='Порт для прослушивания')
     config_parser.add_argument('--save', type=str, help='Путь для сохранения конфигурации', default='config.json')
     config_parser.add_argument('--restart', action='store_true', help='Перезапустить сервер после сохранения конфигурации')
+    config_parser.add_argument('--api-port', type=int, help='Включить API Xray (HandlerService) на указанном порту')
+    config_parser.add_argument('--stats', action='store_true', help='Включить счетчики трафика пользователей (stats, policy и StatsService в API)')
+    config_parser.add_argument('--access-log', action='store_true', help='Включить access-лог Xray в директории конфигурации (для команды access-report)')
+    config_parser.add_argument('--metadata-backend', choices=['json', 'sqlite'], help='Хранилище метаданных пользователей (по умолчанию json)')
+    config_parser.add_argument('--docker-keys', action='store_true', help='Генерировать ключи через xray в Docker вместо встроенной реализации')
+    config_parser.add_argument('--sharding', choices=['hash', 'least-loaded', 'explicit'], help='Политика распределения новых пользователей по inbound (по умолчанию hash)')
 
     # Команда для запуска xray
     start_parser = subparsers.add_parser('start', help='Запуск xray с указанным конфигом')
     start_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
     start_parser.add_argument('--detach', action='store_true', help='Запуск в фоновом режиме')
-    start_parser.add_argument('--host-port', type=int, default=443, help='Хост-порт для проброса в контейнер (по умолчанию 443)')
+    start_parser.add_argument('--host-port', type=int, help='Хост-порт для основного inbound (по умолчанию порт inbound, остальные inbound публикуются на своих портах)')
 
     # Команда для остановки xray
     stop_parser = subparsers.add_parser('stop', help='Остановка xray')
 
+    # Команда для просмотра логов контейнера
+    logs_parser = subparsers.add_parser('logs', help='Просмотр логов Xray с фильтрами')
+    logs_parser.add_argument('--tail', type=str, default='100', help='Количество последних строк или all')
+    logs_parser.add_argument('--follow', '-f', action='store_true', help='Продолжать вывод новых строк')
+    logs_parser.add_argument('--since', type=str, help='Показать строки за период: 30m, 24h, 7d')
+    logs_parser.add_argument('--level', type=str, choices=['debug', 'info', 'warning', 'error'], help='Минимальный уровень (записи access-лога имеют уровень info)')
+    logs_parser.add_argument('--user', type=str, help='Только записи access-лога пользователя (email)')
+    logs_parser.add_argument('--json', action='store_true', help='Выводить разобранные записи в формате JSONL')
+
     # Команда для добавления пользователя
     add_user_parser = subparsers.add_parser('add-user', help='Добавление пользователя в конфигурацию')
     add_user_parser.add_argument('--name', type=str, required=True, help='Имя пользователя')
     add_user_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
     add_user_parser.add_argument('--restart', action='store_true', help='Перезапустить сервер после добавления пользователя')
+    add_user_parser.add_argument('--inbound', type=str, help='Тег inbound пользователя (по умолчанию по политике распределения)')
+    add_hot_arguments(add_user_parser)
 
     # Команда для удаления пользователя
     remove_user_parser = subparsers.add_parser('remove-user', help='Удаление пользователя из конфигурации')
     remove_user_parser.add_argument('--name', type=str, required=True, help='Имя пользователя')
     remove_user_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
     remove_user_parser.add_argument('--restart', action='store_true', help='Перезапустить сервер после удаления пользователя')
+    add_hot_arguments(remove_user_parser)
+
+    # Команды для пакетного добавления и удаления пользователей
+    add_users_parser = subparsers.add_parser('add-users', help='Пакетное добавление пользователей из файла или stdin (CSV/JSONL)')
+    add_users_parser.add_argument('--file', type=str, default='-', help='Файл со списком имен (по умолчанию stdin)')
+    add_users_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    add_users_parser.add_argument('--restart', action='store_true', help='Перезапустить сервер после добавления пользователей')
+    add_users_parser.add_argument('--inbound', type=str, help='Тег inbound пользователей (по умолчанию по политике распределения)')
+    add_hot_arguments(add_users_parser)
+
+    remove_users_parser = subparsers.add_parser('remove-users', help='Пакетное удаление пользователей из файла или stdin (CSV/JSONL)')
+    remove_users_parser.add_argument('--file', type=str, default='-', help='Файл со списком имен (по умолчанию stdin)')
+    remove_users_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    remove_users_parser.add_argument('--restart', action='store_true', help='Перезапустить сервер после удаления пользователей')
+    add_hot_arguments(remove_users_parser)
 
     # Команда для получения QR-кода
     qr_parser = subparsers.add_parser('qr', help='Получение QR-кода с конфигурацией для клиента')
     qr_parser.add_argument('--name', type=str, required=True, help='Имя пользователя')
     qr_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
-    qr_parser.add_argument('--save', type=str, help='Путь для сохранения QR-кода')
+    qr_parser.add_argument('--save', type=str, help='Путь для сохранения QR-кода (PNG или SVG по расширению .svg)')
     qr_parser.add_argument('--server', type=str, default="", help='IP-адрес или домен сервера для конфигурации')
+    qr_parser.add_argument('--payload', type=str, choices=['json', 'compact', 'deflate', 'link'], default='json',
+                           help='Содержимое QR-кода: json, compact (минифицированный JSON), '
+                                'deflate (сжатый JSON в base45) или link (VLESS-ссылка)')
 
     # Команда для получения JSON-конфигурации пользователя
     get_config_parser = subparsers.add_parser('get-config', help='Получение JSON-конфигурации для клиента')
@@ -54,6 +206,7 @@ def main():
     get_config_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
     get_config_parser.add_argument('--save', type=str, help='Путь для сохранения JSON-конфигурации в файл')
     get_config_parser.add_argument('--server', type=str, default="", help='IP-адрес или домен сервера для конфигурации')
+    get_config_parser.add_argument('--format', type=str, choices=['xray', 'sing-box', 'clash'], default='xray', help='Формат конфигурации клиента')
 
     # Команда для получения URI-ссылки VLESS
     vless_link_parser = subparsers.add_parser('vless-link', help='Получение URI-ссылки VLESS для клиента')
@@ -62,16 +215,163 @@ def main():
     vless_link_parser.add_argument('--server', type=str, default="", help='IP-адрес или домен сервера для ссылки')
     vless_link_parser.add_argument('--save', type=str, help='Путь для сохранения ссылки в файл')
     vless_link_parser.add_argument('--qr', action='store_true', help='Генерировать QR-код для VLESS-ссылки')
-    vless_link_parser.add_argument('--qr-save', type=str, help='Путь для сохранения QR-кода VLESS-ссылки')
+    vless_link_parser.add_argument('--qr-save', type=str, help='Путь для сохранения QR-кода VLESS-ссылки (PNG или SVG по расширению .svg)')
+
+    # Команда для пакетного экспорта ссылок, конфигураций и QR-кодов
+    export_parser = subparsers.add_parser('export', help='Экспорт ссылок, конфигураций и QR-кодов для всех пользователей')
+    export_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    export_parser.add_argument('--output', type=str, required=True, help='Директория, zip-архив (*.zip) или "-" для zip в stdout')
+    export_parser.add_argument('--server', type=str, default="", help='IP-адрес или домен сервера для ссылок и конфигураций')
+    export_parser.add_argument('--names', type=str, nargs='+', help='Экспортировать только указанных пользователей')
+    export_parser.add_argument('--file', type=str, help='Файл со списком пользователей для экспорта (CSV/JSONL)')
+    export_parser.add_argument('--workers', type=int, help='Количество процессов для генерации QR-кодов')
+    export_parser.add_argument('--no-qr', action='store_true', help='Не генерировать QR-коды')
+    export_parser.add_argument('--formats', type=str, nargs='+', choices=['xray', 'sing-box', 'clash'], default=['xray'],
+                               help='Форматы конфигураций клиентов (xray - <имя>.json, sing-box - <имя>.sing-box.json, clash - <имя>.clash.yaml)')
+
+    # Команда для определения внешнего адреса сервера
+    address_parser = subparsers.add_parser('address', help='Определение внешнего адреса сервера и настройка источников')
+    address_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    address_parser.add_argument('--sources', type=str, nargs='+', help='Источники адреса: static:<адрес>, interface, http:<url>')
+    address_parser.add_argument('--ttl', type=int, help='Время жизни кэша адреса в секундах')
+    address_parser.add_argument('--timeout', type=float, help='Таймаут опроса источников в секундах')
+    address_parser.add_argument('--refresh', action='store_true', help='Игнорировать кэш и определить адрес заново')
 
     # Команда для генерации ключей
     keys_parser = subparsers.add_parser('gen-keys', help='Генерация ключей для Reality')
     keys_parser.add_argument('--save-to-config', type=str, help='Сохранить ключи в указанный файл конфигурации')
     keys_parser.add_argument('--restart', action='store_true', help='Перезапустить сервер после сохранения ключей')
+    keys_parser.add_argument('--docker', action='store_true', help='Генерировать ключи через xray в Docker вместо встроенной реализации')
+
+    # Команды управления inbound пользователей
+    inbound_add_parser = subparsers.add_parser('inbound-add', help='Добавление inbound пользователей на отдельном порту с тем же ключом')
+    inbound_add_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    inbound_add_parser.add_argument('--port', type=int, required=True, help='Порт inbound')
+    inbound_add_parser.add_argument('--dest', type=str, help='Целевой домен (по умолчанию как у основного inbound)')
+    inbound_add_parser.add_argument('--server-names', type=str, nargs='+', help='Список имен серверов (по умолчанию как у основного inbound)')
+    inbound_add_parser.add_argument('--tag', type=str, help='Тег inbound (по умолчанию vless-in-2, vless-in-3, ...)')
+    inbound_add_parser.add_argument('--restart', action='store_true', help='Пересоздать контейнер Xray, чтобы опубликовать новый порт')
+
+    inbound_remove_parser = subparsers.add_parser('inbound-remove', help='Удаление inbound пользователей без пользователей')
+    inbound_remove_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    inbound_remove_parser.add_argument('--tag', type=str, required=True, help='Тег inbound')
+    inbound_remove_parser.add_argument('--restart', action='store_true', help='Перезапустить сервер после удаления')
+
+    inbound_list_parser = subparsers.add_parser('inbound-list', help='Inbound пользователей: порт, serverName, количество пользователей')
+    inbound_list_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    inbound_list_parser.add_argument('--json', action='store_true', help='Вывод в формате JSON')
+
+    # Команды поэтапной ротации ключа Reality
+    rotation_start_parser = subparsers.add_parser('rotation-start', help='Начало ротации ключа: новый ключ на новом порту, старый ключ работает до завершения')
+    rotation_start_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    rotation_start_parser.add_argument('--port', type=int, help='Порт inbound с новым ключом (по умолчанию порт прошлой ротации или текущий порт + 1)')
+    rotation_start_parser.add_argument('--grace', type=str, default='7d', help='Срок работы старого ключа: 24h, 7d, 30d')
+    rotation_start_parser.add_argument('--short-ids', action='store_true', help='Выдать пользователям новые shortId')
+    rotation_start_parser.add_argument('--docker', action='store_true', help='Генерировать ключи через xray в Docker вместо встроенной реализации')
+    rotation_start_parser.add_argument('--restart', action='store_true', help='Пересоздать контейнер Xray, чтобы опубликовать новый порт')
+    rotation_start_parser.add_argument('--export', type=str, help='Экспортировать новые ссылки, конфигурации и QR-коды всех пользователей в директорию или zip-архив')
+    rotation_start_parser.add_argument('--server', type=str, default="", help='IP-адрес или домен сервера для экспорта')
+    rotation_start_parser.add_argument('--formats', type=str, nargs='+', choices=['xray', 'sing-box', 'clash'], default=['xray'], help='Форматы конфигураций клиентов для экспорта')
+
+    rotation_status_parser = subparsers.add_parser('rotation-status', help='Переход пользователей на новый ключ; завершает ротацию, когда перешли все или истек срок')
+    rotation_status_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    rotation_status_parser.add_argument('--no-retire', action='store_true', help='Только показать состояние, не завершать ротацию')
+    rotation_status_parser.add_argument('--restart', action='store_true', help='Перезапустить Xray после завершения ротации, если не удалось применить через API')
+    rotation_status_parser.add_argument('--json', action='store_true', help='Вывод в формате JSON')
+    add_hot_arguments(rotation_status_parser)
+
+    rotation_retire_parser = subparsers.add_parser('rotation-retire', help='Завершение ротации: удаление inbound со старым ключом')
+    rotation_retire_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    rotation_retire_parser.add_argument('--restart', action='store_true', help='Перезапустить Xray, если не удалось применить через API')
+    add_hot_arguments(rotation_retire_parser)
 
     # Команда для просмотра всех пользователей
     list_users_parser = subparsers.add_parser('list-users', help='Список всех пользователей')
     list_users_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    list_users_parser.add_argument('--stats', action='store_true', help='Показать накопленный трафик пользователей')
+
+    # Команды сбора и просмотра статистики трафика
+    stats_collect_parser = subparsers.add_parser('stats-collect', help='Сбор статистики трафика пользователей через StatsService')
+    stats_collect_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    stats_collect_parser.add_argument('--api', type=str, help='Адрес API Xray (по умолчанию из конфигурации, 127.0.0.1:10085)')
+    stats_collect_parser.add_argument('--interval', type=int, default=60, help='Интервал опроса в секундах')
+    stats_collect_parser.add_argument('--retention-days', type=int, default=30, help='Срок хранения временных рядов в днях')
+    stats_collect_parser.add_argument('--once', action='store_true', help='Выполнить один опрос и завершиться')
+
+    stats_top_parser = subparsers.add_parser('stats-top', help='Пользователи с наибольшим трафиком')
+    stats_top_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    stats_top_parser.add_argument('--limit', type=int, default=10, help='Количество пользователей в отчете')
+    stats_top_parser.add_argument('--since', type=str, help='Период отчета: 30m, 24h, 7d (по умолчанию за все время)')
+    stats_top_parser.add_argument('--by', type=str, choices=['total', 'uplink', 'downlink'], default='total', help='Сортировка')
+
+    # Команда для аналитики access-лога
+    access_report_parser = subparsers.add_parser('access-report', help='Аналитика access-лога: активность пользователей, адреса назначения, отклоненные подключения')
+    access_report_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    access_report_parser.add_argument('--log', type=str, help='Путь к access-логу (по умолчанию из секции log конфигурации)')
+    access_report_parser.add_argument('--limit', type=int, default=10, help='Количество строк в отчете')
+    access_report_parser.add_argument('--by', type=str, choices=['connections', 'rejected', 'destinations', 'sources'], default='connections', help='Сортировка пользователей')
+    access_report_parser.add_argument('--user', type=str, help='Адреса назначения пользователя')
+    access_report_parser.add_argument('--idle', type=str, help='Пользователи без подключений за период: 24h, 7d, 30d')
+    access_report_parser.add_argument('--no-update', action='store_true', help='Не обрабатывать новые строки лога, только отчет')
+
+    # Команда для получения адреса подписки пользователя
+    sub_link_parser = subparsers.add_parser('sub-link', help='Адрес подписки пользователя (маршрут /sub/<token> сервиса serve)')
+    sub_link_parser.add_argument('--name', type=str, required=True, help='Имя пользователя')
+    sub_link_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    sub_link_parser.add_argument('--base-url', type=str, default='', help='Внешний адрес сервиса serve, например https://sub.example.com')
+
+    # Команда для просмотра состояния сервера
+    status_parser = subparsers.add_parser('status', help='Состояние сервера: пользователи, ключ, контейнер')
+    status_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    status_parser.add_argument('--json', action='store_true', help='Вывод в формате JSON')
+
+    # Команды управления флотом узлов из инвентаря
+    fleet_status_parser = subparsers.add_parser('fleet-status', help='Состояние всех узлов флота')
+    add_fleet_arguments(fleet_status_parser, restart=False)
+
+    fleet_add_user_parser = subparsers.add_parser('fleet-add-user', help='Добавление пользователя на все узлы флота')
+    fleet_add_user_parser.add_argument('--name', type=str, required=True, help='Имя пользователя')
+    add_fleet_arguments(fleet_add_user_parser)
+
+    fleet_remove_user_parser = subparsers.add_parser('fleet-remove-user', help='Удаление пользователя со всех узлов флота')
+    fleet_remove_user_parser.add_argument('--name', type=str, required=True, help='Имя пользователя')
+    add_fleet_arguments(fleet_remove_user_parser)
+
+    fleet_rotate_keys_parser = subparsers.add_parser('fleet-rotate-keys', help='Новые ключи Reality на всех узлах флота')
+    add_fleet_arguments(fleet_rotate_keys_parser)
+
+    # Команда для проверки согласованности конфигурации и метаданных
+    check_parser = subparsers.add_parser('check', help='Проверка согласованности конфигурации и метаданных')
+    check_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+
+    # Команда для переноса метаданных между хранилищами
+    migrate_parser = subparsers.add_parser('migrate-metadata', help='Перенос метаданных пользователей в другое хранилище')
+    migrate_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    migrate_parser.add_argument('--to', type=str, choices=['json', 'sqlite'], required=True, help='Целевое хранилище метаданных')
+
+    # Команда для запуска сервиса управления с HTTP/JSON API
+    serve_parser = subparsers.add_parser('serve', help='Запуск сервиса управления с HTTP/JSON API')
+    serve_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    serve_parser.add_argument('--host', type=str, default='127.0.0.1', help='Адрес для прослушивания')
+    serve_parser.add_argument('--port', type=int, default=8080, help='Порт для прослушивания')
+    serve_parser.add_argument('--flush-interval', type=float, default=0.5, help='Интервал пакетной записи изменений на диск в секундах')
+    serve_parser.add_argument('--token', type=str, help='Токен для заголовка Authorization: Bearer (по умолчанию без авторизации)')
+    serve_parser.add_argument('--inventory', type=str, help='Инвентарь флота: локальные узлы с адресом server добавляются в подписки')
+    add_hot_arguments(serve_parser)
+
+    # Команда для просмотра счетчиков отложенных перезапусков
+    restart_stats_parser = subparsers.add_parser('restart-stats', help='Счетчики запрошенных, выполненных и сэкономленных перезапусков')
+    restart_stats_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+
+    # Команда для экспорта метрик в формате Prometheus
+    metrics_parser = subparsers.add_parser('metrics', help='Экспорт метрик менеджера и Xray в формате Prometheus')
+    metrics_parser.add_argument('--config', type=str, default='config.json', help='Путь к файлу конфигурации')
+    metrics_parser.add_argument('--host', type=str, default='127.0.0.1', help='Адрес для прослушивания')
+    metrics_parser.add_argument('--port', type=int, default=9550, help='Порт для прослушивания')
+    metrics_parser.add_argument('--cache-ttl', type=float, default=10.0, help='Время жизни кэша результатов сбора в секундах')
+    metrics_parser.add_argument('--api', type=str, help='Адрес API Xray (по умолчанию из конфигурации, 127.0.0.1:10085)')
+    metrics_parser.add_argument('--once', action='store_true', help='Вывести метрики в stdout и завершиться')
+    metrics_parser.add_argument('--container', type=str, help='Имя контейнера Xray (по умолчанию из XRAY_CONTAINER_NAME или xray-reality-container)')
 
     args = parser.parse_args()
 
@@ -79,14 +379,35 @@ def main():
         parser.print_help()
         return
 
-    config_manager = ConfigManager()
-    user_manager = UserManager(config_manager)
-    docker_manager = DockerManager()
+    # Длительность команды записывается в метрики при любом завершении, включая sys.exit
+    config_path = getattr(args, 'config', None) or getattr(args, 'save', None) or getattr(args, 'save_to_config', None)
+    if config_path and args.command in RECORDED_COMMANDS:
+        import atexit
+        import time
+        started = time.perf_counter()
+        atexit.register(lambda: record_command(config_path, args.command, time.perf_counter() - started))
+
+    if args.command in DOCKER_COMMANDS:
+        from docker_manager import DockerManager
+        docker_manager = DockerManager()
+    else:
+        from config_manager import ConfigManager
+        config_manager = ConfigManager()
+
+    if args.command in USER_COMMANDS:
+        from user_manager import UserManager
+        user_manager = UserManager(config_manager)
 
     if args.command == 'config':
+        # Смена хранилища метаданных переносит существующие метаданные
+        if args.metadata_backend:
+            if config_manager.migrate_metadata(args.save, args.metadata_backend):
+                print(f"Метаданные перенесены в хранилище {args.metadata_backend}")
+            config_manager.metadata_backend = args.metadata_backend
+
         # Проверяем, существует ли файл конфигурации
         try:
-            config_manager.load_config(args.save)
+            config_manager.load_config(args.save, lock=True)
             print(f"Найдена существующая конфигурация в {args.save}, обновляю указанные параметры")
         except:
             print(f"Создаю новую конфигурацию в {args.save}")
@@ -109,9 +430,28 @@ def main():
             config_manager.update_port(args.port)
             print(f"Обновлен порт: {args.port}")
 
+        if args.api_port:
+            config_manager.enable_api(args.api_port)
+            print(f"API Xray включен на порту {args.api_port}")
+
+        if args.stats:
+            config_manager.enable_stats(args.api_port)
+            print("Счетчики трафика пользователей включены")
+
+        if args.sharding:
+            from config_manager import SHARDING_KEY
+            config_manager.user_metadata[SHARDING_KEY] = {"policy": args.sharding}
+            print(f"Политика распределения пользователей по inbound: {args.sharding}")
+
+        if args.access_log:
+            updated = config_manager.enable_access_log()
+            print(f"Access-лог включен: {config_manager.get_access_log_path(args.save)}")
+            if updated:
+                print(f"Добавлен email клиентам без него: {updated}")
+
         # Если конфигурация новая, генерируем ключи
         if not config_manager.has_reality_settings():
-            private_key, public_key = config_manager.generate_keys()
+            private_key, public_key = config_manager.generate_keys(args.docker_keys)
             short_id = config_manager.generate_short_id()
             config_manager.update_keys(private_key, public_key, short_id)
             print("Сгенерированы новые ключи и short_id")
@@ -119,7 +459,7 @@ def main():
         config_manager.save_config(args.save, args.restart)
         print(f"Конфигурация сохранена в {args.save}")
         if args.restart:
-            print("Сервер перезапущен")
+            print("Перезапуск сервера запланирован")
 
     elif args.command == 'start':
         docker_manager.start_xray(args.config, args.detach, args.host_port)
@@ -129,46 +469,100 @@ def main():
         docker_manager.stop_xray()
         print("Xray остановлен")
 
+    elif args.command == 'logs':
+        import time
+        from contextlib import closing
+        from docker_api import DockerApiError
+        from stats import parse_duration
+        from xray_logs import matches, parse_line
+
+        since = time.time() - parse_duration(args.since) if args.since else None
+        tail = None if args.tail == 'all' else int(args.tail)
+        filtered = args.level or args.user or args.json
+        try:
+            with closing(docker_manager.stream_container_logs(tail, args.follow, since)) as lines:
+                for _, line in lines:
+                    if filtered:
+                        record = parse_line(line)
+                        if not matches(record, args.level, args.user):
+                            continue
+                        if args.json:
+                            line = json.dumps(record, ensure_ascii=False)
+                    print(line, flush=args.follow)
+        except DockerApiError as e:
+            print("Контейнер не существует" if e.status == 404 else f"Ошибка при получении логов: {e}")
+            sys.exit(1)
+        except OSError as e:
+            print(f"Ошибка при получении логов: {e}")
+            sys.exit(1)
+
     elif args.command == 'add-user':
-        config_manager.load_config(args.config)
-        user_id = user_manager.add_user(args.name)
-        config_manager.save_config(args.config, args.restart)
+        config_manager.load_config(args.config, lock=True)
+        user_id = user_manager.add_user(args.name, args.inbound)
+        if user_id is None:
+            config_manager.release_lock()
+            sys.exit(1)
+        restart_scheduled = save_user_changes(config_manager, user_manager, args)
         print(f"Пользователь {args.name} добавлен с ID: {user_id}")
-        if args.restart:
-            print("Сервер перезапущен")
+        if restart_scheduled:
+            print("Перезапуск сервера запланирован")
 
     elif args.command == 'remove-user':
-        config_manager.load_config(args.config)
+        config_manager.load_config(args.config, lock=True)
         user_manager.remove_user(args.name)
-        config_manager.save_config(args.config, args.restart)
+        restart_scheduled = save_user_changes(config_manager, user_manager, args)
         print(f"Пользователь {args.name} удален")
-        if args.restart:
-            print("Сервер перезапущен")
+        if restart_scheduled:
+            print("Перезапуск сервера запланирован")
+
+    elif args.command in ('add-users', 'remove-users'):
+        from bulk_users import read_user_names, write_results
+
+        names = read_user_names(args.file)
+        config_manager.load_config(args.config, lock=True)
+
+        if args.command == 'add-users':
+            results = user_manager.add_users(names, args.inbound)
+            changed = sum(1 for result in results if result["status"] == "added")
+        else:
+            results = user_manager.remove_users(names)
+            changed = sum(1 for result in results if result["status"] == "removed")
+
+        # Один цикл сохранения и не более одного перезапуска на всю пачку
+        restart_scheduled = False
+        if changed:
+            restart_scheduled = save_user_changes(config_manager, user_manager, args)
+        write_results(results)
+        print(f"Обработано пользователей: {len(results)}, изменено: {changed}", file=sys.stderr)
+        if restart_scheduled:
+            print("Перезапуск сервера запланирован", file=sys.stderr)
 
     elif args.command == 'qr':
-        config_manager.load_config(args.config)
-        user_manager.generate_qr_code(args.name, args.save, args.server)
+        config_manager.load_config(args.config, readonly=True)
+        user_manager.enable_artifact_cache(args.config)
+        user_manager.generate_qr_code(args.name, args.save, args.server, args.payload)
         if args.save:
             print(f"QR-код сохранен в {args.save}")
 
     elif args.command == 'get-config':
-        config_manager.load_config(args.config)
-        client_config = user_manager.generate_client_config(args.name, args.server)
+        config_manager.load_config(args.config, readonly=True)
+        client_config = user_manager.render_client_config(args.name, args.server, args.format)
         if client_config:
             if args.save:
                 # Сохранение конфигурации в файл
                 with open(args.save, 'w') as f:
-                    json.dump(client_config, f, indent=2)
+                    f.write(client_config)
                 print(f"Конфигурация сохранена в {args.save}")
             else:
                 # Вывод конфигурации в терминал
-                print(json.dumps(client_config, indent=2))
+                print(client_config.rstrip("\n"))
 
     elif args.command == 'vless-link':
-        config_manager.load_config(args.config)
+        config_manager.load_config(args.config, readonly=True)
 
         if args.qr or args.qr_save:
             # Генерация QR-кода для VLESS-ссылки
+            user_manager.enable_artifact_cache(args.config)
             user_manager.generate_vless_qr(args.name, args.server, args.qr_save)
             if args.qr_save:
                 print(f"QR-код для VLESS-ссылки сохранен в {args.qr_save}")
@@ -186,36 +580,333 @@ def main():
                     print("\nVLESS URI-ссылка для быстрой настройки клиента:")
                     print(vless_link)
 
+    elif args.command == 'export':
+        from bulk_users import read_user_names, write_results
+        from exporter import export_users
+
+        config_manager.load_config(args.config, readonly=True)
+        names = args.names
+        if args.file:
+            names = (names or []) + read_user_names(args.file)
+
+        if not args.no_qr:
+            user_manager.enable_artifact_cache(args.config)
+        results = export_users(user_manager, args.output, names, args.server, args.workers, not args.no_qr, args.formats)
+        # При выводе архива в stdout результаты пишутся в stderr
+        write_results(results, sys.stderr if args.output == "-" else sys.stdout)
+        exported = sum(1 for result in results if result["status"] == "exported")
+        print(f"Экспортировано пользователей: {exported}", file=sys.stderr)
+
+    elif args.command == 'address':
+        from address_resolver import AddressResolver
+
+        config_manager.load_config(args.config, readonly=True)
+
+        # Сохранение новых настроек источников адреса
+        if args.sources or args.ttl is not None or args.timeout is not None:
+            settings = dict(config_manager.user_metadata.get("resolver", {}))
+            if args.sources:
+                settings["sources"] = args.sources
+            if args.ttl is not None:
+                settings["ttl"] = args.ttl
+            if args.timeout is not None:
+                settings["timeout"] = args.timeout
+            config_manager.save_metadata_value("resolver", settings)
+            print(f"Настройки определения адреса сохранены: {settings}")
+
+        address = AddressResolver(config_manager).resolve(args.refresh)
+        if address:
+            print(address)
+        else:
+            print("Не удалось определить внешний адрес сервера")
+            sys.exit(1)
+
     elif args.command == 'gen-keys':
-        private_key, public_key = config_manager.generate_keys()
+        private_key, public_key = config_manager.generate_keys(args.docker)
         print(f"Приватный ключ: {private_key}")
         print(f"Публичный ключ: {public_key}")
 
         if args.save_to_config:
-            config_manager.load_config(args.save_to_config)
-            inbound = config_manager.get_inbound()
-            reality_settings = inbound["streamSettings"]["realitySettings"]
-            reality_settings["privateKey"] = private_key
-
-            # Обновление публичного ключа в метаданных для клиентов
-            server_info = config_manager.get_server_info()
-            server_info["publicKey"] = public_key
+            config_manager.load_config(args.save_to_config, lock=True)
+            # Ключ общий для всех inbound пользователей, публичный ключ сохраняется в метаданных для клиентов
+            config_manager.update_keys(private_key, public_key)
 
             config_manager.save_config(args.save_to_config, args.restart)
             print(f"Ключи сохранены в конфигурации {args.save_to_config}")
             if args.restart:
-                print("Сервер перезапущен")
+                print("Перезапуск сервера запланирован")
 
-    elif args.command == 'list-users':
+    elif args.command in ('inbound-add', 'inbound-remove'):
+        config_manager.load_config(args.config, lock=True)
+        try:
+            if args.command == 'inbound-add':
+                tag = config_manager.add_inbound(args.port, args.dest, args.server_names, args.tag)
+            else:
+                config_manager.remove_inbound(args.tag)
+        except ValueError as e:
+            config_manager.release_lock()
+            print(f"Ошибка: {e}")
+            sys.exit(1)
+
+        if args.command == 'inbound-remove':
+            config_manager.save_config(args.config, args.restart)
+            print(f"Inbound {args.tag} удален")
+        else:
+            config_manager.save_config(args.config)
+            print(f"Inbound {tag} добавлен на порту {args.port}")
+            # Новый порт публикуется только при создании контейнера
+            if args.restart:
+                from docker_manager import DockerManager
+                if not DockerManager(container_name=config_manager.container_name).start_xray(args.config, detach=True):
+                    sys.exit(1)
+            else:
+                print("Для публикации нового порта пересоздайте контейнер: python3 main.py start --detach", file=sys.stderr)
+
+    elif args.command == 'inbound-list':
         config_manager.load_config(args.config)
+        inbounds = []
+        for tag, inbound in config_manager.get_user_inbounds().items():
+            server_info = config_manager.get_server_info(tag)
+            inbounds.append({
+                "tag": config_manager.get_inbound_tag(tag),
+                "port": inbound.get("port"),
+                "serverName": server_info.get("serverName"),
+                "dest": inbound["streamSettings"]["realitySettings"].get("dest"),
+                "users": len(inbound["settings"]["clients"]),
+            })
+        if args.json:
+            print(json.dumps(inbounds, ensure_ascii=False))
+        else:
+            from config_manager import SHARDING_KEY
+            print(f"Политика распределения: {config_manager.user_metadata.get(SHARDING_KEY, {}).get('policy', 'hash')}")
+            for inbound in inbounds:
+                print(f"- {inbound['tag']}: порт {inbound['port']}, serverName {inbound['serverName']}, "
+                      f"dest {inbound['dest']}, пользователей {inbound['users']}")
+
+    elif args.command == 'rotation-start':
+        from key_rotation import KeyRotation, RotationError
+        from stats import parse_duration
+
+        config_manager.load_config(args.config, lock=True)
+        rotation = KeyRotation(config_manager, args.config)
+        try:
+            state = rotation.start(args.port, parse_duration(args.grace), args.short_ids, args.docker)
+        except RotationError as e:
+            print(f"Ошибка: {e}")
+            sys.exit(1)
+        config_manager.save_config(args.config)
+
+        server_info = config_manager.get_server_info()
+        print(f"Новый ключ: {server_info['publicKey']}, порт {server_info['port']}")
+        print(f"Старый ключ работает на порту {state['port']} до перехода всех пользователей, но не дольше {args.grace}")
+        if args.restart:
+            # Новый порт публикуется только при создании контейнера, поэтому контейнер пересоздается один раз
+            from docker_manager import DockerManager
+            if not DockerManager(container_name=config_manager.container_name).start_xray(args.config, detach=True):
+                sys.exit(1)
+        else:
+            print("Для публикации нового порта пересоздайте контейнер: python3 main.py start --detach", file=sys.stderr)
+
+        if args.export:
+            from bulk_users import write_results
+            from exporter import export_users
+            from user_manager import UserManager
+
+            user_manager = UserManager(config_manager)
+            user_manager.enable_artifact_cache(args.config)
+            results = export_users(user_manager, args.export, server_address=args.server, formats=args.formats)
+            write_results(results, sys.stderr)
+
+    elif args.command in ('rotation-status', 'rotation-retire'):
+        from key_rotation import KeyRotation, RotationError
+
+        config_manager.load_config(args.config, lock=True)
+        rotation = KeyRotation(config_manager, args.config)
+        if not rotation.active:
+            config_manager.release_lock()
+            print("Ротация ключа не идет")
+            sys.exit(1 if args.command == 'rotation-retire' else 0)
+
+        if args.command == 'rotation-retire':
+            retire_rotation(config_manager, rotation, args)
+            return
+
+        status = rotation.check()
+        if args.json:
+            print(json.dumps(status, ensure_ascii=False))
+        else:
+            print(f"Перешли на новый ключ: {status['moved']}, ожидают: {len(status['pending'])} "
+                  f"(источники: {', '.join(status['sources']) or 'нет'})")
+            for name in status['pending']:
+                print(f"- {name}")
+        # Ротация завершается автоматически, поэтому команду удобно запускать по расписанию
+        if not args.no_retire and (not status['pending'] or status['expired']):
+            retire_rotation(config_manager, rotation, args)
+        else:
+            config_manager.save_config(args.config)
+
+    elif args.command == 'list-users':
+        config_manager.load_config(args.config, readonly=True)
         users = user_manager.list_users()
+        totals = {}
+        if args.stats:
+            from stats import StatsStore, format_bytes, get_stats_path
+            totals = StatsStore(get_stats_path(args.config)).totals()
         if users:
             print("Список пользователей:")
             for idx, user in enumerate(users, 1):
-                print(f"{idx}. {user['name']} (ID: {user['id']})")
+                line = f"{idx}. {user['name']} (ID: {user['id']})"
+                if args.stats:
+                    uplink, downlink, _ = totals.get(user['name'], (0, 0, None))
+                    line += f" - отправлено {format_bytes(uplink)}, получено {format_bytes(downlink)}"
+                print(line)
         else:
             print("Пользователи не найдены")
 
+    elif args.command == 'stats-collect':
+        from stats import StatsCollector, StatsStore, get_stats_path
+        from xray_api import XrayApiClient, XrayApiError
+
+        config_manager.load_config(args.config, readonly=True)
+        if not config_manager.has_stats():
+            print("Счетчики трафика не включены, выполните: python3 main.py config --stats --restart", file=sys.stderr)
+
+        api_client = XrayApiClient(args.api or config_manager.get_api_address())
+        collector = StatsCollector(api_client, StatsStore(get_stats_path(args.config)))
+        if args.once:
+            try:
+                deltas = collector.poll()
+            except XrayApiError as e:
+                print(f"Ошибка при опросе статистики: {e}")
+                sys.exit(1)
+            print(f"Собрана статистика: пользователей с трафиком {len(deltas)}")
+        else:
+            collector.run(args.interval, args.retention_days)
+
+    elif args.command == 'stats-top':
+        import time
+        from stats import StatsStore, format_bytes, get_stats_path, parse_duration
+
+        since = time.time() - parse_duration(args.since) if args.since else None
+        rows = StatsStore(get_stats_path(args.config)).top(args.limit, since, args.by)
+        if rows:
+            for idx, (name, uplink, downlink) in enumerate(rows, 1):
+                print(f"{idx}. {name}: всего {format_bytes(uplink + downlink)} "
+                      f"(отправлено {format_bytes(uplink)}, получено {format_bytes(downlink)})")
+        else:
+            print("Статистика трафика не найдена")
+
+    elif args.command == 'access-report':
+        import os
+        from access_log import AccessLogAnalyzer, get_access_stats_path
+        from stats import parse_duration
+
+        config_manager.load_config(args.config, readonly=True)
+        log_path = args.log or config_manager.get_access_log_path(args.config)
+        analyzer = AccessLogAnalyzer(log_path, get_access_stats_path(args.config))
+
+        if not args.no_update:
+            if not log_path or not os.path.exists(log_path):
+                print("Access-лог не найден: включите его командой config --access-log или укажите --log")
+                sys.exit(1)
+            processed, lines = analyzer.update()
+            print(f"Обработано новых данных: {processed} байт, строк: {lines}")
+
+        total, rejected, anonymous = analyzer.summary()
+        print(f"Подключений: {total}, отклонено: {rejected} ({rejected / total:.1%})" if total else "Подключений: 0")
+        if anonymous:
+            print(f"Отклонено без пользователя (неизвестный UUID, сканирование): {anonymous}")
+
+        if args.idle:
+            names = [user_data["name"] for _, user_data in config_manager.iter_users()]
+            idle = analyzer.idle(names, parse_duration(args.idle))
+            print(f"\nПользователи без подключений за {args.idle}: {len(idle)}")
+            for name, last_seen in idle:
+                print(f"- {name}: {last_seen or 'подключений не было'}")
+        elif args.user:
+            print(f"\nАдреса назначения пользователя {args.user}:")
+            for host, connections in analyzer.top_destinations(args.limit, args.user):
+                print(f"- {host}: {connections}")
+        else:
+            print(f"\nПользователи (сортировка: {args.by}):")
+            for idx, (name, connections, user_rejected, destinations, sources, last_seen) in enumerate(analyzer.top(args.limit, args.by), 1):
+                print(f"{idx}. {name}: подключений {connections}, отклонено {user_rejected}, "
+                      f"адресов назначения {destinations}, адресов клиентов {sources}, последнее {last_seen}")
+            print("\nАдреса назначения:")
+            for host, connections in analyzer.top_destinations(args.limit):
+                print(f"- {host}: {connections}")
+        analyzer.close()
+
+    elif args.command == 'sub-link':
+        from subscription import get_subscription_secret, subscription_token
+
+        config_manager.load_config(args.config)
+        user_info = config_manager.get_client_by_name(args.name)
+        if not user_info:
+            print(f"Пользователь с именем {args.name} не найден")
+            sys.exit(1)
+        token = subscription_token(get_subscription_secret(config_manager), user_info[0])
+        print(f"{args.base_url.rstrip('/')}/sub/{token}")
+
+    elif args.command == 'status':
+        from fleet import FleetError, node_status
+        try:
+            status = node_status(config_manager, args.config)
+        except FleetError as e:
+            print(f"Ошибка: {e}")
+            sys.exit(1)
+        if args.json:
+            print(json.dumps(status, ensure_ascii=False))
+        else:
+            print(f"Пользователей: {status['users']}, shortId: {status['shortIds']}, поколение конфигурации: {status['generation']}")
+            print(f"Порт: {status['port']}, inbound пользователей: {status['inbounds']}, публичный ключ: {status['publicKey']}")
+            print(f"Контейнер: {status['container']}")
+
+    elif args.command == 'fleet-status':
+        run_fleet_command(args, lambda transport: transport.status())
+
+    elif args.command == 'fleet-add-user':
+        run_fleet_command(args, lambda transport: transport.add_user(args.name, args.restart))
+
+    elif args.command == 'fleet-remove-user':
+        run_fleet_command(args, lambda transport: transport.remove_user(args.name, args.restart))
+
+    elif args.command == 'fleet-rotate-keys':
+        run_fleet_command(args, lambda transport: transport.rotate_keys(args.restart))
+
+    elif args.command == 'check':
+        config_manager.load_config(args.config)
+        problems = config_manager.check_consistency()
+        if problems:
+            print("Найдены проблемы согласованности:")
+            for problem in problems:
+                print(f"- {problem}")
+            sys.exit(1)
+        print("Конфигурация и метаданные согласованы")
+
+    elif args.command == 'serve':
+        from daemon import run_daemon
+        if not run_daemon(config_manager, args.config, args.host, args.port, args.flush_interval, args.hot, args.api, args.token, args.inventory):
+            sys.exit(1)
+
+    elif args.command == 'metrics':
+        from metrics import MetricsExporter, serve_metrics
+        exporter = MetricsExporter(args.config, args.api, args.cache_ttl, args.container)
+        if args.once:
+            sys.stdout.write(exporter.render())
+        else:
+            serve_metrics(exporter, args.host, args.port)
+
+    elif args.command == 'restart-stats':
+        from restart_scheduler import RestartScheduler
+        print(json.dumps(RestartScheduler(args.config).metrics(), indent=2))
+
+    elif args.command == 'migrate-metadata':
+        if config_manager.migrate_metadata(args.config, args.to):
+            print(f"Метаданные перенесены в хранилище {args.to}")
+        else:
+            print(f"Метаданные уже хранятся в {args.to} или не найдены")
+
 if __name__ == "__main__":
     try:
         main()
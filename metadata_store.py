@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Хранилища метаданных пользователей: JSON-файл (по умолчанию) и SQLite"""
+
+import json
+import os
+
+from config_store import ConfigStore, atomic_write
+
+
+class JsonMetadataStore:
+    """Метаданные в файле `*_metadata.json`, читаются и записываются целиком"""
+
+    suffix = "_metadata.json"
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        """Загрузка всех метаданных"""
+        if not self.exists():
+            return {}
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def save(self, config_path, config_data, metadata, changed_ids=None, removed_ids=None):
+        """Транзакционная запись конфигурации (если передана) и метаданных"""
+        files = {self.path: json.dumps(metadata, indent=2).encode('utf-8')}
+        if config_data is not None:
+            files[config_path] = config_data
+        ConfigStore(config_path).write(files)
+
+    def recover(self, config_path):
+        """Восстановление прерванной записи"""
+        return ConfigStore(config_path).recover([config_path, self.path])
+
+    def set_meta(self, key, value):
+        """Запись одного ключа верхнего уровня без записи config.json"""
+        if not self.exists():
+            return
+        metadata = self.load()
+        metadata[key] = value
+        atomic_write(self.path, json.dumps(metadata, indent=2).encode('utf-8'))
+
+    def get_meta(self, key, default=None):
+        return self.load().get(key, default)
+
+    def get_server(self):
+        return self.load().get("server", {})
+
+    def get_user_by_name(self, name):
+        for user_id, user_data in self.load().get("users", {}).items():
+            if user_data["name"] == name:
+                return user_id, user_data
+        return None
+
+    def iter_users(self):
+        return iter(self.load().get("users", {}).items())
+
+    def close(self):
+        pass
+
+
+class SqliteMetadataStore:
+    """Метаданные в базе SQLite `*_metadata.db` с индексами по имени и shortId
+
+    Позволяет читать одного пользователя или данные сервера без разбора всех
+    метаданных. Журнал транзакции записи config.json хранится в той же базе и
+    фиксируется одной транзакцией вместе с изменениями метаданных.
+    """
+
+    suffix = "_metadata.db"
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    @property
+    def connection(self):
+        """Ленивое открытие базы и создание схемы"""
+        if self._connection is None:
+            import sqlite3
+            self._connection = sqlite3.connect(self.path)
+            self._connection.executescript("""
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=FULL;
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS users (
+                    id TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    short_id TEXT,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS users_name ON users (name);
+                CREATE INDEX IF NOT EXISTS users_short_id ON users (short_id);
+                CREATE TABLE IF NOT EXISTS journal (path TEXT PRIMARY KEY, tmp_path TEXT NOT NULL);
+            """)
+        return self._connection
+
+    def load(self):
+        """Загрузка всех метаданных в формате JSON-хранилища"""
+        if not self.exists():
+            return {}
+        metadata = {key: json.loads(value) for key, value in self.connection.execute("SELECT key, value FROM meta")}
+        metadata["users"] = {user_id: user_data for user_id, user_data in self.iter_users()}
+        return metadata
+
+    def _write_metadata(self, metadata, changed_ids, removed_ids):
+        """Запись метаданных в текущей транзакции; без changed_ids таблица users перезаписывается целиком"""
+        connection = self.connection
+        users = metadata.get("users", {})
+
+        connection.execute("DELETE FROM meta")
+        connection.executemany(
+            "INSERT INTO meta (key, value) VALUES (?, ?)",
+            [(key, json.dumps(value)) for key, value in metadata.items() if key != "users"]
+        )
+
+        if changed_ids is None:
+            connection.execute("DELETE FROM users")
+            changed_ids = users.keys()
+        elif removed_ids:
+            connection.executemany("DELETE FROM users WHERE id = ?", [(user_id,) for user_id in removed_ids])
+
+        # Обновление на месте сохраняет rowid, поэтому измененный пользователь остается
+        # на своей позиции в выдаче, как в JSON-хранилище
+        connection.executemany(
+            "INSERT INTO users (id, name, short_id, data) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET name = excluded.name, short_id = excluded.short_id, data = excluded.data",
+            [
+                (user_id, users[user_id]["name"], users[user_id].get("shortId"), json.dumps(users[user_id]))
+                for user_id in changed_ids if user_id in users
+            ]
+        )
+
+    def save(self, config_path, config_data, metadata, changed_ids=None, removed_ids=None):
+        """Транзакционная запись конфигурации (если передана) и метаданных"""
+        if not self.exists():
+            # В новую базу пользователи записываются целиком, а не только измененные
+            changed_ids = removed_ids = None
+        files = {config_path: config_data} if config_data is not None else {}
+        ConfigStore(config_path, _SqliteJournal(self, metadata, changed_ids, removed_ids)).write(files)
+
+    def recover(self, config_path):
+        """Восстановление прерванной записи config.json по журналу в базе"""
+        if not self.exists():
+            return None
+        return ConfigStore(config_path, _SqliteJournal(self)).recover([config_path])
+
+    def set_meta(self, key, value):
+        """Запись одного ключа верхнего уровня без записи config.json"""
+        if not self.exists():
+            return
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value))
+            )
+
+    def get_meta(self, key, default=None):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def get_server(self):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'server'").fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def get_user_by_name(self, name):
+        row = self.connection.execute(
+            "SELECT id, data FROM users WHERE name = ? ORDER BY rowid LIMIT 1", (name,)
+        ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def iter_users(self):
+        for user_id, data in self.connection.execute("SELECT id, data FROM users ORDER BY rowid"):
+            yield user_id, json.loads(data)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class _SqliteJournal:
+    """Журнал транзакции в таблице journal базы метаданных"""
+
+    def __init__(self, store, metadata=None, changed_ids=None, removed_ids=None):
+        self.store = store
+        self.metadata = metadata
+        self.changed_ids = changed_ids
+        self.removed_ids = removed_ids
+
+    def commit(self, pending):
+        """Запись метаданных и журнала одной транзакцией SQLite - точка фиксации"""
+        with self.store.connection:
+            if self.metadata is not None:
+                self.store._write_metadata(self.metadata, self.changed_ids, self.removed_ids)
+            self.store.connection.executemany(
+                "INSERT OR REPLACE INTO journal (path, tmp_path) VALUES (?, ?)", list(pending.items())
+            )
+
+    def read(self):
+        rows = self.store.connection.execute("SELECT path, tmp_path FROM journal").fetchall()
+        return dict(rows) if rows else None
+
+    def clear(self):
+        with self.store.connection:
+            self.store.connection.execute("DELETE FROM journal")
+
+
+METADATA_BACKENDS = {
+    "json": JsonMetadataStore,
+    "sqlite": SqliteMetadataStore,
+}
+
+
+def get_metadata_path(config_path, backend="json"):
+    """Путь к хранилищу метаданных для файла конфигурации"""
+    base_path, _ = os.path.splitext(config_path)
+    return f"{base_path}{METADATA_BACKENDS[backend].suffix}"
+
+
+def open_metadata_store(config_path, backend=None):
+    """Открытие хранилища метаданных; без backend выбирается SQLite, если база уже существует"""
+    if backend is None:
+        backend = "sqlite" if os.path.exists(get_metadata_path(config_path, "sqlite")) else "json"
+    return METADATA_BACKENDS[backend](get_metadata_path(config_path, backend))
+
+
+def migrate_metadata(config_path, backend):
+    """Перенос метаданных из текущего хранилища в хранилище backend"""
+    source = open_metadata_store(config_path)
+    target = open_metadata_store(config_path, backend)
+    if type(source) is type(target) or not source.exists():
+        return False
+
+    metadata = source.load()
+    target.save(config_path, None, metadata)
+    source.close()
+    target.close()
+
+    # Старое хранилище переименовывается, чтобы автоопределение выбрало новое
+    os.replace(source.path, f"{source.path}.bak")
+    return True
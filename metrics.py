@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Метрики менеджера и Xray в текстовом формате Prometheus
+
+Длительности команд CLI и запросов к сервису `serve` накапливаются в файле
+`<config>.metrics.json` (гистограммы по операциям). Экспортер собирает остальные
+значения (состояние контейнера, размер конфигурации, количество пользователей,
+счетчики Xray) при опросе и кэширует результат на cache_ttl секунд, поэтому частые
+опросы не превращаются в частые обращения к Docker и API Xray.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+from config_store import FileLock, atomic_write
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_PORT = 9550
+DEFAULT_CACHE_TTL = 10.0
+
+
+def get_metrics_path(config_path):
+    """Путь к файлу накопленных метрик операций"""
+    return f"{config_path}.metrics.json"
+
+
+class OperationMetrics:
+    """Гистограммы длительности операций: накапливаются в памяти и сливаются в общий файл"""
+
+    def __init__(self, path):
+        self.path = path
+        self._pending = {}
+
+    def observe(self, operation, seconds):
+        entry = self._pending.setdefault(operation, {"count": 0, "sum": 0.0, "buckets": [0] * len(LATENCY_BUCKETS)})
+        entry["count"] += 1
+        entry["sum"] += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                entry["buckets"][i] += 1
+
+    def load(self):
+        """Накопленные гистограммы из файла: {операция: {count, sum, buckets}}"""
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as f:
+            return json.load(f).get("operations", {})
+
+    def flush(self):
+        """Слияние накопленных в памяти значений с файлом под блокировкой"""
+        if not self._pending:
+            return
+        with FileLock(f"{self.path}.lock"):
+            operations = self.load()
+            for operation, pending in self._pending.items():
+                entry = operations.setdefault(operation, {"count": 0, "sum": 0.0, "buckets": [0] * len(LATENCY_BUCKETS)})
+                entry["count"] += pending["count"]
+                entry["sum"] += pending["sum"]
+                entry["buckets"] = [a + b for a, b in zip(entry["buckets"], pending["buckets"])]
+            atomic_write(self.path, json.dumps({"operations": operations}).encode('utf-8'))
+        self._pending = {}
+
+
+def record_operation(config_path, operation, seconds):
+    """Запись длительности одной операции; ошибки записи метрик не влияют на команду"""
+    metrics = OperationMetrics(get_metrics_path(config_path))
+    metrics.observe(operation, seconds)
+    try:
+        metrics.flush()
+    except (OSError, ValueError):
+        pass
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsWriter:
+    """Формирование текста в формате Prometheus"""
+
+    def __init__(self):
+        self.lines = []
+
+    def header(self, name, metric_type, help_text):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {metric_type}")
+
+    def metric(self, name, metric_type, help_text, samples):
+        """Метрика с HELP/TYPE и списком пар (метки, значение)"""
+        self.header(name, metric_type, help_text)
+        for labels, value in samples:
+            self.sample(name, labels, value)
+
+    def sample(self, name, labels, value):
+        label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+        self.lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    def text(self):
+        return "\n".join(self.lines) + "\n"
+
+
+class MetricsExporter:
+    """Сбор метрик с кэшированием результата"""
+
+    def __init__(self, config_path, api_address=None, cache_ttl=DEFAULT_CACHE_TTL, container_name=None):
+        self.config_path = config_path
+        self.api_address = api_address
+        self.container_name = container_name
+        self.cache_ttl = cache_ttl
+        self._cache = None
+        self._cache_time = 0
+        self._lock = threading.Lock()
+
+    def render(self):
+        """Текст метрик из кэша или новый сбор; параллельные опросы ждут один сбор"""
+        with self._lock:
+            if self._cache is None or time.monotonic() - self._cache_time >= self.cache_ttl:
+                started = time.perf_counter()
+                writer = MetricsWriter()
+                self._collect(writer)
+                writer.metric("xray_manager_scrape_duration_seconds", "gauge",
+                              "Время сбора метрик", [({}, f"{time.perf_counter() - started:.6f}")])
+                self._cache = writer.text()
+                self._cache_time = time.monotonic()
+            return self._cache
+
+    def _collect(self, writer):
+        self._collect_container(writer)
+        config_manager = self._collect_config(writer)
+        self._collect_restarts(writer)
+        self._collect_operations(writer)
+        if config_manager is not None and config_manager.has_api():
+            self._collect_xray(writer, config_manager)
+
+    def _collect_container(self, writer):
+        from docker_manager import DockerManager
+
+        state = DockerManager(container_name=self.container_name).get_container_state()
+        writer.metric("xray_container_up", "gauge", "Контейнер Xray запущен (1) или нет (0)",
+                      [({}, 1 if state and state.get("Running") else 0)])
+        writer.metric("xray_container_restart_count", "gauge", "Перезапуски контейнера политикой Docker",
+                      [({}, state.get("RestartCount", 0) if state else 0)])
+
+    def _collect_config(self, writer):
+        from config_manager import ConfigManager
+        from metadata_store import open_metadata_store
+
+        sizes = []
+        for kind, path in (("config", self.config_path), ("metadata", open_metadata_store(self.config_path).path)):
+            if os.path.exists(path):
+                sizes.append(({"file": kind}, os.path.getsize(path)))
+        writer.metric("xray_manager_config_size_bytes", "gauge", "Размер файлов конфигурации и метаданных", sizes)
+
+        if not os.path.exists(self.config_path):
+            return None
+        config_manager = ConfigManager()
+        config_manager.load_config(self.config_path)
+        writer.metric("xray_manager_users", "gauge", "Количество пользователей", [({}, len(config_manager.registry))])
+        user_inbounds = config_manager.get_user_inbounds()
+        writer.metric("xray_manager_short_ids", "gauge", "Количество shortId в realitySettings",
+                      [({}, sum(len(inbound["streamSettings"]["realitySettings"].get("shortIds", []))
+                             for inbound in user_inbounds.values()))])
+        writer.metric("xray_manager_inbound_users", "gauge", "Количество пользователей в inbound",
+                      [({"inbound": config_manager.get_inbound_tag(tag)}, len(inbound["settings"]["clients"]))
+                       for tag, inbound in user_inbounds.items()])
+        writer.metric("xray_manager_config_generation", "gauge", "Поколение метаданных конфигурации",
+                      [({}, config_manager.generation)])
+        return config_manager
+
+    def _collect_restarts(self, writer):
+        from restart_scheduler import RestartScheduler
+
+        restarts = RestartScheduler(self.config_path).metrics()
+        writer.metric("xray_manager_restart_requests_total", "counter", "Запрошенные перезапуски", [({}, restarts["requests"])])
+        writer.metric("xray_manager_restarts_total", "counter", "Выполненные перезапуски", [({}, restarts["restarts"])])
+        writer.metric("xray_manager_restarts_saved_total", "counter", "Перезапуски, объединенные с другими",
+                      [({}, restarts["saved"])])
+
+    def _collect_operations(self, writer):
+        name = "xray_manager_operation_duration_seconds"
+        writer.header(name, "histogram", "Длительность команд CLI и запросов к сервису управления")
+        for operation, entry in sorted(OperationMetrics(get_metrics_path(self.config_path)).load().items()):
+            for bound, count in zip(LATENCY_BUCKETS, entry["buckets"]):
+                writer.sample(f"{name}_bucket", {"operation": operation, "le": bound}, count)
+            writer.sample(f"{name}_bucket", {"operation": operation, "le": "+Inf"}, entry["count"])
+            writer.sample(f"{name}_sum", {"operation": operation}, f"{entry['sum']:.6f}")
+            writer.sample(f"{name}_count", {"operation": operation}, entry["count"])
+
+    def _collect_xray(self, writer, config_manager):
+        from stats import StatsStore, get_stats_path
+        from xray_api import XrayApiClient, XrayApiError
+
+        # Накопленный трафик пользователей от сборщика stats-collect (монотонные счетчики)
+        totals = StatsStore(get_stats_path(self.config_path)).totals()
+        samples = []
+        for user, (uplink, downlink, _) in sorted(totals.items()):
+            samples.append(({"user": user, "direction": "uplink"}, uplink))
+            samples.append(({"user": user, "direction": "downlink"}, downlink))
+        writer.metric("xray_user_traffic_bytes_total", "counter", "Трафик пользователей, собранный stats-collect", samples)
+
+        # Текущие значения счетчиков Xray (сбрасываются сборщиком статистики пользователей)
+        if not config_manager.has_stats():
+            return
+        api_client = XrayApiClient(self.api_address or config_manager.get_api_address())
+        stats = None
+        try:
+            stats = api_client.query_stats("")
+        except XrayApiError as e:
+            print(f"Ошибка при опросе API Xray: {e}", file=sys.stderr)
+        finally:
+            api_client.close()
+
+        writer.metric("xray_api_up", "gauge", "API Xray отвечает (1) или нет (0)", [({}, int(stats is not None))])
+        if stats is None:
+            return
+        samples = []
+        for stat_name, value in sorted(stats.items()):
+            parts = stat_name.split(">>>")
+            if len(parts) == 4 and parts[2] == "traffic":
+                samples.append(({"kind": parts[0], "name": parts[1], "direction": parts[3]}, value))
+        writer.metric("xray_traffic_bytes", "gauge", "Счетчики трафика Xray с момента последнего обнуления", samples)
+
+
+def serve_metrics(exporter, host="127.0.0.1", port=DEFAULT_PORT):
+    """HTTP-сервер с метриками по адресу /metrics"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = exporter.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    print(f"Метрики доступны по адресу http://{host}:{port}/metrics", file=sys.stderr)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
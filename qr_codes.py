@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Построение QR-кодов и компактное кодирование содержимого
+
+Содержимое QR-кода с конфигурацией клиента задается режимом:
+    json     - JSON с отступами-пробелами, как раньше (по умолчанию)
+    compact  - минифицированный JSON
+    deflate  - минифицированный JSON, сжатый zlib и закодированный base45 (RFC 9285)
+               с префиксом DEFLATE_PREFIX; все символы base45 входят в алфавитно-цифровой
+               режим QR-кода (5,5 бит на символ), поэтому код почти не больше сжатых данных.
+               Клиент должен уметь раскодировать такой формат (inflate_payload)
+    link     - только VLESS-ссылка
+
+В компактных режимах версия QR-кода вычисляется сразу по длине данных, а маска
+задается фиксированной: qrcode по умолчанию строит код со всеми восемью масками
+и выбирает лучшую, что в несколько раз дороже построения с одной маской. SVG
+собирается из матрицы модулей без растеризации, поэтому не требует Pillow.
+"""
+
+import io
+import json
+import zlib
+
+PAYLOAD_MODES = ("json", "compact", "deflate", "link")
+DEFLATE_PREFIX = "XRC1:"
+COMPACT_MASK_PATTERN = 0
+BOX_SIZE = 10
+BORDER = 4
+
+BASE45_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
+_BASE45_VALUES = {char: value for value, char in enumerate(BASE45_ALPHABET)}
+
+
+def base45_encode(data):
+    """Кодирование байтов в строку base45 (RFC 9285)"""
+    chars = []
+    for i in range(0, len(data) - 1, 2):
+        value = data[i] * 256 + data[i + 1]
+        chars.extend((value % 45, value // 45 % 45, value // 2025))
+    if len(data) % 2:
+        chars.extend((data[-1] % 45, data[-1] // 45))
+    return "".join(BASE45_ALPHABET[value] for value in chars)
+
+
+def base45_decode(text):
+    """Декодирование строки base45 в байты, ValueError при некорректной строке"""
+    try:
+        values = [_BASE45_VALUES[char] for char in text]
+    except KeyError as e:
+        raise ValueError(f"недопустимый символ base45: {e}")
+    if len(values) % 3 == 1:
+        raise ValueError("некорректная длина строки base45")
+    data = bytearray()
+    for i in range(0, len(values), 3):
+        chunk = values[i:i + 3]
+        value = sum(digit * 45 ** power for power, digit in enumerate(chunk))
+        if len(chunk) == 3:
+            if value > 0xFFFF:
+                raise ValueError("некорректная группа base45")
+            data.extend(divmod(value, 256))
+        else:
+            if value > 0xFF:
+                raise ValueError("некорректная группа base45")
+            data.append(value)
+    return bytes(data)
+
+
+def encode_config(client_config, mode="json"):
+    """Строка для QR-кода с конфигурацией клиента в режиме json, compact или deflate"""
+    if mode == "json":
+        return json.dumps(client_config)
+    minified = json.dumps(client_config, separators=(",", ":"))
+    if mode == "compact":
+        return minified
+    if mode == "deflate":
+        return DEFLATE_PREFIX + base45_encode(zlib.compress(minified.encode('utf-8'), 9))
+    raise ValueError(f"неизвестный режим содержимого QR-кода: {mode}")
+
+
+def inflate_payload(payload):
+    """Конфигурация клиента из строки режима deflate"""
+    if not payload.startswith(DEFLATE_PREFIX):
+        raise ValueError("строка не в формате deflate")
+    return json.loads(zlib.decompress(base45_decode(payload[len(DEFLATE_PREFIX):])))
+
+
+def qr_version(data, error_correction):
+    """Минимальная версия QR-кода для строки data одним сегментом"""
+    from qrcode import exceptions, util
+
+    segment = util.QRData(data)
+    buffer = util.BitBuffer()
+    segment.write(buffer)
+    for version in range(1, 41):
+        needed_bits = 4 + util.length_in_bits(segment.mode, version) + len(buffer)
+        if needed_bits <= util.BIT_LIMIT_TABLE[error_correction][version]:
+            return version
+    raise exceptions.DataOverflowError()
+
+
+def make_qr(data, compact=False):
+    """Построение QR-кода для строки
+
+    compact - версия по длине данных и фиксированная маска вместо перебора масок.
+    """
+    # qrcode и Pillow загружаются только командами, которые строят QR-коды
+    import qrcode
+
+    error_correction = qrcode.constants.ERROR_CORRECT_L
+    if not compact:
+        qr = qrcode.QRCode(version=1, error_correction=error_correction, box_size=BOX_SIZE, border=BORDER)
+        qr.add_data(data)
+        qr.make(fit=True)
+        return qr
+
+    qr = qrcode.QRCode(
+        version=qr_version(data, error_correction),
+        error_correction=error_correction,
+        box_size=BOX_SIZE,
+        border=BORDER,
+        mask_pattern=COMPACT_MASK_PATTERN,
+    )
+    qr.add_data(data, optimize=0)
+    qr.make(fit=False)
+    return qr
+
+
+def render_qr_ascii(data, compact=False):
+    """QR-код в виде текста для терминала, возвращает байты UTF-8"""
+    buffer = io.StringIO()
+    make_qr(data, compact).print_ascii(out=buffer, invert=True)
+    return buffer.getvalue().encode('utf-8')
+
+
+def render_qr_png(data, compact=False):
+    """Растеризация QR-кода в PNG, возвращает байты изображения
+
+    Функция уровня модуля, чтобы ее можно было выполнять в пуле процессов.
+    """
+    img = make_qr(data, compact).make_image(fill_color="black", back_color="white")
+    buffer = io.BytesIO()
+    img.save(buffer)
+    return buffer.getvalue()
+
+
+def render_qr_svg(data, compact=False):
+    """QR-код в SVG: один путь из горизонтальных отрезков темных модулей, возвращает байты"""
+    modules = make_qr(data, compact).modules
+    size = len(modules) + 2 * BORDER
+    path = []
+    for y, row in enumerate(modules, BORDER):
+        x = 0
+        while x < len(row):
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < len(row) and row[x]:
+                x += 1
+            path.append(f"M{start + BORDER} {y}h{x - start}v1h-{x - start}z")
+    svg = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" '
+        f'width="{size * BOX_SIZE}" height="{size * BOX_SIZE}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path d="{"".join(path)}" fill="#000"/></svg>\n'
+    )
+    return svg.encode('ascii')
+
+
+RENDERERS = {"png": render_qr_png, "svg": render_qr_svg, "ascii": render_qr_ascii}
+
+
+def qr_format(save_path):
+    """Формат файла QR-кода по расширению: svg или png"""
+    return "svg" if save_path.lower().endswith(".svg") else "png"
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Отложенный перезапуск Xray с объединением запросов от нескольких процессов
+
+Запрос перезапуска записывается в файл состояния `<config>.restart.json` под блокировкой
+`<config>.restart.lock`. Перезапуск выполняет один исполнитель, удерживающий блокировку
+`<config>.restart.run`: он ждет, пока запросы не стихнут на debounce секунд (но не дольше
+max_delay от первого запроса), и выполняет один перезапуск на все накопленные запросы.
+Если исполнителя нет, запросивший процесс запускает его в фоне и сразу завершается.
+"""
+
+import json
+import os
+import sys
+import time
+
+from config_store import FileLock, atomic_write
+
+DEFAULT_DEBOUNCE = 1.0
+DEFAULT_MAX_DELAY = 10.0
+
+
+class RestartScheduler:
+    """Планировщик перезапусков с окном объединения и метриками сэкономленных перезапусков"""
+
+    def __init__(self, config_path, debounce=DEFAULT_DEBOUNCE, max_delay=DEFAULT_MAX_DELAY, container_name=None):
+        self.config_path = config_path
+        self.container_name = container_name
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.state_path = f"{config_path}.restart.json"
+        self.lock_path = f"{config_path}.restart.lock"
+        self.runner_lock_path = f"{config_path}.restart.run"
+
+    def _read_state(self):
+        state = {"pending": 0, "first_request": None, "due": None,
+                 "requests": 0, "restarts": 0, "saved": 0, "last_restart": None, "last_result": None}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as f:
+                state.update(json.load(f))
+        return state
+
+    def _write_state(self, state):
+        atomic_write(self.state_path, json.dumps(state, indent=2).encode('utf-8'))
+
+    def request(self, detach=True):
+        """Запрос перезапуска; без detach исполнитель работает в текущем процессе до перезапуска"""
+        now = time.time()
+        with FileLock(self.lock_path):
+            state = self._read_state()
+            if not state["pending"]:
+                state["first_request"] = now
+            state["pending"] += 1
+            state["requests"] += 1
+            state["due"] = min(now + self.debounce, state["first_request"] + self.max_delay)
+            self._write_state(state)
+
+        if not detach:
+            self.run()
+            return
+
+        # Занятая блокировка означает, что исполнитель есть и увидит этот запрос до своего завершения
+        probe = FileLock(self.runner_lock_path)
+        if probe.acquire(blocking=False):
+            probe.release()
+            self._spawn_runner()
+
+    def _spawn_runner(self):
+        """Запуск исполнителя отдельным процессом, не привязанным к терминалу"""
+        import subprocess
+        command = [sys.executable, os.path.abspath(__file__), self.config_path]
+        if self.container_name:
+            command.append(self.container_name)
+        subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+
+    def run(self):
+        """Цикл исполнителя: ожидание окна и перезапуск, пока есть запросы
+
+        Возвращает False, если исполнитель уже работает в другом процессе.
+        """
+        runner_lock = FileLock(self.runner_lock_path)
+        if not runner_lock.acquire(blocking=False):
+            return False
+
+        try:
+            while True:
+                with FileLock(self.lock_path):
+                    state = self._read_state()
+                    if not state["pending"]:
+                        # Освобождение под блокировкой состояния: новый запрос либо уже виден, либо запустит исполнителя
+                        runner_lock.release()
+                        return True
+
+                    wait = state["due"] - time.time()
+                    if wait <= 0:
+                        # Запросы, пришедшие во время перезапуска, откроют новое окно
+                        pending = state["pending"]
+                        state["pending"] = 0
+                        state["first_request"] = None
+                        state["due"] = None
+                        self._write_state(state)
+
+                if wait > 0:
+                    time.sleep(wait)
+                    continue
+
+                restarted = self._restart()
+
+                with FileLock(self.lock_path):
+                    state = self._read_state()
+                    state["restarts"] += 1
+                    state["saved"] += pending - 1
+                    state["last_restart"] = time.time()
+                    state["last_result"] = "ok" if restarted else "failed"
+                    self._write_state(state)
+        finally:
+            runner_lock.release()
+
+    def _restart(self):
+        from docker_manager import DockerManager
+        return DockerManager(container_name=self.container_name).restart_xray()
+
+    def metrics(self):
+        """Счетчики запросов, выполненных и сэкономленных перезапусков"""
+        with FileLock(self.lock_path):
+            return self._read_state()
+
+
+def schedule_restart(config_path, container_name=None):
+    """Запрос перезапуска Xray после изменения конфигурации config_path"""
+    RestartScheduler(config_path, container_name=container_name).request()
+    print(f"Перезапуск Xray запланирован: запросы за {DEFAULT_DEBOUNCE:g} с объединяются в один", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    RestartScheduler(sys.argv[1], container_name=sys.argv[2] if len(sys.argv) > 2 else None).run()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Статистика трафика пользователей через StatsService Xray
+
+Счетчики `user>>>{email}>>>traffic>>>{uplink|downlink}` всех пользователей читаются
+одним запросом QueryStats с обнулением (reset), поэтому каждое значение - прирост
+с прошлого опроса. Приросты складываются в базу SQLite `*_stats.db` по интервалам
+фиксированной длины: одна строка на пользователя и интервал, только при ненулевом трафике.
+"""
+
+import os
+import re
+import sys
+import time
+
+USER_STATS_PATTERN = "user>>>"
+DEFAULT_INTERVAL = 60
+DEFAULT_BUCKET = 300
+DEFAULT_RETENTION_DAYS = 30
+
+
+def get_stats_path(config_path):
+    """Путь к базе статистики для файла конфигурации"""
+    base_path, _ = os.path.splitext(config_path)
+    return f"{base_path}_stats.db"
+
+
+def parse_user_stats(stats):
+    """Счетчики QueryStats -> {email: [uplink, downlink]}"""
+    users = {}
+    for name, value in stats.items():
+        parts = name.split(">>>")
+        if len(parts) == 4 and parts[0] == "user" and parts[2] == "traffic":
+            entry = users.setdefault(parts[1], [0, 0])
+            entry[0 if parts[3] == "uplink" else 1] += value
+    return users
+
+
+def parse_duration(value):
+    """Длительность вида 30m, 24h, 7d или число секунд -> секунды"""
+    match = re.fullmatch(r"(\d+)([smhd]?)", value.strip())
+    if not match:
+        raise ValueError(f"Некорректная длительность: {value}")
+    number, unit = match.groups()
+    return int(number) * {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}[unit]
+
+
+def format_bytes(value):
+    """Размер в байтах в человекочитаемом виде"""
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if value < 1024:
+            return f"{value:.0f} {unit}" if unit == "Б" else f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} ТБ"
+
+
+class StatsStore:
+    """Временные ряды трафика пользователей в SQLite
+
+    Имена хранятся один раз в таблице names, ряды - в таблице samples без rowid
+    с ключом (пользователь, интервал), накопленные суммы - в таблице totals.
+    """
+
+    def __init__(self, path, bucket=DEFAULT_BUCKET):
+        self.path = path
+        self.bucket = bucket
+        self._connection = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    @property
+    def connection(self):
+        """Ленивое открытие базы и создание схемы"""
+        if self._connection is None:
+            import sqlite3
+            self._connection = sqlite3.connect(self.path)
+            self._connection.executescript("""
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+                CREATE TABLE IF NOT EXISTS samples (
+                    name_id INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    uplink INTEGER NOT NULL,
+                    downlink INTEGER NOT NULL,
+                    PRIMARY KEY (name_id, bucket)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS samples_bucket ON samples (bucket);
+                CREATE TABLE IF NOT EXISTS totals (
+                    name_id INTEGER PRIMARY KEY,
+                    uplink INTEGER NOT NULL,
+                    downlink INTEGER NOT NULL,
+                    last_seen REAL NOT NULL
+                );
+            """)
+        return self._connection
+
+    def _name_ids(self, names):
+        """ID имен пользователей, новые имена добавляются"""
+        connection = self.connection
+        connection.executemany("INSERT OR IGNORE INTO names (name) VALUES (?)", [(name,) for name in names])
+        ids = {}
+        for name in names:
+            ids[name] = connection.execute("SELECT id FROM names WHERE name = ?", (name,)).fetchone()[0]
+        return ids
+
+    def add(self, deltas, timestamp=None):
+        """Добавление приростов {email: [uplink, downlink]} одной транзакцией"""
+        if not deltas:
+            return
+        timestamp = timestamp or time.time()
+        bucket = int(timestamp // self.bucket)
+
+        with self.connection as connection:
+            ids = self._name_ids(list(deltas))
+            connection.executemany(
+                """INSERT INTO samples (name_id, bucket, uplink, downlink) VALUES (?, ?, ?, ?)
+                   ON CONFLICT (name_id, bucket) DO UPDATE SET
+                       uplink = uplink + excluded.uplink, downlink = downlink + excluded.downlink""",
+                [(ids[name], bucket, uplink, downlink) for name, (uplink, downlink) in deltas.items()]
+            )
+            connection.executemany(
+                """INSERT INTO totals (name_id, uplink, downlink, last_seen) VALUES (?, ?, ?, ?)
+                   ON CONFLICT (name_id) DO UPDATE SET
+                       uplink = uplink + excluded.uplink, downlink = downlink + excluded.downlink,
+                       last_seen = excluded.last_seen""",
+                [(ids[name], uplink, downlink, timestamp) for name, (uplink, downlink) in deltas.items()]
+            )
+
+    def prune(self, before):
+        """Удаление интервалов старше before (timestamp); накопленные суммы сохраняются"""
+        with self.connection as connection:
+            connection.execute("DELETE FROM samples WHERE bucket < ?", (int(before // self.bucket),))
+
+    def totals(self):
+        """Накопленный трафик: {email: (uplink, downlink, last_seen)}"""
+        if not self.exists():
+            return {}
+        rows = self.connection.execute(
+            "SELECT n.name, t.uplink, t.downlink, t.last_seen FROM totals t JOIN names n ON n.id = t.name_id"
+        )
+        return {name: (uplink, downlink, last_seen) for name, uplink, downlink, last_seen in rows}
+
+    def top(self, limit=10, since=None, order="total"):
+        """Пользователи с наибольшим трафиком: список (email, uplink, downlink)
+
+        Без since используются накопленные суммы, иначе - интервалы начиная с since.
+        """
+        if not self.exists():
+            return []
+        order_by = {"total": "uplink + downlink", "uplink": "uplink", "downlink": "downlink"}[order]
+        if since is None:
+            query = f"""SELECT n.name, t.uplink AS uplink, t.downlink AS downlink
+                        FROM totals t JOIN names n ON n.id = t.name_id
+                        ORDER BY {order_by} DESC LIMIT ?"""
+            params = (limit,)
+        else:
+            query = f"""SELECT n.name, SUM(s.uplink) AS uplink, SUM(s.downlink) AS downlink
+                        FROM samples s JOIN names n ON n.id = s.name_id
+                        WHERE s.bucket >= ? GROUP BY s.name_id
+                        ORDER BY {order_by} DESC LIMIT ?"""
+            params = (int(since // self.bucket), limit)
+        return self.connection.execute(query, params).fetchall()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class StatsCollector:
+    """Периодический опрос StatsService с обнулением счетчиков и записью приростов"""
+
+    def __init__(self, api_client, store):
+        self.api_client = api_client
+        self.store = store
+
+    def poll(self):
+        """Один опрос: все счетчики пользователей одним запросом, возвращает ненулевые приросты"""
+        stats = self.api_client.query_stats(USER_STATS_PATTERN, reset=True)
+        deltas = {email: values for email, values in parse_user_stats(stats).items() if any(values)}
+        self.store.add(deltas)
+        return deltas
+
+    def run(self, interval=DEFAULT_INTERVAL, retention_days=DEFAULT_RETENTION_DAYS):
+        """Опрос каждые interval секунд до прерывания, старые интервалы удаляются раз в час"""
+        from xray_api import XrayApiError
+
+        last_prune = 0
+        while True:
+            started = time.time()
+            try:
+                deltas = self.poll()
+                print(f"Собрана статистика: пользователей с трафиком {len(deltas)}", file=sys.stderr)
+            except XrayApiError as e:
+                print(f"Ошибка при опросе статистики: {e}", file=sys.stderr)
+
+            if started - last_prune >= 3600:
+                self.store.prune(started - retention_days * 86400)
+                last_prune = started
+
+            time.sleep(max(0, interval - (time.time() - started)))
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Подписки: наборы VLESS-ссылок пользователя в base64
+
+Подписка пользователя содержит ссылку на каждый узел и каждое имя из serverNames.
+Адрес подписки - /sub/<token>, где token - HMAC секрета подписок (хранится в метаданных)
+и UUID пользователя, поэтому по адресу нельзя подобрать чужую подписку, а новый
+секрет отзывает все адреса сразу.
+
+Готовые наборы кэшируются вместе с отпечатком входных данных (UUID и shortId
+пользователя, ключ, порт, serverNames и адрес каждого узла). Повторный запрос
+сравнивает отпечаток и отдает готовое тело с ETag; набор пересобирается только
+после изменения этого пользователя или параметров сервера.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import sys
+import time
+
+SUBSCRIPTION_KEY = "subscription"
+TOKEN_REBUILD_INTERVAL = 1.0
+NODE_RELOAD_INTERVAL = 5.0
+
+
+def get_subscription_secret(config_manager, create=True):
+    """Секрет подписок из метаданных; при отсутствии создается и записывается"""
+    settings = config_manager.user_metadata.get(SUBSCRIPTION_KEY) or {}
+    if not settings.get("secret") and create:
+        settings = dict(settings, secret=secrets.token_hex(32))
+        config_manager.save_metadata_value(SUBSCRIPTION_KEY, settings)
+    return settings.get("secret")
+
+
+def subscription_token(secret, user_id):
+    """Токен адреса подписки пользователя"""
+    digest = hmac.new(secret.encode('utf-8'), user_id.encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode('ascii')
+
+
+class SubscriptionSource:
+    """Узел в подписке: конфигурация и адрес, по которому к нему подключаются клиенты"""
+
+    def __init__(self, label, config_manager, server_address=None, config_path=None):
+        from user_manager import UserManager
+
+        self.label = label
+        self.config_manager = config_manager
+        self.server_address = server_address
+        # Конфигурация другого узла перечитывается при изменении файла
+        self.config_path = config_path
+        self.user_manager = UserManager(config_manager)
+        self._mtime = None
+        self._checked = 0
+
+    def refresh(self):
+        """Перечитывание конфигурации узла, если файл изменился (не чаще NODE_RELOAD_INTERVAL)"""
+        if not self.config_path or time.monotonic() - self._checked < NODE_RELOAD_INTERVAL:
+            return
+        self._checked = time.monotonic()
+        try:
+            mtime = os.stat(self.config_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._mtime:
+            # Полная загрузка: в ленивом режиме SQLite config.json не читается и serverNames пусты
+            self.config_manager.load_config(self.config_path)
+            self._mtime = mtime
+
+    def fingerprint(self, name, server_address):
+        """Входные данные ссылок пользователя на этом узле или None, если пользователя на узле нет"""
+        user_info = self.config_manager.get_client_by_name(name)
+        if not user_info:
+            return None
+        user_id, user_data = user_info
+        tag = user_data.get("inbound")
+        server_info = self.config_manager.get_server_info(tag)
+        reality_settings = self.config_manager.get_reality_settings(tag)
+        return (
+            self.label, server_address, user_id, user_data.get("shortId"), server_info.get("publicKey"),
+            server_info.get("port"), tuple(reality_settings.get("serverNames", []))
+        )
+
+    def links(self, name, server_address):
+        """Ссылки пользователя на все serverNames его inbound на узле"""
+        tag = self.config_manager.get_client_by_name(name)[1].get("inbound")
+        links = []
+        for server_name in self.config_manager.get_reality_settings(tag).get("serverNames", []):
+            remark = f"{name} {self.label} {server_name}" if self.label else f"{name} {server_name}"
+            link = self.user_manager.generate_vless_link(name, server_address, server_name, remark)
+            if link:
+                links.append(link)
+        return links
+
+
+class SubscriptionService:
+    """Выдача подписок по токену с кэшем готовых наборов"""
+
+    def __init__(self, config_manager, nodes=()):
+        self.config_manager = config_manager
+        self.sources = [SubscriptionSource("", config_manager)] + list(nodes)
+        self.secret = get_subscription_secret(config_manager)
+        # token -> UUID пользователя, UUID -> (отпечаток, ETag, тело)
+        self._tokens = {}
+        self._tokens_built = 0
+        self._bundles = {}
+
+    def token_for(self, user_id):
+        return subscription_token(self.secret, user_id)
+
+    def _find_user(self, token):
+        """UUID пользователя по токену; индекс токенов перестраивается при промахе не чаще раза в секунду"""
+        user_id = self._tokens.get(token)
+        if user_id is None and time.monotonic() - self._tokens_built >= TOKEN_REBUILD_INTERVAL:
+            self._tokens = {self.token_for(user_id): user_id for user_id, _ in self.config_manager.iter_users()}
+            self._tokens_built = time.monotonic()
+            user_id = self._tokens.get(token)
+        return user_id
+
+    def get(self, token, server_address):
+        """Подписка по токену: (ETag, тело) или None, если токен не найден
+
+        server_address - адрес этого узла; у остальных узлов адрес задан в инвентаре.
+        """
+        user_id = self._find_user(token)
+        user_data = self.config_manager.user_metadata.get("users", {}).get(user_id) if user_id else None
+        if not user_data:
+            self._bundles.pop(user_id, None)
+            return None
+        name = user_data["name"]
+
+        fingerprint = []
+        for source in self.sources:
+            source.refresh()
+            fingerprint.append(source.fingerprint(name, source.server_address or server_address))
+
+        cached = self._bundles.get(user_id)
+        if cached and cached[0] == fingerprint:
+            return cached[1], cached[2]
+
+        links = []
+        for source, source_fingerprint in zip(self.sources, fingerprint):
+            if source_fingerprint is None:
+                continue
+            source_links = source.links(name, source.server_address or server_address)
+            if not source_links:
+                print(f"Узел {source.label or 'текущий'} не добавил ссылок в подписку {name}: "
+                      f"нет serverNames в inbound пользователя", file=sys.stderr)
+            links.extend(source_links)
+        body = base64.b64encode("\n".join(links).encode('utf-8'))
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self._bundles[user_id] = (fingerprint, etag, body)
+        return etag, body
+
+
+def load_fleet_sources(inventory_path, config_path):
+    """Узлы флота для подписок: локальные узлы инвентаря с адресом server, кроме текущей конфигурации"""
+    from config_manager import ConfigManager
+    from fleet import load_inventory
+
+    sources = []
+    for node in load_inventory(inventory_path):
+        if node["transport"] != "local" or not node.get("server"):
+            continue
+        if os.path.abspath(node["config"]) == os.path.abspath(config_path):
+            continue
+        source = SubscriptionSource(node["name"], ConfigManager(), node["server"], node["config"])
+        source.refresh()
+        config_manager = source.config_manager
+        if not any(config_manager.get_reality_settings(tag).get("serverNames") for tag in config_manager.get_user_inbounds()):
+            print(f"Узел {node['name']} ({node['config']}) не добавит ссылок в подписки: нет serverNames",
+                  file=sys.stderr)
+        sources.append(source)
+    return sources
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Общие заготовки тестов: конфигурации во временной директории"""
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from config_manager import ConfigManager
+from user_manager import UserManager
+
+
+def make_config(path, names=(), backend=None, extra_port=None):
+    """Конфигурация с пользователями names (и дополнительным inbound на extra_port), записанная в path"""
+    config_manager = ConfigManager(metadata_backend=backend)
+    with contextlib.redirect_stdout(io.StringIO()):
+        config_manager.create_config("example.com:443", ["example.com"])
+        if extra_port:
+            config_manager.add_inbound(extra_port)
+        user_manager = UserManager(config_manager)
+        for name in names:
+            user_manager.add_user(name)
+        config_manager.save_config(path)
+    return config_manager
+
+
+class TempDirTestCase(unittest.TestCase):
+    """Тест с временной директорией, удаляемой после теста"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
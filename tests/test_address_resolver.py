@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Определение адреса сервера: источники на локальном HTTP-сервере, гонка и кэш"""
+
+import contextlib
+import io
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from address_resolver import AddressResolver, resolve_http, resolve_source
+from config_manager import ConfigManager
+from support import TempDirTestCase, make_config
+
+SLOW_DELAY = 1.0
+
+
+class StubSourceHandler(BaseHTTPRequestHandler):
+    # Путь -> (задержка, статус, тело)
+    routes = {
+        "/fast": (0, 200, b"203.0.113.7\n"),
+        "/slow": (SLOW_DELAY, 200, b"198.51.100.9"),
+        "/text": (0, 200, b"<html>not an address</html>"),
+        "/error": (0, 500, b""),
+    }
+
+    def do_GET(self):
+        self.server.hits.append(self.path)
+        delay, status, body = self.routes[self.path]
+        time.sleep(delay)
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AddressResolverTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubSourceHandler)
+        self.server.daemon_threads = True
+        self.server.hits = []
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+        config_path = self.path("config.json")
+        make_config(config_path)
+        self.config_manager = ConfigManager()
+        self.config_manager.load_config(config_path)
+
+    def resolver(self, *paths, **kwargs):
+        return AddressResolver(self.config_manager, [f"http:{self.base}{path}" for path in paths], **kwargs)
+
+    def test_resolve_http(self):
+        self.assertEqual(resolve_http(f"{self.base}/fast"), "203.0.113.7")
+        self.assertIsNone(resolve_http(f"{self.base}/text"))
+        self.assertEqual(resolve_source("static:vpn.example.com"), "vpn.example.com")
+
+    def test_first_answer_wins(self):
+        started = time.monotonic()
+        self.assertEqual(self.resolver("/slow", "/fast").race(), "203.0.113.7")
+        self.assertLess(time.monotonic() - started, SLOW_DELAY)
+
+    def test_failed_sources_are_skipped(self):
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(self.resolver("/error", "/text", "/slow").race(), "198.51.100.9")
+
+    def test_timeout(self):
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertIsNone(self.resolver("/slow", timeout=0.1).race())
+
+    def test_cached_address(self):
+        resolver = self.resolver("/fast")
+        self.assertEqual(resolver.resolve(), "203.0.113.7")
+        self.assertEqual(resolver.resolve(), "203.0.113.7")
+        self.assertEqual(self.server.hits, ["/fast"])
+
+        # Кэш записан в метаданные и действителен в другом процессе
+        config_manager = ConfigManager()
+        config_manager.load_config(self.path("config.json"))
+        self.assertEqual(AddressResolver(config_manager, resolver.sources).get_cached(), "203.0.113.7")
+
+        # Другие источники или истекший срок - новый опрос
+        self.assertIsNone(self.resolver("/slow").get_cached())
+        expired = self.resolver("/fast", ttl=-1)
+        expired.store("203.0.113.7")
+        self.assertIsNone(expired.get_cached())
+        self.assertEqual(resolver.resolve(refresh=True), "203.0.113.7")
+        self.assertEqual(self.server.hits, ["/fast", "/fast"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Восстановление прерванной записи конфигурации и метаданных по журналу"""
+
+import contextlib
+import io
+import json
+import os
+import unittest
+from unittest import mock
+
+import config_store
+from config_manager import ConfigManager
+from config_store import ConfigStore, FileJournal, check_consistency
+from support import TempDirTestCase, make_config
+from user_manager import UserManager
+
+
+class Crash(Exception):
+    """Имитация падения процесса в середине записи"""
+
+
+class RecoveryTest(TempDirTestCase):
+    backend = "json"
+
+    def setUp(self):
+        super().setUp()
+        self.config_path = self.path("config.json")
+        make_config(self.config_path, ["alice"], backend=self.backend)
+
+    def load(self):
+        config_manager = ConfigManager()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            config_manager.load_config(self.config_path)
+        return config_manager, output.getvalue()
+
+    def interrupted_add(self, name, **patches):
+        """Добавление пользователя, запись которого прерывается в указанном месте"""
+        config_manager, _ = self.load()
+        UserManager(config_manager).add_user(name)
+        with contextlib.ExitStack() as stack:
+            for target, side_effect in patches.items():
+                stack.enter_context(mock.patch(target.replace("__", "."), side_effect=side_effect))
+            with contextlib.redirect_stdout(io.StringIO()):
+                # save_config сообщает об ошибке и возвращает False
+                self.assertFalse(config_manager.save_config(self.config_path))
+
+    def names(self, config_manager):
+        return sorted(user_data["name"] for _, user_data in config_manager.iter_users())
+
+    def client_count(self):
+        with open(self.config_path) as f:
+            return len(json.load(f)["inbounds"][0]["settings"]["clients"])
+
+    def leftovers(self):
+        return sorted(name for name in os.listdir(self.tmp) if name.endswith((".tmp", ".journal")))
+
+    def test_crash_before_commit_rolls_back(self):
+        journal = "config_store__FileJournal__commit" if self.backend == "json" else "metadata_store___SqliteJournal__commit"
+        self.interrupted_add("bob", **{journal: Crash})
+        self.assertTrue(self.leftovers())
+
+        config_manager, output = self.load()
+        self.assertIn("Отменена незавершенная запись", output)
+        self.assertEqual(self.names(config_manager), ["alice"])
+        self.assertEqual(self.client_count(), 1)
+        self.assertEqual(config_manager.check_consistency(), [])
+        self.assertEqual(self.leftovers(), [])
+
+    def test_crash_after_commit_is_replayed(self):
+        self.interrupted_add("bob", config_store__ConfigStore___apply=Crash)
+        config_manager, output = self.load()
+        self.assertIn("Завершена прерванная запись", output)
+        self.assertEqual(self.names(config_manager), ["alice", "bob"])
+        self.assertEqual(self.client_count(), 2)
+        self.assertEqual(config_manager.check_consistency(), [])
+        self.assertEqual(self.leftovers(), [])
+
+    def test_half_applied_journal_is_replayed(self):
+        # Первый файл транзакции уже переименован, второй - нет
+        if self.backend != "json":
+            self.skipTest("в транзакции SQLite один файл - config.json")
+        replace = os.replace
+        calls = []
+
+        def replace_once(src, dst):
+            calls.append(dst)
+            if len(calls) > 1 and src.endswith(".tmp"):
+                raise Crash()
+            replace(src, dst)
+
+        self.interrupted_add("bob", config_store__os__replace=replace_once)
+        config_manager, output = self.load()
+        self.assertIn("Завершена прерванная запись", output)
+        self.assertEqual(self.names(config_manager), ["alice", "bob"])
+        self.assertEqual(self.client_count(), 2)
+        self.assertEqual(config_manager.check_consistency(), [])
+        self.assertEqual(self.leftovers(), [])
+
+        # После восстановления запись продолжается с нового поколения
+        UserManager(config_manager).add_user("carol")
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(config_manager.save_config(self.config_path))
+        self.assertEqual(self.names(self.load()[0]), ["alice", "bob", "carol"])
+
+
+class SqliteRecoveryTest(RecoveryTest):
+    backend = "sqlite"
+
+
+class ConfigStoreTest(TempDirTestCase):
+    def test_write_and_recover(self):
+        paths = [self.path("a.json"), self.path("b.json")]
+        store = ConfigStore(self.path("a.json"))
+        store.write({paths[0]: b"1", paths[1]: b"2"})
+        self.assertEqual([open(path, "rb").read() for path in paths], [b"1", b"2"])
+        self.assertIsNone(store.recover(paths))
+
+        # Журнал с уже примененным файлом: повтор пропускает его
+        with open(f"{paths[1]}.tmp", "wb") as f:
+            f.write(b"3")
+        FileJournal(store.journal.path).commit({paths[0]: f"{paths[0]}.tmp", paths[1]: f"{paths[1]}.tmp"})
+        self.assertEqual(store.recover(paths), "replayed")
+        self.assertEqual([open(path, "rb").read() for path in paths], [b"1", b"3"])
+        self.assertFalse(os.path.exists(store.journal.path))
+
+    def test_check_consistency(self):
+        config_manager = make_config(self.path("config.json"), ["alice", "bob"])
+        self.assertEqual(config_manager.check_consistency(), [])
+
+        clients = config_manager.get_clients()
+        removed = clients.pop()
+        config_manager.get_reality_settings()["shortIds"].append("ffff")
+        problems = check_consistency(config_manager.get_user_inbounds(), config_manager.user_metadata)
+        self.assertEqual(len(problems), 2)
+        self.assertTrue(any(removed["id"] in problem and "отсутствует в clients" in problem for problem in problems))
+        self.assertTrue(any("ffff" in problem for problem in problems))
+
+
+if __name__ == "__main__":
+    unittest.main()
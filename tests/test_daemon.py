@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Сервис управления: ответы при ошибках записи пачки и некорректном теле запроса"""
+
+import asyncio
+import contextlib
+import io
+import json
+import unittest
+from unittest import mock
+
+from config_manager import ConfigManager
+from daemon import HttpError, ManagementDaemon
+from support import TempDirTestCase, make_config
+from user_manager import UserManager
+
+
+class DaemonTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_path = self.path("config.json")
+        make_config(self.config_path, ["alice"])
+        self.config_manager = ConfigManager()
+        self.config_manager.load_config(self.config_path)
+        self.daemon = ManagementDaemon(self.config_manager, self.config_path, flush_interval=60)
+
+    def disk_users(self):
+        config_manager = ConfigManager()
+        config_manager.load_config(self.config_path)
+        return sorted(user_data["name"] for _, user_data in config_manager.iter_users())
+
+    async def request_and_flush(self, method, path, body=None):
+        """Запрос, ожидающий записи пачки, и запись пачки"""
+        request = asyncio.ensure_future(self.daemon.handle_request(method, path, {}, body or {}))
+        await asyncio.sleep(0)
+        with contextlib.suppress(Exception), contextlib.redirect_stdout(io.StringIO()):
+            await self.daemon.flush()
+        return await request
+
+    def test_failed_save_is_pending_and_retried(self):
+        save_config = self.config_manager.save_config
+        self.config_manager.save_config = lambda *args, **kwargs: False
+
+        status, result = asyncio.run(self.request_and_flush("POST", "/users", {"name": "bob"}))
+        self.assertEqual(status, 202)
+        self.assertEqual(result["status"], "added")
+        self.assertEqual(self.disk_users(), ["alice"])
+
+        # Следующая запись сохраняет отложенные изменения один раз
+        self.config_manager.save_config = save_config
+        asyncio.run(self.daemon.flush())
+        self.assertEqual(self.disk_users(), ["alice", "bob"])
+
+    def test_successful_save(self):
+        status, _ = asyncio.run(self.request_and_flush("POST", "/users", {"name": "bob"}))
+        self.assertEqual(status, 201)
+        status, _ = asyncio.run(self.request_and_flush("DELETE", "/users/bob"))
+        self.assertEqual(status, 200)
+        self.assertEqual(self.disk_users(), ["alice"])
+
+    def test_save_releases_allocated_ids(self):
+        allocator = self.daemon.user_manager.id_allocator
+        self.config_manager.save_config = lambda *args, **kwargs: False
+        asyncio.run(self.request_and_flush("POST", "/users", {"names": ["bob", "carol"]}))
+        # Пока пачка не записана, выданные ID остаются зарезервированными
+        self.assertEqual(len(allocator._reserved_ids), 2)
+        self.assertEqual(len(allocator._reserved_short_ids), 2)
+
+        del self.config_manager.save_config
+        asyncio.run(self.daemon.flush())
+        self.assertEqual(allocator._reserved_ids, set())
+        self.assertEqual(allocator._reserved_short_ids, set())
+        self.assertEqual(self.disk_users(), ["alice", "bob", "carol"])
+
+    def test_conflict_rolls_back_batch(self):
+        other = ConfigManager()
+        other.load_config(self.config_path, lock=True)
+        UserManager(other).add_user("carol")
+        with contextlib.redirect_stdout(io.StringIO()):
+            other.save_config(self.config_path)
+
+        with self.assertRaises(HttpError) as error:
+            asyncio.run(self.request_and_flush("POST", "/users", {"name": "bob"}))
+        self.assertEqual(error.exception.status, 409)
+        self.assertEqual(self.disk_users(), ["alice", "carol"])
+
+    def test_flush_conflict_is_409(self):
+        async def add_and_flush():
+            request = asyncio.ensure_future(self.daemon.handle_request("POST", "/users", {}, {"name": "bob"}))
+            await asyncio.sleep(0)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    return await self.daemon.handle_request("POST", "/flush", {}, {})
+            finally:
+                with contextlib.suppress(HttpError):
+                    await request
+
+        other = ConfigManager()
+        other.load_config(self.config_path, lock=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            other.save_config(self.config_path)
+
+        with self.assertRaises(HttpError) as error:
+            asyncio.run(add_and_flush())
+        self.assertEqual(error.exception.status, 409)
+
+    def test_conflict_closes_previous_metadata_store(self):
+        config_path = self.path("sqlite.json")
+        make_config(config_path, ["alice"], backend="sqlite")
+        config_manager = ConfigManager()
+        config_manager.load_config(config_path)
+        self.daemon = ManagementDaemon(config_manager, config_path, flush_interval=60)
+        old_store = config_manager.metadata_store
+        self.assertIsNotNone(old_store.connection)
+
+        other = ConfigManager()
+        other.load_config(config_path, lock=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            other.save_config(config_path)
+        other.metadata_store.close()
+
+        with self.assertRaises(HttpError):
+            asyncio.run(self.request_and_flush("POST", "/users", {"name": "bob"}))
+        self.assertIsNone(old_store._connection)
+        self.assertIsNot(config_manager.metadata_store, old_store)
+        config_manager.metadata_store.close()
+
+    def test_restart_uses_container_name(self):
+        self.config_manager.container_name = "xray-node"
+        with mock.patch("restart_scheduler.RestartScheduler") as scheduler:
+            self.daemon._restart_xray()
+        scheduler.assert_called_once_with(self.config_path, container_name="xray-node")
+        scheduler.return_value.request.assert_called_once_with()
+
+    def test_names_must_be_list(self):
+        for body in ({"names": "bob"}, {"names": ["bob", 1]}, {"name": ["bob"]}):
+            with self.subTest(body=body):
+                with self.assertRaises(HttpError) as error:
+                    asyncio.run(self.daemon.handle_request("POST", "/users", {}, body))
+                self.assertEqual(error.exception.status, 400)
+        self.assertFalse(self.daemon._dirty)
+        self.assertIsNone(self.config_manager.get_client_by_name("b"))
+
+        status, results = asyncio.run(self.request_and_flush("POST", "/users", {"names": ["bob", "carol"]}))
+        self.assertEqual(status, 201)
+        self.assertEqual([result["name"] for result in results], ["bob", "carol"])
+        self.assertEqual(self.disk_users(), ["alice", "bob", "carol"])
+
+    def test_non_object_body_is_400(self):
+        async def post(body):
+            server = await asyncio.start_server(self.daemon._handle_connection, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(f"POST /users HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+                await writer.drain()
+                response = await reader.read()
+                writer.close()
+            head, _, payload = response.partition(b"\r\n\r\n")
+            return int(head.split()[1]), json.loads(payload)
+
+        status, payload = asyncio.run(post(b"[]"))
+        self.assertEqual(status, 400)
+        self.assertIn("error", payload)
+
+
+if __name__ == "__main__":
+    unittest.main()
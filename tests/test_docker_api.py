@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Клиент Docker Engine API против заглушки сервера на Unix-сокете"""
+
+import http.client
+import json
+import socketserver
+import struct
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler
+
+from docker_api import API_VERSION, DockerApiClient
+from support import TempDirTestCase
+
+
+class StubDockerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def handle_one_request(self):
+        super().handle_one_request()
+        # Сервер закрывает keep-alive соединение после ответа, не предупреждая клиента
+        if self.server.close_after_response:
+            self.close_connection = True
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        self.server.requests.append((self.command, self.path, body))
+        if self.server.drop_requests:
+            self.server.drop_requests -= 1
+            self.close_connection = True
+            return
+
+        path = self.path.split("?")[0].replace(f"/{API_VERSION}", "", 1)
+        if path == "/containers/missing/json":
+            self._reply(404, {"message": "No such container: missing"})
+        elif path == "/containers/xray/json":
+            self._reply(200, {"State": {"Running": True}})
+        elif path == "/containers/xray/logs":
+            frames = struct.pack(">BxxxL", 1, 4) + b"out\n" + struct.pack(">BxxxL", 2, 4) + b"err\n"
+            self._reply(200, frames, "application/vnd.docker.raw-stream")
+        elif path == "/containers/create":
+            self._reply(201, {"Id": "abc"})
+        else:
+            self._reply(204, None)
+
+    do_GET = do_POST = do_DELETE = _handle
+
+    def _reply(self, status, payload, content_type="application/json"):
+        data = payload if isinstance(payload, bytes) else (json.dumps(payload).encode() if payload is not None else b"")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        super().__init__(path, StubDockerHandler)
+        self.requests = []
+        self.connections = 0
+        self.drop_requests = 0
+        self.close_after_response = False
+
+
+class DockerApiClientTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        socket_path = self.path("docker.sock")
+        self.server = StubDockerServer(socket_path)
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.client = DockerApiClient(socket_path, timeout=5)
+        self.addCleanup(self.client.close)
+
+    def methods(self):
+        return [method for method, _, _ in self.server.requests]
+
+    def test_inspect(self):
+        self.assertEqual(self.client.inspect_container("xray"), {"State": {"Running": True}})
+        self.assertIsNone(self.client.inspect_container("missing"))
+
+    def test_create_sends_body(self):
+        self.client.create_container("xray", "teddysun/xray", ["run"], port_bindings={"443/tcp": [{"HostPort": "443"}]})
+        method, path, body = self.server.requests[-1]
+        self.assertEqual((method, path), ("POST", f"/{API_VERSION}/containers/create?name=xray"))
+        self.assertEqual(body["HostConfig"]["PortBindings"], {"443/tcp": [{"HostPort": "443"}]})
+
+    def test_logs_are_demultiplexed(self):
+        self.assertEqual(list(self.client.logs("xray")), [("stdout", b"out\n"), ("stderr", b"err\n")])
+
+    def test_connection_is_reused(self):
+        for _ in range(3):
+            self.client.inspect_container("xray")
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_closed_keep_alive_connection_is_replaced_before_post(self):
+        self.server.close_after_response = True
+        self.client.inspect_container("xray")
+        time.sleep(0.1)
+        self.client.restart_container("xray")
+        self.assertEqual(self.methods(), ["GET", "POST"])
+
+    def test_get_is_retried(self):
+        self.server.drop_requests = 1
+        self.assertEqual(self.client.inspect_container("xray"), {"State": {"Running": True}})
+        self.assertEqual(self.methods(), ["GET", "GET"])
+
+    def test_post_is_not_retried(self):
+        self.server.drop_requests = 1
+        with self.assertRaises((OSError, http.client.HTTPException)):
+            self.client.restart_container("xray")
+        self.assertEqual(self.methods(), ["POST"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Флот узлов: локальные узлы в нескольких директориях, поддельные транспорты, порядок и ошибки"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+import unittest
+from unittest import mock
+
+import fleet
+from config_manager import ConfigManager
+from fleet import CommandTransport, FleetError, LocalTransport, load_inventory, run_on_nodes
+from main import run_fleet_command
+from support import TempDirTestCase, make_config
+
+
+class FakeTransport:
+    """Транспорт узла без конфигурации: задержка и ошибка задаются в описании узла"""
+
+    def __init__(self, node):
+        self.node = node
+
+    def add_user(self, name, restart=False):
+        time.sleep(self.node.get("delay", 0))
+        if self.node.get("error"):
+            raise FleetError(self.node["error"])
+        return {"name": name, "status": "added"}
+
+
+class FleetTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        # Узлы в отдельных директориях, как конфигурации разных серверов
+        nodes = []
+        for i, name in enumerate(("n1", "n2", "n3"), 1):
+            os.mkdir(self.path(name))
+            make_config(self.path(f"{name}/config.json"), ["alice"], backend="sqlite" if i == 2 else None,
+                        extra_port=8443 if i == 3 else None)
+            nodes.append({"name": name, "config": f"{name}/config.json", "container": f"xray-{name}"})
+        self.inventory = self.path("fleet.json")
+        with open(self.inventory, "w") as f:
+            json.dump({"nodes": nodes}, f)
+        self.nodes = load_inventory(self.inventory)
+
+        patcher = mock.patch("docker_manager.DockerManager")
+        self.docker_manager = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.docker_manager.return_value.get_container_state.return_value = {"Running": True}
+
+    def users(self, name):
+        config_manager = ConfigManager()
+        config_manager.load_config(self.path(f"{name}/config.json"))
+        return sorted(user_data["name"] for _, user_data in config_manager.iter_users())
+
+    def test_local_nodes(self):
+        results = list(run_on_nodes(self.nodes, lambda transport: transport.add_user("bob")))
+        self.assertEqual(sorted(result["node"] for result in results), ["n1", "n2", "n3"])
+        self.assertTrue(all(result["ok"] and result["result"]["status"] == "added" for result in results))
+        for name in ("n1", "n2", "n3"):
+            self.assertEqual(self.users(name), ["alice", "bob"])
+
+        # Повторное добавление ничего не меняет, удаление - на всех узлах
+        results = list(run_on_nodes(self.nodes, lambda transport: transport.add_user("bob")))
+        self.assertEqual({result["result"]["status"] for result in results}, {"exists"})
+        list(run_on_nodes(self.nodes, lambda transport: transport.remove_user("bob")))
+        for name in ("n1", "n2", "n3"):
+            self.assertEqual(self.users(name), ["alice"])
+
+    def test_status(self):
+        results = {result["node"]: result["result"] for result in run_on_nodes(self.nodes, lambda transport: transport.status())}
+        self.assertEqual(results["n2"]["users"], 1)
+        self.assertEqual(results["n2"]["shortIds"], 1)
+        self.assertEqual(results["n3"]["inbounds"], 2)
+        self.assertEqual(results["n3"]["container"], "running")
+        containers = sorted(call.kwargs["container_name"] for call in self.docker_manager.call_args_list)
+        self.assertEqual(containers, ["xray-n1", "xray-n2", "xray-n3"])
+
+    def test_container_name_is_passed_to_config_manager(self):
+        transport = LocalTransport(self.nodes[1])
+        self.assertEqual(transport._config_manager().container_name, "xray-n2")
+        with mock.patch("config_manager.schedule_restart") as schedule_restart:
+            transport.add_user("bob", restart=True)
+        schedule_restart.assert_called_once_with(self.nodes[1]["config"], "xray-n2")
+
+    def test_results_in_completion_order(self):
+        nodes = [
+            {"name": "slow", "transport": "fake", "delay": 0.3},
+            {"name": "failed", "transport": "fake", "error": "узел недоступен"},
+            {"name": "fast", "transport": "fake", "delay": 0.1},
+        ]
+        transports = {"fake": FakeTransport}
+        results = list(run_on_nodes(nodes, lambda transport: transport.add_user("bob"), parallel=3, transports=transports))
+        self.assertEqual([result["node"] for result in results], ["failed", "fast", "slow"])
+        self.assertEqual(results[0], {"node": "failed", "ok": False, "error": "узел недоступен"})
+        self.assertEqual(sum(not result["ok"] for result in results), 1)
+
+        # Без параллельности узлы обрабатываются в порядке инвентаря
+        results = list(run_on_nodes(nodes, lambda transport: transport.add_user("bob"), parallel=1, transports=transports))
+        self.assertEqual([result["node"] for result in results], ["slow", "failed", "fast"])
+
+    def test_command_timeout(self):
+        node = {"name": "remote", "transport": "command", "config": "/etc/xray/config.json", "command": ["sh", "-c", "sleep 5", "node"]}
+        started = time.monotonic()
+        with mock.patch.object(fleet, "COMMAND_TIMEOUT", 0.2):
+            results = list(run_on_nodes([node], lambda transport: transport.status()))
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertFalse(results[0]["ok"])
+        self.assertIn("timed out", results[0]["error"])
+
+    def test_command_failure(self):
+        node = {"name": "remote", "transport": "command", "config": "c.json", "command": ["sh", "-c", "echo сбой >&2; exit 3"]}
+        with self.assertRaises(FleetError) as error:
+            CommandTransport(node).status()
+        self.assertEqual(str(error.exception), "сбой")
+
+    def test_failure_count(self):
+        os.remove(self.path("n2/config.json"))
+        args = argparse.Namespace(inventory=self.inventory, nodes=None, parallel=2, json=False)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), self.assertRaises(SystemExit) as error:
+            run_fleet_command(args, lambda transport: transport.add_user("bob"))
+        self.assertEqual(error.exception.code, 1)
+        self.assertIn("n2: ошибка: конфигурация", output.getvalue())
+        self.assertIn("Узлов: 3, успешно: 2, с ошибками: 1", output.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Поэтапная ротация ключа: второй inbound со старым ключом, переход пользователей и завершение"""
+
+import contextlib
+import io
+import time
+import unittest
+from unittest import mock
+
+from config_manager import RETIRING_EMAIL_SUFFIX, RETIRING_TAG, ROTATION_KEY, ConfigManager
+from key_rotation import KeyRotation, RotationError
+from stats import StatsStore, get_stats_path
+from support import TempDirTestCase, make_config
+from user_manager import UserManager
+
+
+class KeyRotationTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_path = self.path("config.json")
+        make_config(self.config_path, ["alice", "bob", "carol"])
+        self.config_manager = self.load()
+
+    def load(self):
+        config_manager = ConfigManager()
+        config_manager.load_config(self.config_path)
+        return config_manager
+
+    def save(self, config_manager):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(config_manager.save_config(self.config_path))
+
+    def start(self, **kwargs):
+        config_manager = self.load()
+        state = KeyRotation(config_manager, self.config_path).start(**kwargs)
+        self.save(config_manager)
+        return state
+
+    def client_ids(self, inbound):
+        return sorted(client["id"] for client in inbound["settings"]["clients"])
+
+    def test_start(self):
+        old_inbound = self.config_manager.get_inbound()
+        old_key = old_inbound["streamSettings"]["realitySettings"]["privateKey"]
+        old_public_key = self.config_manager.get_server_info()["publicKey"]
+        old_short_ids = sorted(old_inbound["streamSettings"]["realitySettings"]["shortIds"])
+
+        state = self.start(rotate_short_ids=True)
+        config_manager = self.load()
+        main, retiring = config_manager.get_inbound(), config_manager.get_retiring_inbound()
+
+        # Старый ключ, порт и shortIds остаются во втором inbound
+        self.assertEqual(retiring["port"], 443)
+        self.assertEqual(retiring["streamSettings"]["realitySettings"]["privateKey"], old_key)
+        self.assertEqual(sorted(retiring["streamSettings"]["realitySettings"]["shortIds"]), old_short_ids)
+        self.assertTrue(all(client["email"].endswith(RETIRING_EMAIL_SUFFIX) for client in retiring["settings"]["clients"]))
+        self.assertEqual(self.client_ids(retiring), self.client_ids(main))
+
+        # Основной inbound - новый ключ, новый порт и новые shortId
+        self.assertEqual(main["port"], 444)
+        self.assertNotEqual(main["streamSettings"]["realitySettings"]["privateKey"], old_key)
+        self.assertNotEqual(config_manager.get_server_info()["publicKey"], old_public_key)
+        self.assertFalse(set(main["streamSettings"]["realitySettings"]["shortIds"]) & set(old_short_ids))
+        self.assertEqual(state["port"], 443)
+        self.assertEqual(state["publicKey"], old_public_key)
+        self.assertEqual(len(state["users"]), 3)
+
+        # Inbound со старым ключом не считается inbound пользователей, индексы указывают на основной
+        self.assertEqual(list(config_manager.get_user_inbounds()), [None])
+        _, alice = config_manager.get_client_by_name("alice")
+        self.assertIn(alice["shortId"], main["streamSettings"]["realitySettings"]["shortIds"])
+
+    def test_start_is_refused(self):
+        self.start()
+        with self.assertRaises(RotationError):
+            KeyRotation(self.load(), self.config_path).start()
+
+        # Несколько inbound пользователей и занятый порт
+        for name, extra_port, start_port in (("sharded.json", 8443, None), ("busy.json", None, 8443)):
+            path = self.path(name)
+            make_config(path, ["alice"], extra_port=extra_port)
+            config_manager = ConfigManager()
+            config_manager.load_config(path)
+            if start_port:
+                config_manager.config["inbounds"].append({"tag": "other", "protocol": "socks", "port": start_port})
+            with self.assertRaises(RotationError):
+                KeyRotation(config_manager, path).start(port=start_port)
+
+    def test_users_changed_during_rotation(self):
+        self.start()
+        config_manager = self.load()
+        user_manager = UserManager(config_manager)
+        dave_id = user_manager.add_user("dave")
+        bob_id, _ = config_manager.get_client_by_name("bob")
+        user_manager.remove_user("bob")
+        self.save(config_manager)
+
+        config_manager = self.load()
+        main, retiring = config_manager.get_inbound(), config_manager.get_retiring_inbound()
+        # Новый пользователь старого ключа не знает, удаленный удаляется и из inbound со старым ключом
+        self.assertIn(dave_id, self.client_ids(main))
+        self.assertNotIn(dave_id, self.client_ids(retiring))
+        self.assertNotIn(bob_id, self.client_ids(main))
+        self.assertNotIn(bob_id, self.client_ids(retiring))
+        self.assertEqual(len(retiring["settings"]["clients"]), 2)
+        self.assertNotIn(dave_id, config_manager.user_metadata[ROTATION_KEY]["users"])
+
+    def test_hot_remove_during_rotation(self):
+        self.start()
+        config_manager = self.load()
+        config_manager.ensure_client_emails()
+        user_manager = UserManager(config_manager)
+        user_manager.remove_user("bob")
+        api_client = mock.Mock()
+        self.assertTrue(user_manager.apply_hot_changes(api_client))
+        removed = [call.args for call in api_client.remove_user.call_args_list]
+        self.assertEqual(len(removed), 2)
+        self.assertIn(RETIRING_TAG, [tag for tag, _ in removed])
+        self.assertTrue(any(email.endswith(RETIRING_EMAIL_SUFFIX) for _, email in removed))
+
+    def test_remove_retiring_clients(self):
+        self.start()
+        config_manager = self.load()
+        retiring_ids = self.client_ids(config_manager.get_retiring_inbound())
+        self.assertEqual(config_manager.remove_retiring_clients(set(retiring_ids[:2]) | {"unknown"}), 2)
+        self.assertEqual(self.client_ids(config_manager.get_retiring_inbound()), retiring_ids[2:])
+        self.assertEqual(config_manager.remove_retiring_clients(set()), 0)
+
+    def test_check(self):
+        self.start(grace=3600)
+        config_manager = self.load()
+        rotation = KeyRotation(config_manager, self.config_path)
+        started = rotation.state["startedAt"]
+
+        # Трафик alice до начала ротации не считается, bob - после начала
+        store = StatsStore(get_stats_path(self.config_path))
+        store.add({"alice": [1, 1]}, started - 10)
+        store.add({"bob": [1, 1]}, started + 10)
+        store.close()
+
+        result = rotation.check()
+        self.assertEqual(result["moved"], 1)
+        self.assertEqual(result["pending"], ["alice", "carol"])
+        self.assertEqual(result["sources"], ["stats"])
+        self.assertFalse(result["expired"])
+        bob_id, _ = config_manager.get_client_by_name("bob")
+        self.assertIn(bob_id, rotation.state["moved"])
+
+        rotation.state["grace"] = 0
+        self.assertTrue(rotation.check()["expired"])
+
+        with self.assertRaises(RotationError):
+            KeyRotation(self.config_manager, self.config_path).check()
+
+    def test_retire_and_alternate_port(self):
+        self.start()
+        config_manager = self.load()
+        summary = KeyRotation(config_manager, self.config_path).retire()
+        self.save(config_manager)
+        self.assertEqual(summary["sparePort"], 443)
+        self.assertEqual(summary["users"], 3)
+
+        config_manager = self.load()
+        self.assertIsNone(config_manager.get_retiring_inbound())
+        self.assertEqual(len(config_manager.config["inbounds"]), 1)
+        self.assertEqual(config_manager.get_inbound()["port"], 444)
+        with self.assertRaises(RotationError):
+            KeyRotation(config_manager, self.config_path).retire()
+
+        # Следующая ротация возвращает основной inbound на освободившийся порт
+        state = self.start()
+        self.assertEqual(state["port"], 444)
+        config_manager = self.load()
+        self.assertEqual(config_manager.get_inbound()["port"], 443)
+        self.assertEqual(config_manager.get_retiring_inbound()["port"], 444)
+        self.assertLessEqual(state["startedAt"], time.time())
+
+
+if __name__ == "__main__":
+    unittest.main()
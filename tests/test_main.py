@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Сохранение изменений в командах CLI: при ошибке записи изменения не применяются к Xray"""
+
+import argparse
+import contextlib
+import io
+import unittest
+from unittest import mock
+
+from config_manager import ConfigManager
+from key_rotation import KeyRotation
+from main import retire_rotation, save_user_changes
+from support import TempDirTestCase, make_config
+from user_manager import UserManager
+
+
+class FailedSaveTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_path = self.path("config.json")
+        make_config(self.config_path, ["alice"])
+        self.config_manager = ConfigManager()
+        self.config_manager.load_config(self.config_path)
+        self.config_manager.save_config = lambda *args, **kwargs: False
+        self.args = argparse.Namespace(config=self.config_path, hot=True, restart=True, api=None)
+
+    def test_user_changes_are_not_applied(self):
+        user_manager = UserManager(self.config_manager)
+        user_manager.add_user("bob")
+        with mock.patch.object(user_manager, "apply_hot_changes") as apply_hot_changes, \
+                mock.patch("restart_scheduler.schedule_restart") as schedule_restart, \
+                contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit) as error:
+            save_user_changes(self.config_manager, user_manager, self.args)
+        self.assertEqual(error.exception.code, 1)
+        apply_hot_changes.assert_not_called()
+        schedule_restart.assert_not_called()
+
+    def test_rotation_is_not_reported_retired(self):
+        rotation = KeyRotation(self.config_manager, self.config_path)
+        rotation.start()
+        stderr = io.StringIO()
+        with mock.patch("xray_api.XrayApiClient") as api_client, mock.patch("restart_scheduler.schedule_restart") as schedule_restart, \
+                contextlib.redirect_stderr(stderr), self.assertRaises(SystemExit):
+            retire_rotation(self.config_manager, rotation, self.args)
+        api_client.assert_not_called()
+        schedule_restart.assert_not_called()
+        self.assertNotIn("Ротация завершена", stderr.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Хранилище метаданных SQLite: перенос, ленивая загрузка и запись только измененных пользователей"""
+
+import contextlib
+import io
+import json
+import os
+import unittest
+
+from config_manager import ConfigManager
+from metadata_store import SqliteMetadataStore, get_metadata_path, open_metadata_store
+from support import TempDirTestCase, make_config
+from user_manager import UserManager
+
+NAMES = [f"user-{i:02d}" for i in range(40, 0, -1)]
+
+
+class SqliteStoreTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_path = self.path("config.json")
+
+    def load(self, readonly=False):
+        config_manager = ConfigManager()
+        with contextlib.redirect_stdout(io.StringIO()):
+            config_manager.load_config(self.config_path, readonly=readonly)
+        self.addCleanup(lambda: config_manager.metadata_store and config_manager.metadata_store.close())
+        return config_manager
+
+    def save(self, config_manager):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(config_manager.save_config(self.config_path))
+        config_manager.metadata_store.close()
+
+    def stored_names(self):
+        store = SqliteMetadataStore(get_metadata_path(self.config_path, "sqlite"))
+        try:
+            return [user_data["name"] for _, user_data in store.iter_users()]
+        finally:
+            store.close()
+
+    def test_bulk_add_keeps_insertion_order(self):
+        make_config(self.config_path, ["alice"], backend="sqlite")
+        config_manager = self.load()
+        UserManager(config_manager).add_users(NAMES)
+        self.save(config_manager)
+        self.assertEqual(self.stored_names(), ["alice"] + NAMES)
+
+        # Порядок совпадает с JSON-хранилищем и полной загрузкой
+        names = [user_data["name"] for _, user_data in self.load().iter_users()]
+        self.assertEqual(names, ["alice"] + NAMES)
+
+    def test_incremental_write(self):
+        make_config(self.config_path, ["alice", "bob", "carol"], backend="sqlite")
+        store = SqliteMetadataStore(get_metadata_path(self.config_path, "sqlite"))
+        with store.connection:
+            # Пометка в строке неизмененного пользователя переживает только запись измененных
+            store.connection.execute(
+                "UPDATE users SET data = json_set(data, '$.marker', 1) WHERE name = 'carol'"
+            )
+        store.close()
+
+        config_manager = self.load()
+        user_manager = UserManager(config_manager)
+        user_manager.remove_users(["bob"])
+        user_manager.add_users(["dave"])
+        alice_id, alice = config_manager.get_client_by_name("alice")
+        config_manager.registry.set_user(alice_id, dict(alice, note="updated"))
+        self.assertEqual(list(config_manager.registry.changed_ids), [config_manager.get_client_by_name("dave")[0], alice_id])
+        self.save(config_manager)
+
+        # Обновленный пользователь остается на своем месте, удаленный удален
+        self.assertEqual(self.stored_names(), ["alice", "carol", "dave"])
+        users = dict(self.load().iter_users())
+        self.assertEqual(users[alice_id]["note"], "updated")
+        self.assertEqual(users[self.load().get_client_by_name("carol")[0]]["marker"], 1)
+
+    def test_lazy_readonly_load(self):
+        make_config(self.config_path, ["alice", "bob"], backend="sqlite")
+        with open(self.config_path) as f:
+            config = json.load(f)
+        # Ленивая загрузка не читает config.json
+        os.replace(self.config_path, self.path("moved.json"))
+
+        config_manager = self.load(readonly=True)
+        self.assertEqual(config_manager.generation, 1)
+        self.assertEqual([user_data["name"] for _, user_data in config_manager.iter_users()], ["alice", "bob"])
+        user_id, user_data = config_manager.get_client_by_name("bob")
+        self.assertIn(user_id, [client["id"] for client in config["inbounds"][0]["settings"]["clients"]])
+        self.assertIsNone(config_manager.get_client_by_name("carol"))
+        self.assertEqual(list(config_manager.user_metadata["users"]), [user_id])
+
+    def test_migration_round_trip(self):
+        make_config(self.config_path, ["alice", "bob"] + NAMES)
+        json_path = get_metadata_path(self.config_path, "json")
+        with open(json_path) as f:
+            metadata = json.load(f)
+
+        config_manager = self.load()
+        self.assertTrue(config_manager.migrate_metadata(self.config_path, "sqlite"))
+        self.assertTrue(os.path.exists(f"{json_path}.bak"))
+        self.assertIsInstance(open_metadata_store(self.config_path), SqliteMetadataStore)
+
+        migrated = self.load()
+        self.assertIsInstance(migrated.metadata_store, SqliteMetadataStore)
+        self.assertEqual(migrated.user_metadata, metadata)
+        self.assertEqual(list(migrated.user_metadata["users"]), list(metadata["users"]))
+        self.assertEqual(migrated.check_consistency(), [])
+
+        # Обратный перенос возвращает те же метаданные в JSON
+        self.assertTrue(migrated.migrate_metadata(self.config_path, "json"))
+        with open(json_path) as f:
+            self.assertEqual(json.load(f), metadata)
+        # Повторный перенос в текущее хранилище ничего не делает
+        self.assertFalse(self.load().migrate_metadata(self.config_path, "json"))
+
+
+if __name__ == "__main__":
+    unittest.main()
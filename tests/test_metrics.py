@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Метрики: гистограммы операций и состояние заданного контейнера"""
+
+import unittest
+from unittest import mock
+
+from metrics import LATENCY_BUCKETS, MetricsExporter, MetricsWriter, OperationMetrics
+from support import TempDirTestCase
+
+
+class OperationMetricsTest(TempDirTestCase):
+    def test_flush_merges_with_file(self):
+        path = self.path("config.json.metrics.json")
+        for seconds in (0.001, 0.2):
+            metrics = OperationMetrics(path)
+            metrics.observe("cli:add-user", seconds)
+            metrics.flush()
+
+        entry = OperationMetrics(path).load()["cli:add-user"]
+        self.assertEqual(entry["count"], 2)
+        self.assertAlmostEqual(entry["sum"], 0.201)
+        self.assertEqual(entry["buckets"][0], 1)
+        self.assertEqual(entry["buckets"][LATENCY_BUCKETS.index(0.25)], 2)
+
+
+class ContainerMetricsTest(TempDirTestCase):
+    def test_configured_container_is_checked(self):
+        exporter = MetricsExporter(self.path("config.json"), container_name="xray-node2")
+        with mock.patch("docker_manager.DockerManager") as docker_manager:
+            docker_manager.return_value.get_container_state.return_value = {"Running": True, "RestartCount": 3}
+            writer = MetricsWriter()
+            exporter._collect_container(writer)
+
+        docker_manager.assert_called_once_with(container_name="xray-node2")
+        self.assertIn("xray_container_up 1", writer.lines)
+        self.assertIn("xray_container_restart_count 3", writer.lines)
+
+
+if __name__ == "__main__":
+    unittest.main()
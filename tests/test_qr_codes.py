@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Кодирование base45 (RFC 9285) и содержимое QR-кода в режиме deflate"""
+
+import os
+import unittest
+
+from qr_codes import DEFLATE_PREFIX, base45_decode, base45_encode, encode_config, inflate_payload
+
+# Примеры из RFC 9285, разделы 4.3 и 4.4
+RFC_VECTORS = [
+    (b"AB", "BB8"),
+    (b"Hello!!", "%69 VD92EX0"),
+    (b"base-45", "UJCLQE7W581"),
+    (b"ietf!", "QED8WEX0"),
+]
+
+
+class Base45Test(unittest.TestCase):
+    def test_rfc_vectors(self):
+        for data, text in RFC_VECTORS:
+            with self.subTest(data=data):
+                self.assertEqual(base45_encode(data), text)
+                self.assertEqual(base45_decode(text), data)
+
+    def test_round_trip(self):
+        samples = [b"", b"\x00", b"\xff", b"\xff\xff", b"\x00\x00\x00", bytes(range(256)), os.urandom(1001)]
+        for data in samples:
+            with self.subTest(length=len(data)):
+                self.assertEqual(base45_decode(base45_encode(data)), data)
+
+    def test_invalid_input(self):
+        # Недопустимый символ, длина 3k+1 и группы больше 0xFFFF / 0xFF
+        for text in ("bb8", "BB8A", "GGW", "GGWGG"):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    base45_decode(text)
+
+
+class DeflatePayloadTest(unittest.TestCase):
+    client_config = {
+        "outbounds": [{"protocol": "vless", "settings": {"vnext": [{"address": "example.com", "port": 443}]}}],
+        "remarks": "пользователь",
+    }
+
+    def test_round_trip(self):
+        payload = encode_config(self.client_config, "deflate")
+        self.assertTrue(payload.startswith(DEFLATE_PREFIX))
+        self.assertEqual(inflate_payload(payload), self.client_config)
+
+    def test_rejects_other_modes(self):
+        with self.assertRaises(ValueError):
+            inflate_payload(encode_config(self.client_config, "compact"))
+
+
+if __name__ == "__main__":
+    unittest.main()
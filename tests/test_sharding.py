@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Несколько inbound пользователей: политики распределения, добавление и удаление inbound, индексы по тегам"""
+
+import contextlib
+import hashlib
+import io
+import unittest
+
+from config_manager import INBOUND_TAG, INBOUNDS_KEY, SHARDING_KEY, ConfigManager
+from support import TempDirTestCase, make_config
+from user_manager import UserManager
+
+
+def hash_index(name, count):
+    digest = hashlib.sha256(name.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+class InboundsTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config_path = self.path("config.json")
+        self.config_manager = make_config(self.config_path)
+        self.config_manager.add_inbound(8443, server_names=["cdn.example.com"])
+        self.config_manager.add_inbound(9443, tag="edge")
+        self.user_manager = UserManager(self.config_manager)
+
+    def reload(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(self.config_manager.save_config(self.config_path))
+        self.config_manager = ConfigManager()
+        self.config_manager.load_config(self.config_path)
+        return self.config_manager
+
+    def inbound_of(self, name):
+        return self.config_manager.get_client_by_name(name)[1].get("inbound")
+
+    def clients(self, tag):
+        return sorted(client["id"] for client in self.config_manager.get_clients(tag))
+
+    def test_add_inbound(self):
+        self.assertEqual(list(self.config_manager.get_user_inbounds()), [None, f"{INBOUND_TAG}-2", "edge"])
+        self.assertEqual(self.config_manager.get_inbound("edge")["port"], 9443)
+        self.assertEqual(self.config_manager.get_reality_settings(f"{INBOUND_TAG}-2")["serverNames"], ["cdn.example.com"])
+        self.assertEqual(self.config_manager.get_reality_settings("edge")["serverNames"], ["example.com"])
+        self.assertEqual(self.config_manager.get_server_info("edge")["port"], 9443)
+        # Ключ общий: обновление ключа меняет его во всех inbound
+        self.config_manager.update_keys("private", "public")
+        for tag in self.config_manager.get_user_inbounds():
+            self.assertEqual(self.config_manager.get_reality_settings(tag)["privateKey"], "private")
+
+        for port, tag in ((443, None), (8443, None), (10443, "edge"), (10443, INBOUND_TAG)):
+            with self.assertRaises(ValueError):
+                self.config_manager.add_inbound(port, tag=tag)
+
+    def test_hash_policy(self):
+        names = [f"user{i}" for i in range(30)]
+        tags = list(self.config_manager.get_user_inbounds())
+        self.user_manager.add_users(names)
+        for name in names:
+            self.assertEqual(self.inbound_of(name), tags[hash_index(name, len(tags))])
+        self.assertEqual(sum(len(self.clients(tag)) for tag in tags), 30)
+
+    def test_least_loaded_policy(self):
+        self.config_manager.user_metadata[SHARDING_KEY] = {"policy": "least-loaded"}
+        self.user_manager.add_users([f"user{i}" for i in range(9)])
+        self.assertEqual([len(self.clients(tag)) for tag in self.config_manager.get_user_inbounds()], [3, 3, 3])
+
+    def test_explicit_policy(self):
+        self.config_manager.user_metadata[SHARDING_KEY] = {"policy": "explicit"}
+        self.user_manager.add_users(["alice", "bob"])
+        self.user_manager.add_users(["carol"], "edge")
+        self.user_manager.add_users(["dave"], INBOUND_TAG)
+        self.assertEqual([self.inbound_of(name) for name in ("alice", "bob", "carol", "dave")], [None, None, "edge", None])
+        results = self.user_manager.add_users(["eve"], "missing")
+        self.assertEqual(results[0]["status"], "error")
+        self.assertIsNone(self.config_manager.get_client_by_name("eve"))
+
+    def test_user_links_use_inbound(self):
+        self.user_manager.add_users(["carol"], "edge")
+        link = self.user_manager.generate_vless_link("carol", "203.0.113.1")
+        self.assertIn("@203.0.113.1:9443?", link)
+        _, carol = self.config_manager.get_client_by_name("carol")
+        self.assertIn(carol["shortId"], self.config_manager.get_reality_settings("edge")["shortIds"])
+
+    def test_remove_inbound(self):
+        self.user_manager.add_users(["carol"], "edge")
+        with self.assertRaises(ValueError):
+            self.config_manager.remove_inbound("edge")
+        with self.assertRaises(ValueError):
+            self.config_manager.remove_inbound(None)
+        with self.assertRaises(ValueError):
+            self.config_manager.remove_inbound("missing")
+
+        self.user_manager.remove_user("carol")
+        self.config_manager.remove_inbound("edge")
+        self.assertNotIn("edge", self.config_manager.get_user_inbounds())
+        self.assertNotIn("edge", self.config_manager.user_metadata.get(INBOUNDS_KEY, {}))
+
+    def test_swap_remove_on_secondary_inbound(self):
+        names = [f"user{i}" for i in range(6)]
+        for name in names:
+            self.user_manager.add_users([name], "edge")
+        self.user_manager.add_users(["main"], INBOUND_TAG)
+        ids = {name: self.config_manager.get_client_by_name(name)[0] for name in names}
+        short_ids = {name: self.config_manager.get_client_by_name(name)[1]["shortId"] for name in names}
+
+        self.user_manager.remove_users(["user0", "user3"])
+        remaining = ["user1", "user2", "user4", "user5"]
+        self.assertEqual(self.clients("edge"), sorted(ids[name] for name in remaining))
+        self.assertEqual(sorted(self.config_manager.get_reality_settings("edge")["shortIds"]),
+                         sorted(short_ids[name] for name in remaining))
+        self.assertEqual(len(self.clients(None)), 1)
+        self.assertEqual(self.clients(f"{INBOUND_TAG}-2"), [])
+
+        # Удаление переставленного последним элементом клиента идет в тот же список
+        self.user_manager.remove_users(["user5"])
+        self.assertEqual(len(self.clients("edge")), 3)
+        self.assertEqual(len(self.clients(None)), 1)
+
+    def test_tags_survive_reload(self):
+        self.user_manager.add_users(["alice", "bob"], "edge")
+        self.user_manager.add_users(["carol"], f"{INBOUND_TAG}-2")
+        self.user_manager.add_users(["dave"], INBOUND_TAG)
+        registry = self.reload().registry
+        self.assertEqual(set(registry._client_inbound.values()), {"edge", f"{INBOUND_TAG}-2"})
+        self.assertEqual(len(registry._client_inbound), 3)
+        self.assertEqual(len(registry._short_id_inbound), 3)
+
+        # После перезагрузки удаление идет из списка нужного inbound
+        UserManager(self.config_manager).remove_users(["alice", "carol"])
+        self.assertEqual(len(self.clients("edge")), 1)
+        self.assertEqual(self.clients(f"{INBOUND_TAG}-2"), [])
+        self.assertEqual(len(self.clients(None)), 1)
+        self.assertEqual(len(self.config_manager.get_reality_settings("edge")["shortIds"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Сбор статистики: счетчики StatsService с обнулением и временные ряды в SQLite"""
+
+import unittest
+from concurrent import futures
+
+from stats import StatsCollector, StatsStore, parse_user_stats
+from support import TempDirTestCase
+from xray_api import STATS_SERVICE, XrayApiClient, XrayApiError, _field_bytes, _field_varint, decode_fields
+
+try:
+    import grpc
+except ImportError:
+    grpc = None
+
+BUCKET = 300
+
+
+class StubStatsService:
+    """Счетчики Xray: QueryStats отдает счетчики с подстрокой pattern и при reset обнуляет их"""
+
+    def __init__(self):
+        self.counters = {}
+
+    def traffic(self, email, uplink=0, downlink=0):
+        for direction, value in (("uplink", uplink), ("downlink", downlink)):
+            name = f"user>>>{email}>>>traffic>>>{direction}"
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def query_stats(self, pattern="", reset=False):
+        result = {name: value for name, value in self.counters.items() if pattern in name}
+        if reset:
+            for name in result:
+                self.counters[name] = 0
+        return result
+
+    def handle(self, request, context):
+        """Обработчик gRPC: разбор QueryStatsRequest и кодирование QueryStatsResponse"""
+        fields = dict(decode_fields(request))
+        stats = self.query_stats(fields.get(1, b"").decode(), bool(fields.get(2)))
+        return b"".join(_field_bytes(1, _field_bytes(1, name) + _field_varint(2, value)) for name, value in stats.items())
+
+
+class StatsCollectorTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = StubStatsService()
+        self.store = StatsStore(self.path("config_stats.db"), bucket=BUCKET)
+        self.addCleanup(self.store.close)
+
+    def test_parse_user_stats(self):
+        stats = {
+            "user>>>alice>>>traffic>>>uplink": 1, "user>>>alice>>>traffic>>>downlink": 2,
+            "inbound>>>vless-in>>>traffic>>>uplink": 5,
+        }
+        self.assertEqual(parse_user_stats(stats), {"alice": [1, 2]})
+
+    def test_deltas_accumulate(self):
+        collector = StatsCollector(self.service, self.store)
+        self.service.traffic("alice", 100, 1000)
+        self.service.traffic("bob", 0, 0)
+        self.assertEqual(collector.poll(), {"alice": [100, 1000]})
+
+        # Счетчики обнулены: второй опрос получает только новый трафик
+        self.service.traffic("alice", 1, 10)
+        self.service.traffic("bob", 5, 0)
+        self.assertEqual(collector.poll(), {"alice": [1, 10], "bob": [5, 0]})
+        self.assertEqual(collector.poll(), {})
+
+        totals = self.store.totals()
+        self.assertEqual(totals["alice"][:2], (101, 1010))
+        self.assertEqual(totals["bob"][:2], (5, 0))
+        self.assertEqual(self.store.top(limit=1), [("alice", 101, 1010)])
+
+    def test_buckets_and_prune(self):
+        start = 1_000_000 * BUCKET
+        self.store.add({"alice": [1, 1]}, start)
+        self.store.add({"alice": [2, 2]}, start + 10)
+        self.store.add({"alice": [4, 4], "bob": [1, 0]}, start + BUCKET)
+        rows = self.store.connection.execute("SELECT bucket, uplink FROM samples ORDER BY bucket, uplink").fetchall()
+        self.assertEqual(rows, [(1_000_000, 3), (1_000_001, 1), (1_000_001, 4)])
+
+        self.assertEqual(self.store.top(since=start + BUCKET), [("alice", 4, 4), ("bob", 1, 0)])
+        self.store.prune(start + BUCKET)
+        self.assertEqual(self.store.top(since=start), [("alice", 4, 4), ("bob", 1, 0)])
+        # Накопленные суммы переживают удаление интервалов
+        self.assertEqual(self.store.totals()["alice"][:2], (7, 7))
+
+
+@unittest.skipIf(grpc is None, "нужна библиотека grpcio")
+class StatsCollectorApiTest(TempDirTestCase):
+    """Сборщик с настоящим клиентом API против gRPC-заглушки StatsService"""
+
+    def test_poll_over_grpc(self):
+        service = StubStatsService()
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=1), handlers=[
+            grpc.method_handlers_generic_handler(STATS_SERVICE, {
+                "QueryStats": grpc.unary_unary_rpc_method_handler(service.handle),
+            }),
+        ])
+        port = server.add_insecure_port("127.0.0.1:0")
+        server.start()
+        api_client = XrayApiClient(f"127.0.0.1:{port}")
+        store = StatsStore(self.path("config_stats.db"))
+        self.addCleanup(store.close)
+        self.addCleanup(api_client.close)
+
+        collector = StatsCollector(api_client, store)
+        service.traffic("alice", 3 * 2 ** 32, 7)
+        self.assertEqual(collector.poll(), {"alice": [3 * 2 ** 32, 7]})
+        self.assertEqual(service.counters["user>>>alice>>>traffic>>>uplink"], 0)
+
+        server.stop(None).wait()
+        with self.assertRaises(XrayApiError):
+            collector.poll()
+        self.assertEqual(store.totals()["alice"][:2], (3 * 2 ** 32, 7))
+
+
+if __name__ == "__main__":
+    unittest.main()
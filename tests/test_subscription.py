@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Подписки с узлами флота на разных хранилищах метаданных"""
+
+import base64
+import json
+import unittest
+
+from config_manager import ConfigManager
+from subscription import SubscriptionService, load_fleet_sources
+from support import TempDirTestCase, make_config
+
+
+class FleetSubscriptionTest(TempDirTestCase):
+    def test_every_node_contributes_link(self):
+        make_config(self.path("n1.json"), ["alice"])
+        make_config(self.path("n2.json"), ["alice"], backend="sqlite", extra_port=8443)
+        make_config(self.path("n3.json"), ["alice"], backend="sqlite")
+        nodes = [{"name": name, "config": self.path(f"{name}.json"), "server": f"10.0.0.{i}"}
+                 for i, name in enumerate(("n1", "n2", "n3"), 1)]
+        with open(self.path("fleet.json"), "w") as f:
+            json.dump({"nodes": nodes}, f)
+
+        config_manager = ConfigManager()
+        config_manager.load_config(self.path("n1.json"))
+        service = SubscriptionService(config_manager, load_fleet_sources(self.path("fleet.json"), self.path("n1.json")))
+        user_id = config_manager.get_client_by_name("alice")[0]
+        _, body = service.get(service.token_for(user_id), "10.0.0.1")
+
+        links = base64.b64decode(body).decode().splitlines()
+        self.assertEqual(len(links), 3)
+        for i in (1, 2, 3):
+            self.assertTrue(any(f"@10.0.0.{i}:" in link for link in links), f"нет ссылки узла {i}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Индексы UserRegistry: удаление перестановкой, несколько inbound и повторяющиеся имена"""
+
+import contextlib
+import io
+import unittest
+
+from config_manager import ConfigManager
+
+
+def make_manager(users=None):
+    config_manager = ConfigManager()
+    with contextlib.redirect_stdout(io.StringIO()):
+        config_manager.create_config("example.com:443", ["example.com"])
+    if users:
+        config_manager.user_metadata["users"] = users
+        config_manager.registry.rebuild()
+    return config_manager
+
+
+class DuplicateNamesTest(unittest.TestCase):
+    def setUp(self):
+        self.config_manager = make_manager({
+            "id-1": {"name": "alice", "shortId": "01"},
+            "id-2": {"name": "bob", "shortId": "02"},
+            "id-3": {"name": "alice", "shortId": "03"},
+            "id-4": {"name": "alice", "shortId": "04"},
+        })
+        self.registry = self.config_manager.registry
+
+    def test_first_user_wins(self):
+        self.assertEqual(self.registry.get_by_name("alice")[0], "id-1")
+
+    def test_name_moves_to_next_user(self):
+        self.registry.remove_user("id-1")
+        self.assertEqual(self.registry.get_by_name("alice")[0], "id-3")
+        self.registry.remove_user("id-3")
+        self.assertEqual(self.registry.get_by_name("alice")[0], "id-4")
+        self.registry.remove_user("id-4")
+        self.assertIsNone(self.registry.get_by_name("alice"))
+        self.assertEqual(self.registry.get_by_name("bob")[0], "id-2")
+
+    def test_removing_other_duplicate_keeps_name(self):
+        self.registry.remove_user("id-3")
+        self.assertEqual(self.registry.get_by_name("alice")[0], "id-1")
+
+    def test_update_keeps_name(self):
+        self.registry.set_user("id-1", {"name": "alice", "shortId": "05"})
+        self.assertEqual(self.registry.get_by_name("alice")[0], "id-1")
+        self.assertEqual(self.registry.get_id_by_short_id("05"), "id-1")
+        self.assertIsNone(self.registry.get_id_by_short_id("01"))
+
+    def test_rename_moves_name(self):
+        self.registry.set_user("id-1", {"name": "carol", "shortId": "01"})
+        self.assertEqual(self.registry.get_by_name("alice")[0], "id-3")
+        self.assertEqual(self.registry.get_by_name("carol")[0], "id-1")
+
+    def test_duplicate_added_later(self):
+        self.registry.set_user("id-5", {"name": "bob", "shortId": "05"})
+        self.registry.remove_user("id-2")
+        self.assertEqual(self.registry.get_by_name("bob")[0], "id-5")
+
+
+class SwapRemoveTest(unittest.TestCase):
+    def test_indexes_follow_swapped_elements(self):
+        config_manager = make_manager()
+        config_manager.add_inbound(8443)
+        registry = config_manager.registry
+        tags = (None, "vless-in-2")
+        for i in range(6):
+            tag = tags[i % 2]
+            registry.add_client({"id": f"id-{i}"}, tag)
+            registry.add_short_id(f"0{i}", tag)
+
+        registry.remove_client("id-0")
+        registry.remove_short_id("01")
+        registry.remove_client("id-3")
+
+        self.assertEqual(sorted(c["id"] for c in config_manager.get_clients()), ["id-2", "id-4"])
+        self.assertEqual(sorted(c["id"] for c in config_manager.get_clients("vless-in-2")), ["id-1", "id-5"])
+        self.assertEqual(sorted(config_manager.get_reality_settings("vless-in-2")["shortIds"]), ["03", "05"])
+        # После перестановок индексы совпадают с пересобранными
+        indexes = (dict(registry._client_index), dict(registry._short_id_index), dict(registry._client_inbound))
+        registry.rebuild()
+        self.assertEqual(indexes, (registry._client_index, registry._short_id_index, registry._client_inbound))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Ручное кодирование protobuf HandlerService/StatsService и клиент API против заглушки gRPC-сервера"""
+
+import unittest
+from concurrent import futures
+
+from xray_api import (HANDLER_SERVICE, STATS_SERVICE, XrayApiClient, XrayApiError, _field_bytes, _field_varint,
+                      _varint, alter_inbound_request, decode_fields, parse_query_stats_response,
+                      query_stats_request, typed_message, vless_user)
+
+try:
+    import grpc
+except ImportError:
+    grpc = None
+
+
+def stat(name, value):
+    """Сообщение Stat в QueryStatsResponse"""
+    return _field_bytes(1, _field_bytes(1, name) + _field_varint(2, value))
+
+
+class ProtobufEncodingTest(unittest.TestCase):
+    def test_varint(self):
+        cases = {0: b"\x00", 1: b"\x01", 127: b"\x7f", 128: b"\x80\x01", 300: b"\xac\x02",
+                 2 ** 32: b"\x80\x80\x80\x80\x10"}
+        for value, encoded in cases.items():
+            self.assertEqual(_varint(value), encoded)
+            self.assertEqual(list(decode_fields(b"\x08" + encoded)), [(1, value)])
+
+    def test_default_values_are_omitted(self):
+        self.assertEqual(_field_varint(2, 0), b"")
+        self.assertEqual(_field_bytes(1, ""), b"")
+
+    def test_query_stats_request(self):
+        self.assertEqual(query_stats_request("user>>>", reset=True), b"\x0a\x07user>>>\x10\x01")
+        self.assertEqual(query_stats_request(""), b"")
+
+    def test_alter_inbound_request(self):
+        request = alter_inbound_request("vless-in", "x.Op", _field_bytes(1, "e"))
+        self.assertEqual(request, b"\x0a\x08vless-in" + b"\x12\x0b" + b"\x0a\x04x.Op" + b"\x12\x03\x0a\x01e")
+
+    def test_vless_user(self):
+        user = dict(decode_fields(vless_user("alice", "uuid-1", "xtls-rprx-vision", level=1)))
+        self.assertEqual(user[1], 1)
+        self.assertEqual(user[2], b"alice")
+        account_message = dict(decode_fields(user[3]))
+        self.assertEqual(account_message[1], b"xray.proxy.vless.Account")
+        account = dict(decode_fields(account_message[2]))
+        self.assertEqual(account, {1: b"uuid-1", 2: b"xtls-rprx-vision", 3: b"none"})
+
+    def test_typed_message_with_non_ascii_text(self):
+        fields = list(decode_fields(typed_message("t", "пользователь")))
+        self.assertEqual(fields, [(1, b"t"), (2, "пользователь".encode("utf-8"))])
+
+    def test_fixed_fields_are_skipped(self):
+        data = b"\x09" + b"\x00" * 8 + b"\x15" + b"\x00" * 4 + b"\x18\x05"
+        self.assertEqual(list(decode_fields(data)), [(3, 5)])
+
+    def test_truncated_and_unsupported(self):
+        with self.assertRaises(XrayApiError):
+            list(decode_fields(b"\x08\x80"))
+        with self.assertRaises(XrayApiError):
+            list(decode_fields(b"\x0b"))
+
+    def test_parse_query_stats_response(self):
+        data = stat("user>>>alice>>>traffic>>>uplink", 5 * 2 ** 32) + stat("user>>>alice>>>traffic>>>downlink", 0)
+        self.assertEqual(parse_query_stats_response(data), {
+            "user>>>alice>>>traffic>>>uplink": 5 * 2 ** 32,
+            "user>>>alice>>>traffic>>>downlink": 0,
+        })
+
+
+@unittest.skipIf(grpc is None, "нужна библиотека grpcio")
+class XrayApiClientTest(unittest.TestCase):
+    """Клиент против gRPC-сервера, принимающего и отдающего сырые байты"""
+
+    def setUp(self):
+        self.calls = []
+        self.stats = {"user>>>alice>>>traffic>>>uplink": 100}
+
+        def handler(method, respond):
+            def behavior(request, context):
+                self.calls.append((method, request))
+                return respond(request)
+            return grpc.unary_unary_rpc_method_handler(behavior)
+
+        def query_stats(request):
+            return b"".join(stat(name, value) for name, value in self.stats.items())
+
+        handlers = [
+            grpc.method_handlers_generic_handler(HANDLER_SERVICE, {
+                "AlterInbound": handler("AlterInbound", lambda request: b""),
+                "RemoveInbound": handler("RemoveInbound", lambda request: b""),
+            }),
+            grpc.method_handlers_generic_handler(STATS_SERVICE, {"QueryStats": handler("QueryStats", query_stats)}),
+        ]
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=2), handlers=handlers)
+        port = self.server.add_insecure_port("127.0.0.1:0")
+        self.server.start()
+        self.addCleanup(self.server.stop, None)
+        self.client = XrayApiClient(f"127.0.0.1:{port}")
+        self.addCleanup(self.client.close)
+
+    def test_add_and_remove_user(self):
+        self.client.add_user("vless-in", "alice", "uuid-1", "xtls-rprx-vision")
+        self.client.remove_user("vless-in", "alice")
+
+        (_, add_request), (_, remove_request) = self.calls
+        add = dict(decode_fields(add_request))
+        self.assertEqual(add[1], b"vless-in")
+        operation = dict(decode_fields(add[2]))
+        self.assertEqual(operation[1], b"xray.app.proxyman.command.AddUserOperation")
+        user = dict(decode_fields(dict(decode_fields(operation[2]))[1]))
+        self.assertEqual(user[2], b"alice")
+
+        remove = dict(decode_fields(remove_request))
+        operation = dict(decode_fields(remove[2]))
+        self.assertEqual(operation[1], b"xray.app.proxyman.command.RemoveUserOperation")
+        self.assertEqual(dict(decode_fields(operation[2])), {1: b"alice"})
+
+    def test_remove_inbound(self):
+        self.client.remove_inbound("vless-in-retiring")
+        self.assertEqual(self.calls, [("RemoveInbound", b"\x0a\x11vless-in-retiring")])
+
+    def test_query_stats(self):
+        self.assertEqual(self.client.query_stats("user>>>", reset=True), self.stats)
+        self.assertEqual(self.calls, [("QueryStats", query_stats_request("user>>>", reset=True))])
+
+    def test_unknown_method_is_api_error(self):
+        with self.assertRaises(XrayApiError):
+            self.client.call(HANDLER_SERVICE, "ListInbounds", b"")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Разбор строк логов Xray и фильтры команды logs"""
+
+import unittest
+
+from xray_logs import iter_lines, matches, parse_line
+
+ACCEPTED = "2024/05/01 10:00:00.123456 from 203.0.113.5:51234 accepted tcp:www.example.com:443 [vless-in -> direct] email: alice"
+# Строка отказа Xray: адрес назначения пуст, после rejected два пробела
+REJECTED = "2024/05/01 10:00:01 from 203.0.113.6:51235 rejected  proxy/vless/encoding: invalid request user id"
+ERROR = "2024/05/01 10:00:02 [Warning] core: Xray 1.8.4 started"
+
+
+class ParseLineTest(unittest.TestCase):
+    def test_accepted(self):
+        record = parse_line(ACCEPTED)
+        self.assertEqual(record["type"], "access")
+        self.assertEqual(record["status"], "accepted")
+        self.assertEqual(record["network"], "tcp")
+        self.assertEqual(record["destination"], "www.example.com:443")
+        self.assertEqual((record["inbound"], record["outbound"]), ("vless-in", "direct"))
+        self.assertEqual(record["email"], "alice")
+
+    def test_rejected(self):
+        record = parse_line(REJECTED)
+        self.assertEqual(record["type"], "access")
+        self.assertEqual(record["status"], "rejected")
+        self.assertEqual(record["source"], "203.0.113.6:51235")
+        self.assertEqual(record["level"], "info")
+        self.assertTrue(matches(record, level="info"))
+
+    def test_error(self):
+        record = parse_line(ERROR)
+        self.assertEqual(record["type"], "error")
+        self.assertEqual(record["level"], "warning")
+        self.assertTrue(matches(record, level="info"))
+        self.assertFalse(matches(record, level="error"))
+
+    def test_raw(self):
+        record = parse_line("not a log line")
+        self.assertEqual(record["type"], "raw")
+        self.assertFalse(matches(record, level="debug"))
+
+
+class IterLinesTest(unittest.TestCase):
+    def test_lines_split_across_chunks(self):
+        chunks = [("stdout", b"first\nsec"), ("stderr", b"err"), ("stdout", b"ond\n"), ("stderr", b"or\n")]
+        self.assertEqual(list(iter_lines(chunks)), [("stdout", "first"), ("stdout", "second"), ("stderr", "error")])
+
+    def test_long_line_is_split(self):
+        lines = list(iter_lines([("stdout", b"x" * 10)], max_length=4))
+        self.assertEqual([line for _, line in lines], ["xxxx", "xxxx", "xx"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,125 +2,198 @@
 # -*- coding: utf-8 -*-
 
 import json
-import os
-import qrcode
-import base64
-import tempfile
+import sys
 import urllib.parse
-import urllib.request
-from datetime import datetime
+
+from config_manager import RETIRING_EMAIL_SUFFIX, RETIRING_TAG, ROTATION_KEY
+from id_allocator import IdAllocator
+from qr_codes import RENDERERS, encode_config, qr_format
+from xray_api import XrayApiError
 
 class UserManager:
     """Класс для управления пользователями в конфигурации Xray"""
 
     def __init__(self, config_manager):
         self.config_manager = config_manager
+        self.id_allocator = IdAllocator(config_manager)
+        # Изменения пользователей, которые можно применить к запущенному Xray через API
+        self.pending_api_changes = []
+        # Кэш QR-кодов на диске (ArtifactCache), включается командами, которые строят QR-коды
+        self.artifact_cache = None
+        # Рендереры клиентских конфигураций по inbound: тег -> (параметры сервера, рендерер)
+        self._renderers = {}
+
+    def add_user(self, name, inbound=None):
+        """Добавление нового пользователя в конфигурацию
+
+        inbound - тег inbound пользователя (по умолчанию выбирается политикой распределения).
+        """
+        try:
+            user_id, created = self._add_user(name, inbound)
+        except ValueError as e:
+            print(f"Ошибка: {e}")
+            return None
+        if not created:
+            print(f"Пользователь с именем {name} уже существует")
+        return user_id
 
-    def add_user(self, name):
-        """Добавление нового пользователя в конфигурацию"""
+    def _add_user(self, name, inbound=None):
+        """Добавление пользователя, возвращает (user_id, создан ли пользователь)"""
         # Проверка, существует ли пользователь с таким именем
         existing_user = self.config_manager.get_client_by_name(name)
         if existing_user:
-            print(f"Пользователь с именем {name} уже существует")
-            return existing_user[0]  # Вернуть ID существующего пользователя
+            return existing_user[0], False  # Вернуть ID существующего пользователя
 
-        # Генерация UUID для нового пользователя
-        user_id = self.config_manager.generate_uuid()
+        # Inbound пользователя (None - основной) по политике распределения или явно заданный
+        tag = self.config_manager.select_inbound(name, inbound)
 
-        # Генерация short_id для пользователя
-        short_id = self.config_manager.generate_short_id()
+        # Выделение UUID и short_id, не пересекающихся с существующими
+        user_id = self.id_allocator.allocate_uuid()
+        short_id = self.id_allocator.allocate_short_id()
 
         # Добавление short_id в realitySettings
-        self.config_manager.add_client_short_id(short_id)
+        self.config_manager.add_client_short_id(short_id, tag)
 
         # Добавление пользователя в конфигурацию
-        clients = self.config_manager.get_clients()
         client_data = {
             "id": user_id,
-            "flow": "xtls-rprx-vision"
+            "flow": "xtls-rprx-vision",
+            "email": name  # По email пользователь адресуется в API и статистике Xray
         }
-        clients.append(client_data)
+        self.config_manager.add_client(client_data, tag)
+        self.pending_api_changes.append(("add", client_data, self.config_manager.get_inbound_tag(tag)))
 
         # Сохранение метаданных о пользователе вместе с short_id
-        self.config_manager.update_client(user_id, name, client_data, short_id)
+        self.config_manager.update_client(user_id, name, client_data, short_id, tag)
 
-        return user_id
+        return user_id, True
+
+    def add_users(self, names, inbound=None):
+        """Добавление пользователей пачкой, возвращает результат по каждому имени"""
+        results = []
+        for name in names:
+            try:
+                user_id, created = self._add_user(name, inbound)
+                results.append({"name": name, "status": "added" if created else "exists", "id": user_id})
+            except Exception as e:
+                results.append({"name": name, "status": "error", "error": str(e)})
+        return results
 
     def remove_user(self, name):
         """Удаление пользователя из конфигурации"""
-        # Поиск пользователя по имени
-        user_info = self.config_manager.get_client_by_name(name)
-        if not user_info:
+        if not self._remove_user(name):
             print(f"Пользователь с именем {name} не найден")
             return False
+        return True
 
-        user_id, _ = user_info
+    def _remove_user(self, name):
+        """Удаление пользователя, возвращает ID удаленного пользователя или None"""
+        # Поиск пользователя по имени
+        user_info = self.config_manager.get_client_by_name(name)
+        if not user_info:
+            return None
 
-        # Получение shortId пользователя из метаданных перед удалением
-        user_short_id = None
-        if "users" in self.config_manager.user_metadata:
-            if user_id in self.config_manager.user_metadata["users"]:
-                user_short_id = self.config_manager.user_metadata["users"][user_id].get("shortId")
+        user_id, user_data = user_info
+        user_short_id = user_data.get("shortId")
 
         # Удаление пользователя из списка клиентов
-        clients = self.config_manager.get_clients()
-        for i, client in enumerate(clients):
-            if client["id"] == user_id:
-                clients.pop(i)
-                break
+        self.config_manager.remove_client(user_id)
 
         # Удаление shortId из списка shortIds в конфигурации
         if user_short_id:
             self.config_manager.remove_client_short_id(user_short_id)
 
         # Удаление метаданных о пользователе
-        if "users" in self.config_manager.user_metadata:
-            if user_id in self.config_manager.user_metadata["users"]:
-                del self.config_manager.user_metadata["users"][user_id]
+        self.config_manager.remove_client_metadata(user_id)
+        inbound_tag = self.config_manager.get_inbound_tag(user_data.get("inbound"))
+        self.pending_api_changes.append(("remove", user_data.get("data", {}), inbound_tag))
 
-        return True
+        return user_id
+
+    def remove_users(self, names):
+        """Удаление пользователей пачкой, возвращает результат по каждому имени"""
+        results = []
+        for name in names:
+            try:
+                user_id = self._remove_user(name)
+                if user_id:
+                    results.append({"name": name, "status": "removed", "id": user_id})
+                else:
+                    results.append({"name": name, "status": "not_found"})
+            except Exception as e:
+                results.append({"name": name, "status": "error", "error": str(e)})
+        return results
+
+    def apply_hot_changes(self, api_client, changes=None):
+        """Применение накопленных изменений пользователей к запущенному Xray через HandlerService
+
+        Если changes не передан, применяются и сбрасываются изменения из pending_api_changes.
+        Изменение - (действие, данные клиента, тег inbound пользователя).
+        """
+        if changes is None:
+            changes, self.pending_api_changes = self.pending_api_changes, []
+        # Во время ротации пользователи, существовавшие до ее начала, удаляются и из inbound со старым ключом
+        retiring_ids = set()
+        if self.config_manager.get_retiring_inbound() is not None:
+            retiring_ids = set(self.config_manager.user_metadata.get(ROTATION_KEY, {}).get("users", []))
+        try:
+            for action, client_data, inbound_tag in changes:
+                email = client_data.get("email")
+                if not email:
+                    raise XrayApiError(f"у клиента {client_data.get('id')} нет email, изменение требует перезапуска")
+
+                if action == "add":
+                    api_client.add_user(inbound_tag, email, client_data["id"], client_data.get("flow", ""))
+                else:
+                    api_client.remove_user(inbound_tag, email)
+                    if client_data.get("id") in retiring_ids:
+                        api_client.remove_user(RETIRING_TAG, f"{email}{RETIRING_EMAIL_SUFFIX}")
+            return True
+        except XrayApiError as e:
+            print(f"Ошибка при применении изменений через API Xray: {e}")
+            return False
 
     def list_users(self):
         """Получение списка всех пользователей"""
         users = []
-        if "users" in self.config_manager.user_metadata:
-            for user_id, user_data in self.config_manager.user_metadata["users"].items():
-                users.append({
-                    "id": user_id,
-                    "name": user_data["name"]
-                })
+        for user_id, user_data in self.config_manager.iter_users():
+            users.append({
+                "id": user_id,
+                "name": user_data["name"],
+                "inbound": self.config_manager.get_inbound_tag(user_data.get("inbound"))
+            })
         return users
 
-    def get_external_ip(self):
-        """Определение внешнего IP-адреса сервера"""
-        try:
-            # Используем сервис ipify для определения внешнего IP-адреса
-            with urllib.request.urlopen('https://api.ipify.org') as response:
-                ip = response.read().decode('utf-8')
-                return ip
-        except Exception as e:
-            print(f"Ошибка при определении внешнего IP-адреса: {e}")
-            # Пробуем альтернативный сервис, если первый не сработал
-            try:
-                with urllib.request.urlopen('https://ifconfig.me/ip') as response:
-                    ip = response.read().decode('utf-8')
-                    return ip
-            except Exception as e:
-                print(f"Ошибка при определении внешнего IP-адреса: {e}")
-                return ""
-
-    def generate_client_config(self, name, server_address=""):
-        """Генерация конфигурации для клиента"""
+    def get_external_ip(self, refresh=False):
+        """Определение внешнего IP-адреса сервера (с кэшем, см. address_resolver.py)"""
+        from address_resolver import AddressResolver
+        return AddressResolver(self.config_manager).resolve(refresh)
+
+    def client_renderer(self, server_address="", inbound=None):
+        """Рендерер клиентских конфигураций (см. client_configs.py) для адреса сервера и inbound
+
+        Серверная часть шаблонов строится один раз на inbound; рендерер пересоздается, если
+        изменились адрес, порт, serverName, ключ или shortIds inbound.
+        """
+        from client_configs import ClientConfigRenderer
+
+        server = self.config_manager.get_server_info(inbound)
+        short_ids = server.get("shortIds") or [""]
+        key = (server_address, server.get("port"), server.get("serverName"), server.get("publicKey"), short_ids[0])
+        cached = self._renderers.get(inbound)
+        if cached is None or cached[0] != key:
+            cached = self._renderers[inbound] = (key, ClientConfigRenderer(self.config_manager, server_address, inbound))
+        return cached[1]
+
+    def render_client_config(self, name, server_address="", fmt="xray"):
+        """Конфигурация клиента в формате fmt (xray, sing-box, clash) строкой или None"""
         # Поиск пользователя по имени
         user_info = self.config_manager.get_client_by_name(name)
         if not user_info:
             print(f"Пользователь с именем {name} не найден")
             return None
 
-        user_id, user_data = user_info
-        server_info = self.config_manager.get_server_info()
-
-        if not server_info:
+        if not self.config_manager.user_metadata.get("server"):
             print("Ошибка: информация о сервере не найдена")
             return None
 
@@ -132,84 +205,19 @@ class UserManager:
             else:
                 print("Не удалось автоматически определить IP-адрес сервера. Конфигурация будет содержать пустое поле address.")
 
-        # Получаем shortId пользователя из метаданных
-        user_short_id = ""
-        if "users" in self.config_manager.user_metadata:
-            if user_id in self.config_manager.user_metadata["users"]:
-                user_short_id = self.config_manager.user_metadata["users"][user_id].get("shortId", "")
-
-        # Если shortId не найден, используем первый из списка (обратная совместимость)
-        if not user_short_id and "shortIds" in server_info and server_info["shortIds"]:
-            user_short_id = server_info["shortIds"][0]
+        user_id, user_data = user_info
+        return self.client_renderer(server_address, user_data.get("inbound")).render(user_id, user_data, fmt)
 
-        # Создание конфигурации для клиента
-        client_config = {
-            "log": {
-                "loglevel": "warning"
-            },
-            "routing": {
-                "rules": [
-                    {
-                        "ip": [
-                            "geoip:private"
-                        ],
-                        "outboundTag": "direct"
-                    }
-                ]
-            },
-            "inbounds": [
-                {
-                    "listen": "127.0.0.1",
-                    "port": 10808,
-                    "protocol": "socks"
-                },
-                {
-                    "listen": "127.0.0.1",
-                    "port": 10809,
-                    "protocol": "http"
-                }
-            ],
-            "outbounds": [
-                {
-                    "protocol": "vless",
-                    "settings": {
-                        "vnext": [
-                            {
-                                "address": server_address,  # Используем определенный IP-адрес сервера
-                                "port": server_info["port"],
-                                "users": [
-                                    {
-                                        "id": user_id,
-                                        "encryption": "none",
-                                        "flow": "xtls-rprx-vision"
-                                    }
-                                ]
-                            }
-                        ]
-                    },
-                    "streamSettings": {
-                        "network": "tcp",
-                        "security": "reality",
-                        "realitySettings": {
-                            "fingerprint": "chrome",
-                            "serverName": server_info["serverName"],
-                            "publicKey": server_info["publicKey"],
-                            "shortId": user_short_id
-                        }
-                    },
-                    "tag": "proxy"
-                },
-                {
-                    "protocol": "freedom",
-                    "tag": "direct"
-                }
-            ]
-        }
+    def generate_client_config(self, name, server_address=""):
+        """Генерация конфигурации для клиента Xray (словарь)"""
+        client_config = self.render_client_config(name, server_address)
+        return json.loads(client_config) if client_config else None
 
-        return client_config
+    def generate_vless_link(self, name, server_address="", server_name=None, remark=None):
+        """Генерация URI-ссылки VLESS для быстрой настройки клиента
 
-    def generate_vless_link(self, name, server_address=""):
-        """Генерация URI-ссылки VLESS для быстрой настройки клиента"""
+        server_name - SNI из serverNames (по умолчанию первое имя), remark - подпись ссылки (по умолчанию имя).
+        """
         # Поиск пользователя по имени
         user_info = self.config_manager.get_client_by_name(name)
         if not user_info:
@@ -217,7 +225,7 @@ class UserManager:
             return None
 
         user_id, user_data = user_info
-        server_info = self.config_manager.get_server_info()
+        server_info = self.config_manager.get_server_info(user_data.get("inbound"))
 
         if not server_info:
             print("Ошибка: информация о сервере не найдена")
@@ -246,7 +254,7 @@ class UserManager:
             "flow": "xtls-rprx-vision",
             "type": "tcp",
             "security": "reality",
-            "sni": server_info["serverName"],
+            "sni": server_name or server_info["serverName"],
             "pbk": server_info["publicKey"],
             "sid": user_short_id,
             "spx": "/",  # Путь по умолчанию
@@ -257,10 +265,34 @@ class UserManager:
         query_string = "&".join([f"{k}={urllib.parse.quote(v)}" for k, v in params.items()])
 
         # Формирование ссылки
-        vless_link = f"vless://{user_id}@{server_address}:{server_info['port']}?{query_string}#{urllib.parse.quote(name)}"
+        vless_link = f"vless://{user_id}@{server_address}:{server_info['port']}?{query_string}#{urllib.parse.quote(remark or name)}"
 
         return vless_link
 
+    def enable_artifact_cache(self, config_path):
+        """Включение кэша QR-кодов рядом с конфигурацией; при смене ключа сервера кэш очищается"""
+        from artifact_cache import ArtifactCache, get_artifacts_path
+        public_key = self.config_manager.get_server_info().get("publicKey", "")
+        self.artifact_cache = ArtifactCache(get_artifacts_path(config_path), public_key)
+
+    def render_qr(self, name, payload, kind="png", compact=False):
+        """QR-код строки payload пользователя name (PNG, SVG или текст) через кэш артефактов, если он включен"""
+        render = RENDERERS[kind]
+        if self.artifact_cache is None:
+            return render(payload, compact)
+        user_info = self.config_manager.get_client_by_name(name)
+        # Компактный QR-код того же содержимого строится с другой маской и хранится отдельно
+        cache_kind = f"compact.{kind}" if compact else kind
+        return self.artifact_cache.get_or_create(user_info[0], cache_kind, payload, lambda data: render(data, compact))
+
+    def _output_qr(self, name, payload, save_path, compact=False):
+        """Сохранение QR-кода в файл PNG или SVG (по расширению) или вывод в терминал"""
+        if save_path:
+            with open(save_path, 'wb') as f:
+                f.write(self.render_qr(name, payload, qr_format(save_path), compact))
+        else:
+            sys.stdout.write(self.render_qr(name, payload, "ascii", compact).decode('utf-8'))
+
     def generate_vless_qr(self, name, server_address="", save_path=None):
         """Генерация QR-кода на основе VLESS URI-ссылки"""
         # Получаем VLESS-ссылку
@@ -268,61 +300,43 @@ class UserManager:
         if not vless_link:
             return False
 
-        # Создание QR-кода
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(vless_link)
-        qr.make(fit=True)
-
-        # Обработка в зависимости от наличия save_path
         if save_path:
-            # Создание изображения QR-кода и сохранение в файл
-            img = qr.make_image(fill_color="black", back_color="white")
-            img.save(save_path)
+            self._output_qr(name, vless_link, save_path)
             print(f"QR-код с VLESS-ссылкой сохранен в {save_path}")
         else:
-            # Отображение QR-кода прямо в терминале
             print("\nQR-код для VLESS URI-ссылки:")
-            qr.print_ascii(invert=True)
+            self._output_qr(name, vless_link, None)
             print("\nVLESS URI-ссылка:")
             print(vless_link)
 
         return True
 
-    def generate_qr_code(self, name, save_path=None, server_address=""):
-        """Генерация QR-кода с конфигурацией для клиента"""
-        client_config = self.generate_client_config(name, server_address)
-        if not client_config:
-            return False
-
-        # Преобразование конфигурации в JSON-строку
-        config_json = json.dumps(client_config)
+    def generate_qr_code(self, name, save_path=None, server_address="", payload_mode="json"):
+        """Генерация QR-кода с конфигурацией для клиента
 
-        # Создание QR-кода
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(config_json)
-        qr.make(fit=True)
+        payload_mode - содержимое QR-кода: json, compact, deflate или link (см. qr_codes.py).
+        """
+        if payload_mode == "link":
+            payload = self.generate_vless_link(name, server_address)
+            if not payload:
+                return False
+            title, text = "VLESS URI-ссылка:", payload
+        else:
+            client_config = self.generate_client_config(name, server_address)
+            if not client_config:
+                return False
+            # Преобразование конфигурации в строку для QR-кода
+            payload = encode_config(client_config, payload_mode)
+            title, text = "Конфигурация для клиента (JSON):", json.dumps(client_config, indent=2)
+        compact = payload_mode != "json"
 
-        # Обработка в зависимости от наличия save_path
         if save_path:
-            # Создание изображения QR-кода и сохранение в файл
-            img = qr.make_image(fill_color="black", back_color="white")
-            img.save(save_path)
+            self._output_qr(name, payload, save_path, compact)
             print(f"QR-код с конфигурацией сохранен в {save_path}")
         else:
-            # Отображение QR-кода прямо в терминале
             print("\nQR-код для конфигурации клиента:")
-            qr.print_ascii(invert=True)
-            print("\nКонфигурация для клиента (JSON):")
-            print(json.dumps(client_config, indent=2))
+            self._output_qr(name, payload, None, compact)
+            print(f"\n{title}")
+            print(text)
 
         return True
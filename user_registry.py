@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+class UserRegistry:
+    """Индексы пользователей для поиска, добавления и удаления за O(1)
+
+    Поддерживает согласованными три индекса поверх конфигурации xray и метаданных:
+    имя -> ID, ID -> позиция клиента в `clients` и shortId -> ID (плюс позиция
+    shortId в `shortIds`). У каждого inbound пользователей свои `clients` и `shortIds`;
+    для элементов дополнительных inbound хранится еще и тег inbound, элементы основного
+    inbound индексируются только позицией. Удаление из списков выполняется перестановкой
+    удаляемого элемента с последним, поэтому порядок клиентов и shortIds не сохраняется.
+    """
+
+    def __init__(self, config_manager):
+        self.config_manager = config_manager
+        # ID пользователей, измененных и удаленных с момента последней пересборки или сохранения;
+        # словари используются как упорядоченные множества, чтобы новые пользователи
+        # записывались в хранилище метаданных в порядке добавления
+        self.changed_ids = {}
+        self.removed_ids = {}
+        self.rebuild()
+
+    def rebuild(self):
+        """Полная пересборка индексов по текущей конфигурации и метаданным"""
+        self._client_index = {}
+        self._short_id_index = {}
+        # Тег inbound для клиентов и shortId дополнительных inbound
+        self._client_inbound = {}
+        self._short_id_inbound = {}
+        for tag in self.config_manager.get_user_inbounds():
+            clients = self.config_manager.get_clients(tag)
+            short_ids = self._short_ids(tag)
+            self._client_index.update({client["id"]: i for i, client in enumerate(clients)})
+            self._short_id_index.update({short_id: i for i, short_id in enumerate(short_ids)})
+            if tag is not None:
+                self._client_inbound.update(dict.fromkeys((client["id"] for client in clients), tag))
+                self._short_id_inbound.update(dict.fromkeys(short_ids, tag))
+        self._name_to_id = {}
+        self._short_id_to_id = {}
+        # Имена, которые носят несколько пользователей (метаданные, созданные до проверки имен)
+        self._duplicate_names = set()
+        self.clear_changes()
+
+        for user_id, user_data in self._users().items():
+            # При дублирующихся именах побеждает первый пользователь, как при линейном поиске
+            if self._name_to_id.setdefault(user_data["name"], user_id) != user_id:
+                self._duplicate_names.add(user_data["name"])
+            if user_data.get("shortId"):
+                self._short_id_to_id[user_data["shortId"]] = user_id
+
+    def clear_changes(self):
+        """Сброс списков измененных и удаленных пользователей после сохранения"""
+        self.changed_ids = {}
+        self.removed_ids = {}
+
+    def _users(self):
+        """Словарь пользователей из метаданных"""
+        return self.config_manager.user_metadata.setdefault("users", {})
+
+    def _short_ids(self, tag=None):
+        """Список shortIds из realitySettings inbound tag"""
+        return self.config_manager.get_reality_settings(tag).setdefault("shortIds", [])
+
+    def __len__(self):
+        return len(self._users())
+
+    def get_by_name(self, name):
+        """Поиск пользователя по имени, возвращает (user_id, user_data) или None"""
+        user_id = self._name_to_id.get(name)
+        if user_id is None:
+            return None
+        return user_id, self._users()[user_id]
+
+    def get_id_by_short_id(self, short_id):
+        """Поиск ID пользователя по shortId"""
+        return self._short_id_to_id.get(short_id)
+
+    def has_id(self, user_id):
+        """Проверка, занят ли UUID клиентом или пользователем из метаданных"""
+        return user_id in self._client_index or user_id in self._users()
+
+    def has_short_id(self, short_id):
+        """Проверка, занят ли shortId"""
+        return short_id in self._short_id_index or short_id in self._short_id_to_id
+
+    def add_client(self, client_data, tag=None):
+        """Добавление клиента в `clients` inbound tag (существующий клиент заменяется на месте)"""
+        user_id = client_data["id"]
+        if user_id in self._client_index:
+            clients = self.config_manager.get_clients(self._client_inbound.get(user_id))
+            clients[self._client_index[user_id]] = client_data
+            return
+        clients = self.config_manager.get_clients(tag)
+        self._client_index[user_id] = len(clients)
+        clients.append(client_data)
+        if tag is not None:
+            self._client_inbound[user_id] = tag
+
+    def remove_client(self, user_id):
+        """Удаление клиента из `clients` его inbound перестановкой с последним элементом"""
+        index = self._client_index.pop(user_id, None)
+        if index is None:
+            return False
+
+        clients = self.config_manager.get_clients(self._client_inbound.pop(user_id, None))
+        last = clients.pop()
+        if index < len(clients):
+            clients[index] = last
+            self._client_index[last["id"]] = index
+        return True
+
+    def add_short_id(self, short_id, tag=None):
+        """Добавление shortId в `shortIds` inbound tag, если его еще нет"""
+        if short_id in self._short_id_index:
+            return
+        short_ids = self._short_ids(tag)
+        self._short_id_index[short_id] = len(short_ids)
+        short_ids.append(short_id)
+        if tag is not None:
+            self._short_id_inbound[short_id] = tag
+
+    def remove_short_id(self, short_id):
+        """Удаление shortId из `shortIds` его inbound перестановкой с последним элементом"""
+        index = self._short_id_index.pop(short_id, None)
+        if index is None:
+            return False
+
+        short_ids = self._short_ids(self._short_id_inbound.pop(short_id, None))
+        last = short_ids.pop()
+        if index < len(short_ids):
+            short_ids[index] = last
+            self._short_id_index[last] = index
+        return True
+
+    def set_user(self, user_id, user_data):
+        """Добавление или обновление пользователя в метаданных"""
+        users = self._users()
+        previous = users.get(user_id)
+        if previous:
+            self._unindex_user(user_id, previous, keep_name=previous["name"] == user_data["name"])
+
+        users[user_id] = user_data
+        self.changed_ids[user_id] = None
+        self.removed_ids.pop(user_id, None)
+        if self._name_to_id.setdefault(user_data["name"], user_id) != user_id:
+            self._duplicate_names.add(user_data["name"])
+        if user_data.get("shortId"):
+            self._short_id_to_id[user_data["shortId"]] = user_id
+
+    def remove_user(self, user_id):
+        """Удаление пользователя из метаданных, возвращает его данные или None"""
+        user_data = self._users().pop(user_id, None)
+        if user_data:
+            self._unindex_user(user_id, user_data)
+            self.changed_ids.pop(user_id, None)
+            self.removed_ids[user_id] = None
+        return user_data
+
+    def _unindex_user(self, user_id, user_data, keep_name=False):
+        """Удаление пользователя из индексов имени и shortId"""
+        name = user_data["name"]
+        if not keep_name and self._name_to_id.get(name) == user_id:
+            del self._name_to_id[name]
+            if name in self._duplicate_names:
+                self._reindex_name(name, user_id)
+        if self._short_id_to_id.get(user_data.get("shortId")) == user_id:
+            del self._short_id_to_id[user_data["shortId"]]
+
+    def _reindex_name(self, name, removed_id):
+        """Имя переходит к следующему пользователю с тем же именем (первому, как при линейном поиске)
+
+        Перебор пользователей выполняется только для имен, которые носят несколько пользователей.
+        """
+        remaining = [user_id for user_id, user_data in self._users().items()
+                     if user_data["name"] == name and user_id != removed_id]
+        if remaining:
+            self._name_to_id[name] = remaining[0]
+        if len(remaining) < 2:
+            self._duplicate_names.discard(name)
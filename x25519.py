@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Генерация ключей X25519 (RFC 7748) для REALITY без внешних зависимостей"""
+
+import base64
+import os
+
+# Параметры кривой Curve25519
+_P = 2 ** 255 - 19
+_A24 = 121665
+_BASE_POINT = 9
+
+
+def _x25519(scalar, u):
+    """Умножение точки на скаляр лестницей Монтгомери"""
+    x_1 = u
+    x_2, z_2 = 1, 0
+    x_3, z_3 = u, 1
+    swap = 0
+
+    for t in reversed(range(255)):
+        k_t = (scalar >> t) & 1
+        swap ^= k_t
+        if swap:
+            x_2, x_3 = x_3, x_2
+            z_2, z_3 = z_3, z_2
+        swap = k_t
+
+        a = (x_2 + z_2) % _P
+        aa = a * a % _P
+        b = (x_2 - z_2) % _P
+        bb = b * b % _P
+        e = (aa - bb) % _P
+        c = (x_3 + z_3) % _P
+        d = (x_3 - z_3) % _P
+        da = d * a % _P
+        cb = c * b % _P
+        x_3 = (da + cb) % _P
+        x_3 = x_3 * x_3 % _P
+        z_3 = (da - cb) % _P
+        z_3 = x_1 * (z_3 * z_3 % _P) % _P
+        x_2 = aa * bb % _P
+        z_2 = e * (aa + _A24 * e) % _P
+
+    if swap:
+        x_2, x_3 = x_3, x_2
+        z_2, z_3 = z_3, z_2
+
+    return x_2 * pow(z_2, _P - 2, _P) % _P
+
+
+def encode_key(key_bytes):
+    """Кодирование ключа в формате xray (base64 URL-safe без padding)"""
+    return base64.urlsafe_b64encode(key_bytes).decode("ascii").rstrip("=")
+
+
+def decode_key(key):
+    """Декодирование ключа из формата xray"""
+    return base64.urlsafe_b64decode(key + "=" * (-len(key) % 4))
+
+
+def clamp_private_key(private_bytes):
+    """Приведение приватного ключа к виду, который использует xray"""
+    k = bytearray(private_bytes)
+    k[0] &= 248
+    k[31] &= 127
+    k[31] |= 64
+    return bytes(k)
+
+
+def public_key_from_private(private_bytes):
+    """Вычисление публичного ключа по приватному"""
+    if len(private_bytes) != 32:
+        raise ValueError("Приватный ключ X25519 должен быть длиной 32 байта")
+    public = _x25519(int.from_bytes(clamp_private_key(private_bytes), "little"), _BASE_POINT)
+    return public.to_bytes(32, "little")
+
+
+def generate_keypair():
+    """Генерация пары ключей X25519 в формате вывода `xray x25519`"""
+    private_bytes = clamp_private_key(os.urandom(32))
+    public_bytes = public_key_from_private(private_bytes)
+    return encode_key(private_bytes), encode_key(public_bytes)
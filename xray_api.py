@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Клиент gRPC API Xray (HandlerService, StatsService) без сгенерированных protobuf-модулей
+
+Сообщения кодируются и разбираются вручную в wire-формате protobuf, транспорт -
+библиотека grpcio, которая импортируется только при первом обращении к API.
+"""
+
+DEFAULT_API_PORT = 10085
+HANDLER_SERVICE = "xray.app.proxyman.command.HandlerService"
+STATS_SERVICE = "xray.app.stats.command.StatsService"
+
+
+class XrayApiError(Exception):
+    """Ошибка обращения к API Xray"""
+
+
+def _varint(value):
+    """Кодирование целого числа в varint"""
+    result = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            result.append(byte | 0x80)
+        else:
+            result.append(byte)
+            return bytes(result)
+
+
+def _field_varint(number, value):
+    """Поле protobuf с типом varint"""
+    if not value:
+        return b""
+    return _varint(number << 3) + _varint(value)
+
+
+def _field_bytes(number, value):
+    """Поле protobuf с типом length-delimited (строка, байты, вложенное сообщение)"""
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    if not value:
+        return b""
+    return _varint((number << 3) | 2) + _varint(len(value)) + value
+
+
+def _read_varint(data, pos):
+    """Чтение varint из data с позиции pos, возвращает (значение, новая позиция)"""
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise XrayApiError("Обрезанное сообщение protobuf")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def decode_fields(data):
+    """Разбор сообщения protobuf: генератор (номер поля, значение)
+
+    Для varint значение - целое число, для length-delimited - байты;
+    поля fixed32/fixed64 пропускаются (в используемых ответах их нет).
+    """
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+            yield number, value
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            yield number, data[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == 5:
+            pos += 4
+        else:
+            raise XrayApiError(f"Неподдерживаемый тип поля protobuf: {wire_type}")
+
+
+def typed_message(type_name, value):
+    """Сообщение xray.common.serial.TypedMessage"""
+    return _field_bytes(1, type_name) + _field_bytes(2, value)
+
+
+def vless_user(email, user_id, flow="", level=0):
+    """Сообщение xray.common.protocol.User с аккаунтом VLESS"""
+    account = _field_bytes(1, user_id) + _field_bytes(2, flow) + _field_bytes(3, "none")
+    return (
+        _field_varint(1, level)
+        + _field_bytes(2, email)
+        + _field_bytes(3, typed_message("xray.proxy.vless.Account", account))
+    )
+
+
+def alter_inbound_request(tag, operation_type, operation):
+    """Сообщение xray.app.proxyman.command.AlterInboundRequest"""
+    return _field_bytes(1, tag) + _field_bytes(2, typed_message(operation_type, operation))
+
+
+def query_stats_request(pattern, reset=False):
+    """Сообщение xray.app.stats.command.QueryStatsRequest"""
+    return _field_bytes(1, pattern) + _field_varint(2, int(reset))
+
+
+def parse_query_stats_response(data):
+    """Разбор QueryStatsResponse: {имя счетчика: значение}"""
+    stats = {}
+    for number, stat in decode_fields(data):
+        if number != 1:
+            continue
+        name, value = "", 0
+        for field, field_value in decode_fields(stat):
+            if field == 1:
+                name = field_value.decode("utf-8")
+            elif field == 2:
+                value = field_value
+        stats[name] = value
+    return stats
+
+
+class XrayApiClient:
+    """Клиент API запущенного Xray"""
+
+    def __init__(self, address=f"127.0.0.1:{DEFAULT_API_PORT}", timeout=5):
+        self.address = address
+        self.timeout = timeout
+        self._channel = None
+
+    def _get_channel(self):
+        """Ленивое создание gRPC-канала"""
+        if self._channel is None:
+            try:
+                import grpc
+            except ImportError:
+                raise XrayApiError("Для работы с API Xray требуется библиотека grpcio (pip install grpcio)")
+            self._channel = grpc.insecure_channel(self.address)
+        return self._channel
+
+    def call(self, service, method, request):
+        """Унарный вызов метода API с уже закодированным запросом, возвращает байты ответа"""
+        import grpc
+
+        # Без сериализаторов grpcio передает байты как есть
+        stub = self._get_channel().unary_unary(f"/{service}/{method}")
+        try:
+            return stub(request, timeout=self.timeout)
+        except grpc.RpcError as e:
+            raise XrayApiError(f"{service}/{method}: {e.code().name}: {e.details()}")
+
+    def add_user(self, inbound_tag, email, user_id, flow="", level=0):
+        """Добавление пользователя VLESS в inbound без перезапуска"""
+        operation = _field_bytes(1, vless_user(email, user_id, flow, level))
+        request = alter_inbound_request(inbound_tag, "xray.app.proxyman.command.AddUserOperation", operation)
+        self.call(HANDLER_SERVICE, "AlterInbound", request)
+
+    def remove_user(self, inbound_tag, email):
+        """Удаление пользователя из inbound без перезапуска"""
+        operation = _field_bytes(1, email)
+        request = alter_inbound_request(inbound_tag, "xray.app.proxyman.command.RemoveUserOperation", operation)
+        self.call(HANDLER_SERVICE, "AlterInbound", request)
+
+    def remove_inbound(self, tag):
+        """Удаление inbound из запущенного Xray (RemoveInboundRequest) без перезапуска"""
+        self.call(HANDLER_SERVICE, "RemoveInbound", _field_bytes(1, tag))
+
+    def query_stats(self, pattern="", reset=False):
+        """Все счетчики, имя которых содержит pattern, одним запросом; с reset счетчики обнуляются"""
+        response = self.call(STATS_SERVICE, "QueryStats", query_stats_request(pattern, reset))
+        return parse_query_stats_response(response)
+
+    def close(self):
+        """Закрытие gRPC-канала"""
+        if self._channel is not None:
+            self._channel.close()
+            self._channel = None
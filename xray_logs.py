@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Построчное чтение и разбор логов Xray
+
+Строки собираются из потока блоков байтов с ограниченным буфером, поэтому память
+не зависит от объема логов. Строки access-лога разбираются в записи с email
+пользователя, адресом назначения и маршрутом (inbound -> outbound), строки
+error-лога - в записи с уровнем и сообщением.
+"""
+
+import re
+
+LEVELS = {"debug": 0, "info": 1, "warning": 2, "error": 3}
+MAX_LINE_LENGTH = 64 * 1024
+
+_TIME = r"(?P<time>\d{4}/\d\d/\d\d \d\d:\d\d:\d\d(?:\.\d+)?)"
+# У отклоненного подключения адрес назначения пуст: после rejected идут два пробела
+ACCESS_RE = re.compile(
+    _TIME + r" (?:from )?(?P<source>\S+) (?P<status>accepted|rejected) +"
+    r"(?:(?P<network>tcp|udp):)?(?P<destination>\S+)"
+    r"(?: \[(?P<inbound>[^\]\s]+) (?:->|>>) (?P<outbound>[^\]\s]+)\])?"
+    r"(?: email: (?P<email>\S+))?"
+)
+ERROR_RE = re.compile(_TIME + r" \[(?P<level>Debug|Info|Warning|Error)\] (?P<message>.*)")
+
+
+def iter_lines(chunks, max_length=MAX_LINE_LENGTH):
+    """Сборка строк из блоков (stream, bytes): генератор (stream, строка)
+
+    Незавершенная строка хранится отдельно для каждого потока; строки длиннее
+    max_length выдаются частями.
+    """
+    buffers = {}
+    for stream, data in chunks:
+        buffer = buffers.get(stream, b"") + data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield stream, line.decode('utf-8', 'replace').rstrip("\r")
+        while len(buffer) > max_length:
+            yield stream, buffer[:max_length].decode('utf-8', 'replace')
+            buffer = buffer[max_length:]
+        buffers[stream] = buffer
+
+    for stream, buffer in buffers.items():
+        if buffer:
+            yield stream, buffer.decode('utf-8', 'replace').rstrip("\r")
+
+
+def read_chunks(stream, size=65536):
+    """Блоки ("stdout", bytes) из файлового объекта до EOF"""
+    while True:
+        data = stream.read1(size)
+        if not data:
+            return
+        yield "stdout", data
+
+
+def parse_line(line):
+    """Разбор строки лога Xray в запись
+
+    type: "access" (уровень info), "error" или "raw" для нераспознанных строк.
+    """
+    match = ACCESS_RE.match(line)
+    if match:
+        record = match.groupdict()
+        record["type"] = "access"
+        record["level"] = "info"
+        return record
+
+    match = ERROR_RE.match(line)
+    if match:
+        record = match.groupdict()
+        record["type"] = "error"
+        record["level"] = record["level"].lower()
+        return record
+
+    return {"type": "raw", "level": None, "message": line}
+
+
+def matches(record, level=None, user=None):
+    """Проверка записи фильтрами: минимальный уровень и email пользователя"""
+    if user is not None and record.get("email") != user:
+        return False
+    if level is not None:
+        record_level = record.get("level")
+        if record_level is None or LEVELS[record_level] < LEVELS[level]:
+            return False
+    return True